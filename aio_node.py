@@ -0,0 +1,385 @@
+"""
+基于asyncio的节点运行时，作为Flask开发服务器的替代
+
+- HTTP前端由asyncio驱动，连接的读写不占用线程，请求交给有界线程池中的
+  WSGI应用（即同一个api Blueprint）处理；长时间等待的事件订阅使用单独的有界线程池，
+  不占用处理普通请求的线程
+- 节点间的广播和链拉取使用异步HTTP并发完成
+- 定时出块由事件循环中的任务驱动，取代每个dns_layer的sleep线程
+- 工作量证明和链验证在进程池中执行，不阻塞事件循环
+"""
+
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import unquote, urlencode, urlsplit
+
+import blockchain as bc
+import chainsync
+import changefeed
+import dns
+
+logger = logging.getLogger(__name__)
+
+# 单个请求头的最大字节数
+MAX_HEADER_BYTES = 64 * 1024
+# 请求体的最大字节数
+MAX_BODY_BYTES = 16 * 1024 * 1024
+# 节点间请求的超时时间（秒）
+PEER_TIMEOUT = 5
+# 空闲keep-alive连接的超时时间（秒）
+KEEPALIVE_TIMEOUT = 75
+# 事件订阅的路径，在订阅线程池中处理
+FEED_PATHS = ('/events', '/events/stream')
+# 订阅线程池在订阅者上限之外多留的线程，用于快速拒绝超出上限的订阅
+FEED_SPARE_WORKERS = 4
+
+REASONS = {
+    400: 'Bad Request',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    431: 'Request Header Fields Too Large',
+}
+
+
+class PeerError(Exception):
+    pass
+
+
+class _HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+async def fetch_json(url, timeout=PEER_TIMEOUT, peers=None):
+    """
+    异步GET请求另一个节点并解析JSON响应
+
+    :param url: 完整的URL，例如 http://host:port/nodes/chain?type=dns
+    :param timeout: 超时时间（秒）
+    :param peers: 可选的PeerTable，记录这次请求的延迟与成败（5xx响应计为失败）
+    :return: 元组 (status, data)
+    """
+    parts = urlsplit(url)
+    host = parts.hostname
+    port = parts.port or 80
+    target = parts.path or '/'
+    if parts.query:
+        target += '?' + parts.query
+
+    async def _fetch():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(
+                f'GET {target} HTTP/1.0\r\nHost: {parts.netloc}\r\n'
+                f'Accept: application/json\r\nConnection: close\r\n\r\n'.encode('latin-1')
+            )
+            await writer.drain()
+            raw = await reader.read()
+        finally:
+            writer.close()
+        head, _, body = raw.partition(b'\r\n\r\n')
+        status_line = head.split(b'\r\n', 1)[0].split()
+        if len(status_line) < 2:
+            raise PeerError(f'无效的响应: {url}')
+        status = int(status_line[1])
+        return status, json.loads(body) if body else None
+
+    start = time.perf_counter()
+    try:
+        status, data = await asyncio.wait_for(_fetch(), timeout)
+    except (OSError, ValueError, asyncio.TimeoutError) as e:
+        bc.PEER_ERRORS.labels(parts.netloc, parts.path).inc()
+        if peers is not None:
+            peers.record_failure(parts.netloc)
+        raise PeerError(f'请求 {url} 失败: {e}') from e
+    finally:
+        elapsed = time.perf_counter() - start
+        bc.PEER_REQUEST_SECONDS.labels(parts.netloc, parts.path).observe(elapsed)
+    if peers is not None:
+        if status >= 500:
+            peers.record_failure(parts.netloc)
+        else:
+            peers.record_success(parts.netloc, elapsed)
+    return status, data
+
+
+class AsyncNode(object):
+    def __init__(self, wsgi_workers=32, cpu_workers=None, flush_interval=None):
+        """
+        :param wsgi_workers: 执行WSGI应用的线程池大小（与连接数无关）
+        :param cpu_workers: 执行PoW与链验证的进程数，默认为CPU核数
+        :param flush_interval: 定时出块间隔（秒），默认为dns.FLUSH_INTERVAL
+        """
+        self.wsgi_pool = ThreadPoolExecutor(max_workers=wsgi_workers, thread_name_prefix='wsgi')
+        self.feed_pool = ThreadPoolExecutor(max_workers=changefeed.MAX_SUBSCRIBERS + FEED_SPARE_WORKERS,
+                                            thread_name_prefix='feed')
+        self.cpu_pool = ProcessPoolExecutor(
+            max_workers=cpu_workers, mp_context=multiprocessing.get_context('spawn')
+        )
+        self.flush_interval = flush_interval or dns.FLUSH_INTERVAL
+        self.loop = None
+        self.layers = {}
+        self.app = None
+        self._server = None
+
+    def install(self):
+        """
+        将本运行时注册为dns层和区块链的执行后端，必须在导入api之前调用
+        """
+        dns.node_runtime = self
+        bc.pow_executor = self.cpu_pool
+
+    def attach(self, layer):
+        """
+        由dns_layer在构造时调用，定时出块作用于每个分片最近创建的dns_layer
+        """
+        self.layers[layer.shard] = layer
+
+    # ---- 可从任意线程调用的入口 ----
+
+    def _submit(self, coro):
+        if self.loop is None or self.loop.is_closed():
+            coro.close()
+            return None
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def broadcast(self, layer, blockchain_type='both'):
+        """
+        异步通知所有邻居节点解决冲突，立即返回
+        """
+        self._submit(self._broadcast(layer, blockchain_type))
+
+    def resolve(self, blockchain):
+        """
+        异步执行共识算法，立即返回
+        """
+        self._submit(self.resolve_conflicts(blockchain))
+
+    # ---- 协程 ----
+
+    async def _broadcast(self, layer, blockchain_type):
+        # 只通知随机选出的一部分邻居，熔断中的邻居不参与
+        calls = []
+        for blockchain in layer._chains(blockchain_type):
+            query = urlencode(blockchain.peer_params())
+            calls += [fetch_json(f'http://{node}/nodes/resolve?{query}', peers=blockchain.nodes)
+                         for node in blockchain.nodes.gossip_targets()]
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("广播失败: %s", result)
+
+    async def resolve_conflicts(self, blockchain):
+        """
+        在线程池中执行先区块头、后并行下载区块体的链同步（见chainsync），不阻塞事件循环；
+        下载的区块在进程池中验证（见chainsync._valid_chain）
+
+        :return: 如果我们的链被替换则为True，否则为False
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, chainsync.HeaderSync(blockchain).run)
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # 各分片并行出块
+            flushes = [loop.run_in_executor(self.wsgi_pool, self._flush, layer) for layer in list(self.layers.values())]
+            await asyncio.gather(*flushes)
+
+    @staticmethod
+    def _flush(layer):
+        try:
+            layer.flush_tmp_domains()
+            layer.flush_tmp_register()
+        except Exception as e:
+            logger.exception("定时出块失败: %s", e)
+
+    # ---- HTTP前端 ----
+
+    async def _read_request(self, reader):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+        except asyncio.LimitOverrunError:
+            raise _HTTPError(431)
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            raise _HTTPError(400)
+        headers = []
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise _HTTPError(400)
+            headers.append((name.strip(), value.strip()))
+
+        header_map = {k.lower(): v for k, v in headers}
+        if 'chunked' in header_map.get('transfer-encoding', '').lower():
+            raise _HTTPError(411)
+        try:
+            length = int(header_map.get('content-length') or 0)
+        except ValueError:
+            raise _HTTPError(400)
+        if length > MAX_BODY_BYTES:
+            raise _HTTPError(413)
+        body = await reader.readexactly(length) if length else b''
+        return method, target, version, headers, header_map, body
+
+    def _environ(self, method, target, version, headers, body, peer):
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote(path, encoding='latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0] if peer else '',
+            'REMOTE_PORT': str(peer[1]) if peer else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers:
+            key = name.upper().replace('-', '_')
+            if key == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif key == 'CONTENT_LENGTH':
+                environ['CONTENT_LENGTH'] = value
+            else:
+                key = 'HTTP_' + key
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def _call_app(self, environ):
+        """
+        在线程池中运行WSGI应用，返回状态、响应头和响应体迭代器
+        """
+        response = {}
+        written = []
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            return written.append
+
+        result = self.app(environ, start_response)
+        return response['status'], response['headers'], written, result
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info('peername')
+        try:
+            while True:
+                try:
+                    method, target, version, headers, header_map, body = await self._read_request(reader)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    return
+                except _HTTPError as e:
+                    await self._write_error(writer, e.status)
+                    return
+
+                environ = self._environ(method, target, version, headers, body, peer)
+                pool = self.feed_pool if environ['PATH_INFO'] in FEED_PATHS else self.wsgi_pool
+                status, resp_headers, written, result = await loop.run_in_executor(
+                    pool, self._call_app, environ
+                )
+                keep_alive = (
+                    version == 'HTTP/1.1' and header_map.get('connection', '').lower() != 'close'
+                ) or header_map.get('connection', '').lower() == 'keep-alive'
+                await self._write_response(writer, pool, version, method, status, resp_headers, written, result,
+                                           keep_alive)
+                if not keep_alive:
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _write_error(self, writer, status):
+        body = REASONS[status].encode()
+        writer.write(
+            f'HTTP/1.1 {status} {REASONS[status]}\r\nContent-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode('latin-1') + body
+        )
+        await writer.drain()
+
+    async def _write_response(self, writer, pool, version, method, status, headers, written, result, keep_alive):
+        loop = asyncio.get_running_loop()
+        names = {k.lower() for k, _ in headers}
+        # 1xx、204、304与HEAD请求的响应没有消息体，也不能带分块编码的结束块
+        code = int(status.split(None, 1)[0])
+        bodiless = method == 'HEAD' or code < 200 or code in (204, 304)
+        # 没有Content-Length的响应（如流式响应）在HTTP/1.1下使用分块编码，
+        # HTTP/1.0下以关闭连接作为结束
+        chunked = not bodiless and 'content-length' not in names and version == 'HTTP/1.1'
+        if not bodiless and 'content-length' not in names and not chunked:
+            keep_alive = False
+        head = [f'HTTP/1.1 {status}']
+        head += [f'{k}: {v}' for k, v in headers]
+        if chunked:
+            head.append('Transfer-Encoding: chunked')
+        head.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+
+        def send(data):
+            if not data or bodiless:
+                return
+            writer.write(b'%x\r\n%s\r\n' % (len(data), data) if chunked else data)
+
+        for data in written:
+            send(data)
+        iterator = iter(result)
+        try:
+            while True:
+                # 逐块从线程池中取出，流式响应不会阻塞事件循环
+                data = await loop.run_in_executor(pool, next, iterator, None)
+                if data is None:
+                    break
+                send(data)
+                await writer.drain()
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(pool, result.close)
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    async def serve(self, app, host='0.0.0.0', port=5000):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_HEADER_BYTES, backlog=1024)
+        flush = asyncio.create_task(self._flush_loop())
+        logger.info("异步节点运行在 http://%s:%d", host, port)
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            flush.cancel()
+
+    def run(self, app, host='0.0.0.0', port=5000):
+        try:
+            asyncio.run(self.serve(app, host, port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.wsgi_pool.shutdown(wait=False)
+            self.feed_pool.shutdown(wait=False)
+            self.cpu_pool.shutdown(wait=False)
@@ -1,24 +1,115 @@
 from configparser import NoSectionError
-from flask import Blueprint, jsonify, request, session
+from flask import Blueprint, Response, g, jsonify, request, session
+import hashlib
 import json
+import logging
 import os
+import changefeed
 import dns
+import metrics
+import profiler
+import tracing
 import threading
 import time as _time
 import atexit
 from blockwallet import Wallet
+from blockstore import BlockStore
+from cache import TTLCache
+from follower import parse_upstreams
+from shards import SHARD_COUNT, shard_file
+from signing import SignatureError
 from functools import wraps
 from login import user_manager, login_required
+from replication import watermark_path
 # Blueprint for API endpoints
 api = Blueprint('api', __name__)
+logger = logging.getLogger(__name__)
+
+HTTP_REQUEST_SECONDS = metrics.Histogram('dns_http_request_seconds', 'HTTP请求处理耗时（秒）',
+                                         ['endpoint', 'method', 'status'])
+RESPONSE_CACHE = metrics.Counter('dns_response_cache_total',
+                                 '条件请求：not_modified返回304，hit复用缓存的响应体，miss重新序列化', ['result'])
+_NOT_MODIFIED, _RESPONSE_HIT, _RESPONSE_MISS = (RESPONSE_CACHE.labels(r) for r in ('not_modified', 'hit', 'miss'))
+
+# 进程角色（见workers.py）：standalone为单进程节点；writer负责出块和持久化；
+# reader只从共享的链文件提供读请求，其余请求转发给writer；
+# follower为不需要钱包的只读跟随节点，从DNS_FOLLOW中的上游节点同步区块（见follower.py）
+NODE_ROLE = os.environ.get('DNS_NODE_ROLE', 'standalone')
+WRITER_URL = os.environ.get('DNS_WRITER_URL', '')
+FOLLOW_UPSTREAMS = parse_upstreams(os.environ.get('DNS_FOLLOW', ''))
+# reader进程在本地处理的只读端点
+READ_ENDPOINTS = {
+    'api.check_alive',
+    'api.dns_lookup',
+    'api.dump_chain',
+    'api.explorer_blocks',
+    'api.explorer_block',
+    'api.explorer_transactions',
+    'api.get_chain_quota',
+    'api.get_wallet_info',
+    'api.metrics_endpoint',
+    'api.chain_tip',
+    'api.chain_headers',
+    'api.chain_blocks',
+    'api.hostname_proof',
+}
+# 跟随节点提供的端点：只读端点、事件订阅与快照，其余请求应发给上游节点
+FOLLOWER_ENDPOINTS = READ_ENDPOINTS | {
+    'api.poll_events',
+    'api.stream_events',
+    'api.export_snapshot',
+    'api.list_peers',
+}
+# 按版本缓存的序列化响应个数及其存活时间（秒）；版本变化时缓存的响应体不再使用
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 600
+# 批量查询一次最多的主机名数
+MAX_BATCH_SIZE = 1000
+# 超过该数量的批量查询以流式响应返回
+STREAM_BATCH_SIZE = 100
+# 长轮询默认和最长的等待时间（秒），不超过转发给writer时的读超时
+EVENTS_WAIT = 25
+MAX_EVENTS_WAIT = 55
+# 事件流没有事件时发送心跳注释的间隔（秒）
+SSE_HEARTBEAT = 15
+# 订阅者已达上限时建议客户端重试前等待的秒数
+SUBSCRIBER_RETRY = 5
 
 # 创建默认钱包作为节点标识符
 default_wallet = None
 wallet_address = None
+# 0号分片的dns_layer，也用于不区分分片的请求；各分片见shards（ShardRouter）
 dns_resolver = None
+shards = None
 wallet_status = False
 init_balance = 10
 # 初始化函数，检查是否有已保存的钱包数据
+def open_dns_layers(node_identifier, **kwargs):
+    """
+    打开DNS_SHARDS个分片的dns_layer（见shards.py）
+
+    :param kwargs: 传给dns_layer的参数
+    :return: 0号分片的dns_layer
+    """
+    global shards
+    # 新建、导入钱包时重新打开：先停止旧分片的定时出块与跨链复制，避免新旧两组线程同时出块
+    for layer in all_layers() if dns_resolver is not None else ():
+        layer.stop()
+    shards = dns.open_shards(node_identifier, SHARD_COUNT, **kwargs)
+    return shards.layer(0)
+
+def all_layers():
+    """
+    :return: 全部分片的dns_layer；没有经open_dns_layers打开时只有dns_resolver
+    """
+    return list(shards) if shards is not None else [dns_resolver]
+
+def shard_layer():
+    """
+    :return: 按链的请求由shard参数选中的分片（见select_shard），默认为0号分片
+    """
+    return g.get('shard_layer') or dns_resolver
+
 def init_wallet_from_storage():
     global default_wallet, wallet_address, dns_resolver
     try:
@@ -37,15 +128,19 @@ def init_wallet_from_storage():
                     last_wallet = wallet_list[-1]
                     wallet_address = last_wallet.get('address')
                     if wallet_address:
-                        dns_resolver = dns.dns_layer(node_identifier=wallet_address)
-                        print(f"已从存储中恢复钱包: {wallet_address}")
+                        dns_resolver = open_dns_layers(wallet_address, read_only=(NODE_ROLE == 'reader'))
+                        logger.info("已从存储中恢复钱包: %s", wallet_address)
                         return True
     except Exception as e:
-        print(f"加载钱包数据失败: {str(e)}")
+        logger.error("加载钱包数据失败: %s", e)
     return False
 
-# 尝试从存储中初始化钱包
-init_wallet_from_storage()
+if NODE_ROLE == 'follower':
+    # 跟随节点不需要钱包
+    dns_resolver = open_dns_layers('', follow=FOLLOW_UPSTREAMS)
+else:
+    # 尝试从存储中初始化钱包
+    init_wallet_from_storage()
 
 # 检测是否存在默认钱包
 def require_wallet_registered(func):
@@ -55,10 +150,113 @@ def require_wallet_registered(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         global wallet_address, dns_resolver
-        if wallet_address is None or dns_resolver is None:
+        if dns_resolver is None or (wallet_address is None and NODE_ROLE != 'follower'):
             return jsonify({'error': '系统钱包未注册，请先注册钱包'}), 403
         return func(*args, **kwargs)
     return wrapper
+@api.before_request
+def start_request_timer():
+    g.request_start = _time.perf_counter()
+    tracing.start(f'{request.method} {request.path}')
+
+@api.after_request
+def observe_request(response):
+    tracing.finish()
+    start = g.pop('request_start', None)
+    if start is not None:
+        HTTP_REQUEST_SECONDS.labels(request.endpoint or 'unknown', request.method,
+                                    response.status_code).observe(_time.perf_counter() - start)
+    return response
+
+@api.before_request
+def route_by_role():
+    """
+    reader进程：只读端点在本地处理，其余请求转发给writer进程；
+    跟随节点：拒绝只读端点以外的请求
+    """
+    if NODE_ROLE == 'follower':
+        if request.endpoint is None or request.endpoint in FOLLOWER_ENDPOINTS:
+            return None
+        return jsonify({'error': '跟随节点只提供查询与区块浏览，请向上游节点发送该请求',
+                        'upstreams': FOLLOW_UPSTREAMS}), 403
+    if NODE_ROLE != 'reader':
+        return None
+    if request.endpoint not in READ_ENDPOINTS:
+        return forward_to_writer()
+    if dns_resolver is None:
+        # writer可能在本进程启动后才创建钱包
+        init_wallet_from_storage()
+    return None
+
+@api.before_request
+def select_shard():
+    """
+    按链的请求用shard参数选择分片，分片号超出范围时返回400
+    """
+    shard = request.args.get('shard')
+    if shard is None or shards is None:
+        return None
+    try:
+        g.shard_layer = shards.layer(int(shard))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return None
+
+_response_cache = TTLCache(RESPONSE_CACHE_SIZE)
+
+def _file_version(file_path):
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def conditional_json(version, build):
+    """
+    带ETag的JSON响应：ETag由请求路径和数据版本（链尾哈希、交易池版本等）决定，
+    If-None-Match匹配时直接返回304；否则复用同一版本缓存的响应体，只在版本变化后重新序列化
+
+    :param version: 可哈希、可repr的数据版本
+    :param build: 无参函数，返回要序列化的数据
+    """
+    key = request.full_path
+    etag = hashlib.sha1(repr((key, version)).encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        _NOT_MODIFIED.inc()
+        response = Response(status=304)
+    else:
+        cached = _response_cache.get(key)
+        if cached is not None and cached[0] == etag:
+            _RESPONSE_HIT.inc()
+            body = cached[1]
+        else:
+            _RESPONSE_MISS.inc()
+            body = jsonify(build()).get_data()
+            _response_cache.set(key, (etag, body), RESPONSE_CACHE_TTL)
+        response = Response(body, status=200, content_type='application/json')
+    response.set_etag(etag)
+    # 客户端每次都需要重新验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def forward_to_writer():
+    import requests
+    from flask import Response
+    headers = {k: v for k, v in request.headers.items()
+               if k.lower() in ('content-type', 'authorization', 'cookie', 'accept', 'last-event-id')}
+    try:
+        resp = requests.request(request.method, WRITER_URL + request.full_path,
+                                data=request.get_data(), headers=headers, timeout=60, stream=True)
+    except requests.RequestException as e:
+        return jsonify({'error': f'写进程不可用: {e}'}), 503
+    content_type = resp.headers.get('Content-Type', '')
+    # 事件流逐块转发，其余响应读完后一次返回
+    body = resp.iter_content(None) if content_type.startswith('text/event-stream') else resp.content
+    out = Response(body, status=resp.status_code, content_type=content_type or None)
+    for cookie in resp.raw.headers.getlist('Set-Cookie'):
+        out.headers.add('Set-Cookie', cookie)
+    return out
+
 # 注册程序退出时保存数据
 # @atexit.register
 # def save_on_exit():
@@ -148,6 +346,31 @@ def check_user_status():
 def check_alive():
     return jsonify('The node is alive'), 200
 
+@api.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus文本格式的本进程指标"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@api.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """
+    对本进程采样seconds秒（默认10），返回火焰图工具可读取的折叠栈文本
+    """
+    if not profiler.ENABLED:
+        return jsonify({'error': 'profiler is disabled, start the node with --profiler'}), 403
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval_ms', profiler.DEFAULT_INTERVAL * 1000)) / 1000
+    except ValueError:
+        return jsonify({'error': 'seconds and interval_ms must be numbers'}), 400
+    if seconds <= 0 or interval <= 0:
+        return jsonify({'error': 'seconds and interval_ms must be positive'}), 400
+    try:
+        stacks = profiler.sample(seconds, interval)
+    except profiler.ProfilerBusy as e:
+        return jsonify({'error': str(e)}), 409
+    return Response(profiler.collapsed(stacks), content_type='text/plain; charset=utf-8')
+
 @api.route('/nodes/new', methods=['POST'])
 @require_wallet_registered
 def register_node():
@@ -156,7 +379,8 @@ def register_node():
     if nodes is None:
         return jsonify('No node supplied'), 400
     for node in nodes:
-        dns_resolver.register_node(node)
+        for layer in all_layers():
+            layer.register_node(node)
     return jsonify({
         'message': 'New nodes have been added',
         'total_nodes': dns_resolver.get_network_size()
@@ -189,13 +413,27 @@ def unbind_wallet():
         return jsonify({'message': message}), 200
     return jsonify({'error': message}), 400
 
+def _has_target(entry):
+    """条目需要带有ip和port，或者带有records记录列表"""
+    return ('ip' in entry and 'port' in entry) or 'records' in entry
+
+def _signing_args(entry, wallet_addr):
+    """
+    条目自带签名时原样传递；否则节点钱包持有私钥且就是条目的所有者时由节点签名
+    """
+    if 'signature' in entry:
+        return {'signature': entry['signature'], 'public_key': entry.get('public_key')}
+    if default_wallet is not None and default_wallet.private_key and default_wallet.address == wallet_addr:
+        return {'signer': default_wallet}
+    return {}
+
 @api.route('/dns/register', methods=['POST'])
 @require_wallet_registered
 def register_domain():
     global default_wallet
     values = request.get_json()
-    required = ['hostname', 'ip', 'port', 'lease_years']
-    if not all(k in values for k in required):
+    required = ['hostname', 'lease_years']
+    if not all(k in values for k in required) or not _has_target(values):
         return jsonify({'error': 'Missing required fields'}), 400
 
     status = dns_resolver.check_domain_status(values['hostname'])
@@ -212,7 +450,14 @@ def register_domain():
     if balance < cost:
         return jsonify({'error': f'Insufficient balance: {balance}, required: {cost}'}), 400
 
-    dns_resolver.new_entry(values['hostname'], values['ip'], values['port'], 'register', lease_years, wallet_addr)
+    try:
+        dns_resolver.new_entry(values['hostname'], values.get('ip'), values.get('port'), 'register',
+                               lease_years, wallet_addr, records=values.get('records'),
+                               **_signing_args(values, wallet_addr))
+    except SignatureError as e:
+        return jsonify({'error': f'Invalid signature: {e}'}), 400
+    except ValueError as e:
+        return jsonify({'error': f'Invalid records: {e}'}), 400
     default_wallet.add_balance(-cost)
     return jsonify({'message': 'Domain registered successfully, waiting for on-chain confirmation', 'blockchain_type': 'register', 'on_chain': False}), 201
 
@@ -222,13 +467,18 @@ def new_transaction():
     global default_wallet
     values = request.get_json()
     #print(values)
-    required = ['hostname', 'ip', 'port']
     bad_entries = []
     for entry in values.values():
-        if all(k in entry for k in required):
+        if 'hostname' in entry and _has_target(entry):
             wallet_addr = entry.get('wallet_address', wallet_address)
+            try:
+                dns_resolver.new_entry(entry['hostname'], entry.get('ip'), entry.get('port'), 'dns', 1,
+                                       wallet_addr, records=entry.get('records'),
+                                       **_signing_args(entry, wallet_addr))
+            except ValueError:
+                bad_entries.append(entry)
+                continue
             default_wallet.add_balance(1)
-            dns_resolver.new_entry(entry['hostname'], entry['ip'], entry['port'], 'dns', 1, wallet_addr)
         else:
             bad_entries.append(entry)
     if bad_entries:
@@ -239,66 +489,297 @@ def new_transaction():
 @require_wallet_registered
 def dns_lookup():
     values = request.get_json()
+    if 'hostnames' in values:
+        return batch_lookup(values)
     if 'hostname' not in values:
         return jsonify({'error': 'Missing values', 'on_chain': False}), 400
+    qtype = values.get('type')
     try:
-        host, port, on_chain = dns_resolver.lookup(values['hostname'])
-        if not on_chain:
-            return jsonify({'ip': host, 'port': port, 'on_chain': False, 'message': '该DNS记录未上链'}), 200
-        return jsonify({'ip': host, 'port': port, 'on_chain': True}), 200
+        result = dns_resolver.query(values['hostname'], qtype.upper() if qtype else None)
+        if not result['on_chain']:
+            result['message'] = '该DNS记录未上链'
+        return jsonify(result), 200
     except LookupError:
         return jsonify({'error': '未找到该域名', 'on_chain': False}), 404
 
+def batch_lookup(values):
+    """
+    批量查询：{'hostnames': [...], 'type': 可选}
+    返回 {'results': {hostname: 结果或{'error': ...}}, 'count': n}，
+    超过STREAM_BATCH_SIZE个主机名时流式返回
+    """
+    from flask import stream_with_context
+    hostnames = values['hostnames']
+    if not isinstance(hostnames, list):
+        return jsonify({'error': 'hostnames must be a list'}), 400
+    if len(hostnames) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'Too many hostnames: {len(hostnames)}, max {MAX_BATCH_SIZE}'}), 413
+    qtype = values.get('type')
+    results = dns_resolver.query_many(hostnames, qtype.upper() if qtype else None)
+
+    def entry(hostname, result, error):
+        if error is not None:
+            return {'error': error, 'on_chain': False}
+        return result
+
+    if len(hostnames) <= STREAM_BATCH_SIZE:
+        out = {str(hostname): entry(hostname, result, error) for hostname, result, error in results}
+        return jsonify({'results': out, 'count': len(out)}), 200
+
+    def generate():
+        yield '{"results":{'
+        seen = set()
+        for hostname, result, error in results:
+            key = str(hostname)
+            if key in seen:
+                continue
+            yield (',' if seen else '') + json.dumps(key, ensure_ascii=False) + ':' + \
+                json.dumps(entry(hostname, result, error), ensure_ascii=False)
+            seen.add(key)
+        yield '},"count":%d}' % len(seen)
+    return Response(stream_with_context(generate()), content_type='application/json'), 200
+
+@api.route('/dns/proof', methods=['GET'])
+@require_wallet_registered
+def hostname_proof():
+    """
+    主机名记录的包含证明：?hostname=<主机名>&checkpoint=<高度>，见lightclient.py
+    """
+    hostname = request.args.get('hostname')
+    if not hostname:
+        return jsonify({'error': 'Missing hostname'}), 400
+    try:
+        checkpoint = request.args.get('checkpoint')
+        proof = dns_resolver.hostname_proof(hostname, int(checkpoint) if checkpoint else None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except LookupError:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(proof), 200
+
 @api.route('/nodes/resolve', methods=['GET'])
 @require_wallet_registered
 def consensus():
     btype = request.args.get('type', 'both')
-    threads = []
-    if btype in ('register', 'both'):
-        t = threading.Thread(target=dns_resolver.register_blockchain.resolve_conflicts)
-        threads.append(t)
-        t.start()
-    if btype in ('dns', 'both'):
-        t = threading.Thread(target=dns_resolver.dns_blockchain.resolve_conflicts)
-        threads.append(t)
-        t.start()
+    layer = shard_layer()
+    # 广播来自出了新区块的邻居，同步前重新探测它的链尾
+    layer.expire_peer_tips(request.remote_addr, btype)
+    layer.resolve_conflicts(btype)
     return jsonify({'message': f'Resolving conflicts for {btype} blockchain(s)'}), 200
 
+@api.route('/nodes/tip', methods=['GET'])
+@require_wallet_registered
+def chain_tip():
+    """
+    链高度与链尾哈希，邻居同步前用它判断谁有更长的链，而不必拉取整条链
+    """
+    btype = request.args.get('type', 'dns')
+    if btype not in ('register', 'dns', 'both'):
+        return jsonify({'error': f'unknown blockchain type: {btype}'}), 400
+    return jsonify(shard_layer().chain_tip(btype)), 200
+
+@api.route('/nodes/headers', methods=['GET'])
+@require_wallet_registered
+def chain_headers():
+    """
+    区块头：?type=dns&start=<高度>&limit=<个数>
+    """
+    try:
+        result = shard_layer().block_headers(request.args.get('type', 'dns'),
+                                             int(request.args.get('start', 1)),
+                                             int(request.args.get('limit', dns.MAX_HEADERS)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result), 200
+
+@api.route('/nodes/blocks', methods=['GET'])
+@require_wallet_registered
+def chain_blocks():
+    """
+    一段完整区块：?type=dns&start=<高度>&end=<结束高度（不含）>
+    """
+    try:
+        start = int(request.args['start'])
+        result = shard_layer().block_range(request.args.get('type', 'dns'), start,
+                                           int(request.args.get('end', start + dns.MAX_BODY_RANGE)))
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f'invalid range: {e}'}), 400
+    return jsonify(result), 200
+
+@api.route('/nodes/snapshot', methods=['GET'])
+@require_wallet_registered
+def export_snapshot():
+    """
+    供新节点快速引导的状态快照包（见bootstrap.py），节点钱包持有私钥时带签名
+    """
+    wallet = default_wallet if default_wallet is not None and default_wallet.private_key else None
+    layer = shard_layer()
+    # 包中还有签名者与跨链复制的水位，换钱包或水位前进后同样需要重新生成
+    version = (wallet.public_key if wallet is not None else None, layer.chain_version('both'),
+               _file_version(watermark_path(layer.data_dir)))
+    return conditional_json(version, lambda: layer.snapshot_bundle(wallet))
+
+@api.route('/nodes/peers', methods=['GET'])
+@require_wallet_registered
+def list_peers():
+    btype = request.args.get('type', 'both')
+    return jsonify(shard_layer().peer_status(btype)), 200
+
 @api.route('/nodes/chain', methods=['GET'])
 @require_wallet_registered
 def dump_chain():
     btype = request.args.get('type', 'both')
-    return jsonify(dns_resolver.dump_chain(btype)), 200
+    layer = shard_layer()
+    return conditional_json(layer.chain_version(btype), lambda: layer.dump_chain(btype))
+
+def _page_args():
+    """
+    :return: 元组 (区块链类型, 每页条数)
+    :raise ValueError: limit不是整数
+    """
+    limit = int(request.args.get('limit', dns.PAGE_SIZE))
+    return request.args.get('type', 'dns'), min(max(limit, 1), dns.MAX_PAGE_SIZE)
+
+@api.route('/explorer/blocks', methods=['GET'])
+@require_wallet_registered
+def explorer_blocks():
+    try:
+        btype, limit = _page_args()
+        before = request.args.get('before')
+        page = shard_layer().block_page(btype, int(before) if before else None, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page), 200
+
+@api.route('/explorer/blocks/<ref>', methods=['GET'])
+@require_wallet_registered
+def explorer_block(ref):
+    try:
+        result = shard_layer().get_block(request.args.get('type', 'dns'), ref)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if result is None:
+        return jsonify({'error': 'Block not found'}), 404
+    return jsonify(result), 200
+
+@api.route('/explorer/transactions', methods=['GET'])
+@require_wallet_registered
+def explorer_transactions():
+    try:
+        btype, limit = _page_args()
+        start = request.args.get('start')
+        end = request.args.get('end')
+        page = shard_layer().transactions_between(btype, float(start) if start else None,
+                                                  float(end) if end else None,
+                                                  request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(page), 200
+
+def _feed_args():
+    """
+    :return: 元组 (EventFeed, 游标)，游标取自cursor参数或Last-Event-ID请求头
+    :raise ValueError: 未知的区块链类型或游标格式不正确
+    """
+    feed = shard_layer().feed(request.args.get('type', 'dns'))
+    cursor = request.args.get('cursor') or request.headers.get('Last-Event-ID')
+    if cursor:
+        changefeed.parse_cursor(cursor)
+    return feed, cursor
+
+@api.route('/events', methods=['GET'])
+@require_wallet_registered
+def poll_events():
+    """
+    长轮询：返回游标之后的事件，没有事件时最多等待wait秒
+    返回 {'events': [...], 'cursor': 下次请求带上的游标}；不带游标时从当前链尾开始
+    """
+    try:
+        feed, cursor = _feed_args()
+        wait = min(max(float(request.args.get('wait', EVENTS_WAIT)), 0), MAX_EVENTS_WAIT)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    cursor = cursor or feed.tip_cursor()
+    try:
+        release = changefeed.subscribe()
+    except changefeed.TooManySubscribers as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(SUBSCRIBER_RETRY)}
+    try:
+        events, seq = feed.events_after(cursor)
+        if not events and feed.wait(seq, wait):
+            events, _ = feed.events_after(cursor)
+    finally:
+        release()
+    return jsonify({'events': events, 'cursor': events[-1]['id'] if events else cursor}), 200
+
+@api.route('/events/stream', methods=['GET'])
+@require_wallet_registered
+def stream_events():
+    """
+    Server-Sent Events：事件的id即游标，断线重连时浏览器通过Last-Event-ID续传
+    """
+    from flask import stream_with_context
+    try:
+        feed, cursor = _feed_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        release = changefeed.subscribe()
+    except changefeed.TooManySubscribers as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(SUBSCRIBER_RETRY)}
+
+    def generate():
+        position = cursor or feed.tip_cursor()
+        yield f'retry: 3000\n: cursor {position}\n\n'
+        while True:
+            events, seq = feed.events_after(position)
+            for event in events:
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if events:
+                position = events[-1]['id']
+            elif not feed.wait(seq, SSE_HEARTBEAT):
+                yield ': heartbeat\n\n'
+    response = Response(stream_with_context(generate()), content_type='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # 连接关闭（包括事件流还没开始发送）时释放订阅者名额
+    response.call_on_close(release)
+    return response
 
 @api.route('/debug/dump_buffer', methods=['GET'])
 @require_wallet_registered
 def dump_buffer():
     btype = request.args.get('type', 'both')
-    return jsonify(dns_resolver.dump_buffer(btype)), 200
+    layer = shard_layer()
+    return conditional_json(layer.buffer_version(btype), lambda: layer.dump_buffer(btype))
 
 @api.route('/debug/force_block', methods=['GET'])
 @require_wallet_registered
 def force_block():
     btype = request.args.get('type', 'both')
+    layer = shard_layer()
     if btype == 'register':
-        proof = dns_resolver.mine_register_block()
+        proof = layer.mine_register_block()
         return jsonify(f"New register blockchain block mined with proof {proof}"), 200
     if btype == 'dns':
-        proof = dns_resolver.mine_dns_block()
+        proof = layer.mine_dns_block()
         return jsonify(f"New DNS blockchain block mined with proof {proof}"), 200
-    dns_resolver.mine_block()
+    layer.mine_block()
     return jsonify('New blocks mined in both blockchains'), 200
 
 @api.route('/debug/get_quota', methods=['GET'])
 @require_wallet_registered
 def get_chain_quota():
     btype = request.args.get('type', 'register')
-    return jsonify(dns_resolver.get_chain_quota(btype)), 200
+    layer = shard_layer()
+    # 配额属于本节点的钱包，导入或新建钱包后即使链没有变化也不同
+    return conditional_json((layer.node_identifier, layer.chain_version(btype)), lambda: layer.get_chain_quota(btype))
 
 @api.route('/data/save', methods=['GET'])
 @require_wallet_registered
 def save_data():
-    dns_resolver.save_data()
+    for layer in all_layers():
+        layer.save_data()
     return jsonify({'status': '数据已成功保存'}), 200
 
 @api.route('/wallet/create', methods=['POST'])
@@ -306,7 +787,7 @@ def create_wallet():
     global default_wallet, wallet_address, dns_resolver,wallet_status
     default_wallet = Wallet()
     wallet_address = default_wallet.address
-    dns_resolver = dns.dns_layer(node_identifier=wallet_address)
+    dns_resolver = open_dns_layers(wallet_address)
     # 定义数据目录路径
     from os import path
     data_dir = path.join(path.dirname(__file__), 'data')
@@ -339,7 +820,7 @@ def import_wallet():
         global default_wallet, wallet_address, dns_resolver
         default_wallet = Wallet(private_key=pk)
         wallet_address = default_wallet.address
-        dns_resolver = dns.dns_layer(node_identifier=wallet_address)
+        dns_resolver = open_dns_layers(wallet_address)
         
         # 定义数据目录路径
         from os import path
@@ -388,10 +869,8 @@ def get_wallet_info(address):
         return jsonify({'error': '无效的钱包地址'}), 400
 
     data_dir = path.join(path.dirname(__file__), 'data')
-    domains = []
-    resolver = dns.dns_layer(node_identifier=address)
-    # 注册区块链数据文件路径
-    dom_file = path.join(data_dir, 'register.json')
+    # 各分片的注册区块链数据文件路径
+    dom_files = [shard_file(data_dir, shard, 'register') for shard in range(SHARD_COUNT)]
 
     # 尝试加载钱包
     wallet_file = path.join(data_dir, 'wallet.json')
@@ -406,54 +885,57 @@ def get_wallet_info(address):
     if not wallet_found:
         return jsonify({'error': '未找到该钱包地址'}), 404
 
-    # 创建钱包实例
-    try:
-        wallet = Wallet()
-        wallet.address = address
-    except Exception as e:
-        return jsonify({'error': f'钱包实例化失败: {str(e)}'}), 500
-
-    if path.exists(dom_file):
-        with open(dom_file, 'r') as f:
-            blockchain_data = json.load(f)
-        for block in blockchain_data:
-            for transaction in block.get('transactions', []):
-                if transaction.get('node_id') == address:
-                    domains.append({
-                        'hostname': transaction['hostname'],
-                        'ip': transaction['ip'],
-                        'port': transaction['port'],
-                        'lease_years': transaction['lease_years'],
-                        'block_index': block['index'],
-                        'timestamp': block['timestamp']
-                    })
-
-    # 获取余额
-    try:
-        balance = wallet.get_balance()
-    except Exception:
-        balance = 0
-
-    return jsonify({
-        'address': address,
-        'domains': domains,
-        'count': len(domains),
-        'balance': balance
-    }), 200
+    # 条件请求的版本：下面读取的注册链区块存储（偏移表随每次追加或截断变化）与钱包文件（余额）
+    version = tuple((_file_version(path.splitext(dom_file)[0] + '.offsets'), _file_version(dom_file))
+                    for dom_file in dom_files) + (_file_version(wallet_file),)
+
+    def build():
+        domains = []
+        for dom_file in dom_files:
+            # 旧链文件由写进程启动时导入，这里只读打开，不修复或截断写进程正在追加的存储
+            blockchain_data = BlockStore(path.splitext(dom_file)[0], read_only=True)
+            for block in blockchain_data:
+                for transaction in block.get('transactions', []):
+                    if transaction.get('node_id') == address:
+                        domains.append({
+                            'hostname': transaction['hostname'],
+                            'ip': transaction.get('ip'),
+                            'port': transaction.get('port'),
+                            'lease_years': transaction['lease_years'],
+                            'block_index': block['index'],
+                            'timestamp': block['timestamp']
+                        })
+
+        # 获取余额
+        try:
+            wallet = Wallet()
+            wallet.address = address
+            balance = wallet.get_balance()
+        except Exception:
+            balance = 0
+
+        return {
+            'address': address,
+            'domains': domains,
+            'count': len(domains),
+            'balance': balance
+        }
+    return conditional_json(version, build)
 
 @api.route('/wallet/reset', methods=['POST'])
+@require_wallet_registered
 def reset_wallet_data():
-    from os import path, remove
-    data_dir = path.join(path.dirname(__file__), 'data')
-    dom_file = path.join(data_dir, 'domains.json')
-    if path.exists(dom_file): remove(dom_file)
+    # 通过区块链清空，运行中的链随之重新加载、派生状态随之重建
+    for layer in all_layers():
+        layer.reset_dns_chain()
     return jsonify({'message': '钱包数据已重置'}), 200
 
 @api.route('/wallet/disconnect', methods=['POST'])
 def disconnect_wallet():
-    global wallet_status, wallet_address, default_wallet, dns_resolver
+    global wallet_status, wallet_address, default_wallet, dns_resolver, shards
     wallet_status = False
     wallet_address = None
     default_wallet = None
     dns_resolver = None
+    shards = None
     return jsonify({'message': '钱包已断开连接'}), 200
\ No newline at end of file
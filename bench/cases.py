@@ -0,0 +1,166 @@
+"""
+基准用例
+
+每个用例接收一个已生成数据的工作目录（当前目录即为该目录）和链规模，
+返回每次操作的耗时列表（秒）。用例在独立的子进程中运行，互不影响内存峰值。
+"""
+
+import json
+import random
+import threading
+import time
+
+from bench import chaingen
+
+NODE_ID = chaingen.NODE_ID
+
+
+def _timed(fn, ops):
+    samples = []
+    for i in range(ops):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _layer():
+    import dns
+    return dns.dns_layer(node_identifier=NODE_ID)
+
+
+def lookup(size, ops):
+    layer = _layer()
+    rng = random.Random(1)
+
+    def op(i):
+        # 十分之一的查询未命中
+        if i % 10 == 9:
+            try:
+                layer.lookup(f'missing-{i}.bench')
+            except LookupError:
+                pass
+        else:
+            chain = 'dns' if i % 2 else 'register'
+            layer.lookup(chaingen.hostname(chain, rng.randrange(size)))
+    return _timed(op, ops)
+
+
+def new_entry(size, ops):
+    layer = _layer()
+
+    def op(i):
+        layer.new_entry(f'new-{i}.bench', '10.0.0.1', 80, 'register' if i % 2 else 'dns', 1, NODE_ID)
+    return _timed(op, ops)
+
+
+def mine_register_block(size, ops):
+    layer = _layer()
+
+    def op(i):
+        layer.register_blockchain.new_transaction({'hostname': f'mine-r-{i}.bench', 'ip': '10.0.0.2', 'port': 80})
+        layer.mine_register_block()
+    return _timed(op, ops)
+
+
+def mine_dns_block(size, ops):
+    layer = _layer()
+
+    def op(i):
+        layer.dns_blockchain.new_transaction({'hostname': f'mine-d-{i}.bench', 'ip': '10.0.0.3', 'port': 80})
+        layer.mine_dns_block()
+    return _timed(op, ops)
+
+
+def valid_chain(size, ops):
+    import blockchain as bc
+    layer = _layer()
+    chain = list(layer.dns_blockchain.chain)
+    return _timed(lambda i: bc.Blockchain.valid_chain(chain), ops)
+
+
+def resolve_conflicts(size, ops):
+    """
+    本地启动一个邻居节点，提供比本链长 10 个区块的链
+    """
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    layer = _layer()
+    blockchain = layer.dns_blockchain
+    base_length = len(blockchain.chain)
+    longer = chaingen.make_blocks('dns', (base_length - 1 + 10) * chaingen.TX_PER_BLOCK, seed=1)
+    body = json.dumps({'chain': longer, 'length': len(longer)}).encode()
+
+    def peer_app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+        return [body]
+
+    server = make_server('127.0.0.1', 0, peer_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    blockchain.register_node(f'127.0.0.1:{server.server_port}')
+
+    samples = []
+    try:
+        for _ in range(ops):
+            # 每轮开始前恢复到较短的本地链，不计入耗时
+            blockchain.chain.replace(blockchain.chain[:base_length])
+            start = time.perf_counter()
+            blockchain.resolve_conflicts()
+            samples.append(time.perf_counter() - start)
+    finally:
+        server.shutdown()
+    return samples
+
+
+def _client(layer):
+    import api
+    from server import create_app
+    api.dns_resolver = layer
+    api.wallet_address = NODE_ID
+    app = create_app()
+    app.testing = True
+    return app.test_client()
+
+
+def endpoint_dns_request(size, ops):
+    client = _client(_layer())
+    rng = random.Random(2)
+
+    def op(i):
+        name = chaingen.hostname('dns', rng.randrange(size))
+        resp = client.post('/dns/request', json={'hostname': name})
+        assert resp.status_code == 200, resp.status_code
+    return _timed(op, ops)
+
+
+def endpoint_nodes_chain(size, ops):
+    client = _client(_layer())
+
+    def op(i):
+        resp = client.get('/nodes/chain?type=dns')
+        assert resp.status_code == 200, resp.status_code
+    return _timed(op, ops)
+
+
+def endpoint_get_quota(size, ops):
+    client = _client(_layer())
+
+    def op(i):
+        resp = client.get('/debug/get_quota?type=both')
+        assert resp.status_code == 200, resp.status_code
+    return _timed(op, ops)
+
+
+# 用例名 -> (函数, 默认操作次数)
+CASES = {
+    'lookup': (lookup, 2000),
+    'new_entry': (new_entry, 100),
+    'mine_register_block': (mine_register_block, 20),
+    'mine_dns_block': (mine_dns_block, 20),
+    'valid_chain': (valid_chain, 3),
+    'resolve_conflicts': (resolve_conflicts, 3),
+    'endpoint_dns_request': (endpoint_dns_request, 500),
+    'endpoint_nodes_chain': (endpoint_nodes_chain, 10),
+    'endpoint_get_quota': (endpoint_get_quota, 200),
+}
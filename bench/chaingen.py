@@ -0,0 +1,94 @@
+"""
+生成合成区块链数据
+
+在指定数据目录下写入注册链与DNS链的区块存储（与dns_layer使用的文件相同），
+区块带有有效的工作量证明和哈希链接，可以直接用于valid_chain等基准。
+DNS链末尾附带注册链交易的跨链复制，并写入对应的复制水位，与运行中的节点一致。
+"""
+
+import json
+import os
+import random
+
+import blockchain as bc
+import replication
+from blockstore import BlockStore
+from merkle import merkle_root
+
+NODE_ID = 'DC' + '5d15c13a71a9716278ae8b826e8c0d6119c7951d'
+TX_PER_BLOCK = 10
+
+
+def hostname(chain, i):
+    return f'{chain}-{i}.bench'
+
+
+def _append_block(blocks, transactions):
+    last = blocks[-1]
+    blocks.append({
+        'index': last['index'] + 1,
+        'source': NODE_ID,
+        'timestamp': last['timestamp'] + 60,
+        'transactions': transactions,
+        'tx_root': merkle_root(transactions),
+        'proof': bc._search_proof(last['proof']),
+        'previous_hash': bc.Blockchain.hash(last),
+    })
+
+
+def make_blocks(chain, tx_count, tx_per_block=TX_PER_BLOCK, seed=0, replicate=None):
+    """
+    生成一条包含tx_count条DNS交易的链（含创世区块）
+
+    :param chain: 'register' 或 'dns'，决定主机名前缀
+    :param replicate: 可选的注册链区块，其中的注册交易复制后追加到链末尾
+    :return: 区块列表
+    """
+    rng = random.Random(seed)
+    blocks = [{
+        'index': 1,
+        'source': NODE_ID,
+        'timestamp': 1700000000.0,
+        'transactions': [],
+        'proof': 100,
+        'previous_hash': '1',
+    }]
+    for start in range(0, tx_count, tx_per_block):
+        transactions = [{
+            'hostname': hostname(chain, i),
+            'ip': f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}',
+            'port': 80,
+            'node_id': NODE_ID,
+            'lease_years': 1,
+        } for i in range(start, min(start + tx_per_block, tx_count))]
+        _append_block(blocks, transactions)
+    if replicate:
+        copies = [replication.replicated_tx(tx, bc.Blockchain.hash(block), block['index'], i, NODE_ID)
+                  for block in replicate for i, tx in enumerate(block['transactions']) if replication.replicable(tx)]
+        for start in range(0, len(copies), replication.BATCH_SIZE):
+            _append_block(blocks, copies[start:start + replication.BATCH_SIZE])
+    return blocks
+
+
+def generate(data_dir, tx_count, tx_per_block=TX_PER_BLOCK):
+    """
+    在data_dir中生成两条链以及空的临时缓冲文件
+
+    :return: dict，链名 -> 区块数
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    sizes = {}
+    register = None
+    for seed, (chain, name) in enumerate((('register', 'register'), ('dns', 'domains'))):
+        blocks = make_blocks(chain, tx_count, tx_per_block, seed=seed, replicate=register)
+        store = BlockStore(os.path.join(data_dir, name))
+        store.clear()
+        store.extend(blocks)
+        sizes[chain] = len(blocks)
+        if register is None:
+            register = blocks
+    replication.write_watermark(replication.watermark_path(data_dir), len(register), bc.Blockchain.hash(register[-1]))
+    for tmp in ('tmp_register.json', 'tmp_domains.json'):
+        with open(os.path.join(data_dir, tmp), 'w', encoding='utf-8') as f:
+            json.dump([], f)
+    return sizes
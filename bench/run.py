@@ -0,0 +1,186 @@
+"""
+热点路径基准测试
+
+为每个链规模生成一份合成数据（两条链各含指定数量的DNS交易），
+在临时目录的独立副本中逐个运行用例（每个用例一个子进程），
+输出吞吐量、p50/p99延迟和内存峰值的JSON结果，并可与保存的基线比较。
+
+用法（在仓库根目录）：
+    python -m bench.run --sizes 1000,10000 --output bench/latest.json
+    python -m bench.run --sizes 1000 --baseline bench/latest.json --threshold 0.2
+"""
+
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bench import chaingen  # noqa: E402
+from bench.cases import CASES  # noqa: E402
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def _child(case, size, ops, workdir, conn):
+    os.chdir(workdir)
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            samples = CASES[case][0](size, ops)
+        # Linux上ru_maxrss的单位是KB
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        conn.send({'samples': samples, 'peak_rss_kb': peak_rss_kb})
+    except BaseException as e:
+        conn.send({'error': f'{type(e).__name__}: {e}'})
+    finally:
+        # 跳过atexit回调（如dns_layer.save_data），它们不属于被测路径
+        sys.stdout.flush()
+        os._exit(0)
+
+
+def run_case(case, size, ops, data_dir):
+    """
+    在数据的独立副本和独立子进程中运行一个用例
+    """
+    ctx = multiprocessing.get_context('fork')
+    workdir = tempfile.mkdtemp(prefix=f'bench-{case}-')
+    try:
+        shutil.copytree(data_dir, os.path.join(workdir, 'data'))
+        parent_conn, child_conn = ctx.Pipe(duplex=False)
+        p = ctx.Process(target=_child, args=(case, size, ops, workdir, child_conn))
+        p.start()
+        child_conn.close()
+        try:
+            result = parent_conn.recv()
+        except EOFError:
+            result = {'error': f'worker exited with code {p.exitcode}'}
+        p.join()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    entry = {'case': case, 'size': size, 'ops': ops}
+    if 'error' in result:
+        entry['error'] = result['error']
+        return entry
+    samples = result['samples']
+    total = sum(samples)
+    entry.update({
+        'throughput': len(samples) / total if total else 0.0,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'peak_rss_kb': result['peak_rss_kb'],
+    })
+    return entry
+
+
+def compare(results, baseline, threshold):
+    """
+    与基线比较：吞吐量下降或p50/p99上升超过threshold的用例视为回归
+
+    :return: 回归列表
+    """
+    base = {(r['case'], r['size']): r for r in baseline.get('results', []) if 'error' not in r}
+    regressions = []
+    for r in results:
+        b = base.get((r['case'], r['size']))
+        if b is None or 'error' in r:
+            continue
+        checks = [
+            ('throughput', b['throughput'], r['throughput'], r['throughput'] < b['throughput'] * (1 - threshold)),
+            ('p50_ms', b['p50_ms'], r['p50_ms'], r['p50_ms'] > b['p50_ms'] * (1 + threshold)),
+            ('p99_ms', b['p99_ms'], r['p99_ms'], r['p99_ms'] > b['p99_ms'] * (1 + threshold)),
+        ]
+        for metric, before, after, regressed in checks:
+            r.setdefault('delta', {})[metric] = (after - before) / before if before else 0.0
+            if regressed:
+                regressions.append({'case': r['case'], 'size': r['size'], 'metric': metric,
+                                    'baseline': before, 'current': after})
+    return regressions
+
+
+def main(argv=None):
+    parser = ArgumentParser(description='Benchmark lookup, register, mine and sync hot paths')
+    parser.add_argument('--sizes', default='1000,10000',
+                        help='comma separated transaction counts per chain (e.g. 1000,100000,1000000)')
+    parser.add_argument('--cases', default=','.join(CASES), help='comma separated case names')
+    parser.add_argument('--ops-scale', default=1.0, type=float, help='multiply the default operation counts')
+    parser.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    parser.add_argument('--baseline', help='compare against a saved JSON result')
+    parser.add_argument('--threshold', default=0.1, type=float, help='allowed relative regression')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    cases = [c for c in args.cases.split(',') if c]
+    unknown = [c for c in cases if c not in CASES]
+    if unknown:
+        parser.error(f'unknown cases: {", ".join(unknown)}')
+
+    results = []
+    for size in sizes:
+        data_root = tempfile.mkdtemp(prefix=f'bench-data-{size}-')
+        try:
+            data_dir = os.path.join(data_root, 'data')
+            start = time.perf_counter()
+            chaingen.generate(data_dir, size)
+            print(f'generated {size} transactions per chain in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+            for case in cases:
+                ops = max(1, int(CASES[case][1] * args.ops_scale))
+                entry = run_case(case, size, ops, data_dir)
+                results.append(entry)
+                if 'error' in entry:
+                    print(f'{case:<24} size={size:<8} ERROR {entry["error"]}', file=sys.stderr)
+                else:
+                    print(f'{case:<24} size={size:<8} {entry["throughput"]:>10.1f} op/s  '
+                          f'p50={entry["p50_ms"]:.3f}ms  p99={entry["p99_ms"]:.3f}ms  '
+                          f'rss={entry["peak_rss_kb"] / 1024:.1f}MB', file=sys.stderr)
+        finally:
+            shutil.rmtree(data_root, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': sizes,
+            'ops_scale': args.ops_scale,
+        },
+        'results': results,
+    }
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        report['regressions'] = regressions
+        for r in regressions:
+            print(f'REGRESSION {r["case"]} size={r["size"]} {r["metric"]}: '
+                  f'{r["baseline"]:.3f} -> {r["current"]:.3f}', file=sys.stderr)
+        exit_code = 1 if regressions else 0
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,51 +4,197 @@ Modified to fit the DNS scenario
 """
 
 import hashlib
-from time import time
+import logging
+from time import time, perf_counter
 from uuid import uuid4
 from urllib.parse import urlparse
 import json
+import os
+import threading
+from collections import OrderedDict
 import requests
+import metrics
+import records as rec
+import signing
+import tracing
+from blockstore import BlockStore, LazyChain
+from merkle import block_hash, merkle_root
+from peers import PeerTable
+
+logger = logging.getLogger(__name__)
+
+POW_SECONDS = metrics.Histogram('dns_pow_seconds', '工作量证明耗时（秒）', ['chain'])
+POW_ATTEMPTS = metrics.Counter('dns_pow_attempts_total', '工作量证明尝试的盐值个数', ['chain'])
+BLOCK_TRANSACTIONS = metrics.Histogram('dns_block_transactions', '每个新区块的交易数', ['chain'],
+	buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+SAVE_SECONDS = metrics.Histogram('dns_save_seconds', '持久化耗时（秒）', ['target'])
+MEMPOOL_DEPTH = metrics.Gauge('dns_mempool_depth', '尚未出块的交易数', ['chain', 'buffer'])
+PEER_REQUEST_SECONDS = metrics.Histogram('dns_peer_request_seconds', '向邻居节点请求的耗时（秒）', ['peer', 'path'])
+PEER_ERRORS = metrics.Counter('dns_peer_errors_total', '向邻居节点请求失败的次数', ['peer', 'path'])
+REORG_DEPTH = metrics.Histogram('dns_reorg_depth', '链重组时回滚的区块数', ['chain'],
+	buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 1024))
+
+# 保留的分支区块（被重组移出主链的区块）个数上限
+MAX_BRANCH_BLOCKS = 1024
+# 向邻居节点请求的默认超时（秒）
+PEER_TIMEOUT = 5
+
+# 可选的工作量证明执行器（如进程池），由异步运行时设置，
+# 用于把PoW这类CPU密集的计算移出事件循环所在进程
+pow_executor = None
+
+
+def atomic_write_json(path, data, **kwargs):
+	"""
+	原子地写入JSON文件：先写临时文件再替换，
+	其他进程不会读到写了一半的文件
+	"""
+	tmp_path = f'{path}.{os.getpid()}.tmp'
+	name = os.path.basename(path)
+	with SAVE_SECONDS.labels(name).timer(), tracing.span(f'write:{name}'):
+		with open(tmp_path, 'w', encoding='utf-8') as f:
+			json.dump(data, f, **kwargs)
+		os.replace(tmp_path, path)
+
+
+def peer_get(node, path, peers=None, **kwargs):
+	"""
+	向邻居节点发送GET请求，记录每个邻居的请求耗时和失败次数
+
+	:param node: 邻居节点地址 host:port
+	:param path: 请求路径，例如 /nodes/chain
+	:param peers: 可选的PeerTable，记录这次请求的延迟与成败（5xx响应计为失败）
+	"""
+	url = f'http://{node}{path}'
+	kwargs.setdefault('timeout', PEER_TIMEOUT)
+	start = perf_counter()
+	try:
+		with tracing.span(f'peer:{node}{path}'):
+			response = requests.get(url, **kwargs)
+	except requests.RequestException:
+		PEER_ERRORS.labels(node, path).inc()
+		if peers is not None:
+			peers.record_failure(node)
+		raise
+	finally:
+		elapsed = perf_counter() - start
+		PEER_REQUEST_SECONDS.labels(node, path).observe(elapsed)
+	if peers is not None:
+		if response.status_code >= 500:
+			peers.record_failure(node)
+		else:
+			peers.record_success(node, elapsed)
+	return response
+
+
+def _search_proof(last_proof):
+	"""
+	在执行器中运行的工作量证明搜索，必须是模块级函数以便序列化
+	"""
+	salt = 0
+	while not Blockchain.valid_proof(last_proof, salt):
+		salt += 1
+	return salt
+
+
+class Reorg(object):
+	"""
+	一次链重组：主链回滚到fork_point个区块，再追加added
+	"""
+	__slots__ = ('fork_point', 'removed', 'added')
+
+	def __init__(self, fork_point, removed, added):
+		"""
+		:param fork_point: 新旧两条链共同的区块数
+		:param removed: 被移出主链的区块（按高度从低到高）
+		:param added: 新追加到主链的区块（按高度从低到高）
+		"""
+		self.fork_point = fork_point
+		self.removed = removed
+		self.added = added
+
+	@property
+	def depth(self):
+		return len(self.removed)
+
 
 class Blockchain(object):
-	def __init__(self, wallet_address):
+	def __init__(self, wallet_address, chain_file="data/blockchain.json", chain_type=None, read_only=False):
 		"""
 		初始化区块链类
 		
 		Current_transactions 是新交易的缓冲区，在创建新区块前存储
-		Chain 是区块链（账本），存储所有数据
-		Nodes 是一个集合，跟踪所有其他节点
+		Chain 是区块链（账本），存储所有数据；它是以区块存储为后端的LazyChain，
+		只有链尾和最近访问的区块在内存中
+		Nodes 是邻居节点表（PeerTable），跟踪所有其他节点的延迟、失败次数、链尾与熔断状态
 		这是必需的，因为我们需要向其他节点广播信息
 		
 		:param wallet_address: 钱包地址，作为节点的唯一标识符
+		:param chain_file: 链文件路径，区块实际保存在同名的 .blocks/.offsets 区块存储中，
+			该JSON文件仅用于首次导入旧数据
+		:param chain_type: 邻居节点API中的区块链类型（'register' 或 'dns'），请求邻居时作为type参数
+		:param read_only: 只读打开区块存储（见BlockStore），不导入、不修复、不创建创世区块，
+			只在存储被写进程修改后重新加载
 		"""
 		self.current_transactions = []
 		self.chain = []
-		self.nodes = set()
+		self.chain_type = chain_type
 		self.wallet_address = wallet_address  # 使用钱包地址替代node_identifier
 		self.transaction_counter = 0  # 添加交易计数器
+		self._file_stamp = None  # 最近一次加载/保存时区块存储的版本标记
+		# 链变化的监听者，调用方式为 listener(blockchain, event, block)
+		# event为'block'（追加了新区块block）、'reorg'（block为描述重组的Reorg）
+		# 或'reset'（整条链被重新加载，block为None）
+		self.listeners = []
+		# 被重组移出主链的分支区块，按哈希索引，只保留最近的MAX_BRANCH_BLOCKS个
+		self.branches = OrderedDict()
+		self._tip = None  # 缓存的 (链长度, 链尾哈希)，链发生任何变化时清空
+		# 交易池的版本：(实例标识, 变化次数)，每次变化时加一，用于条件请求
+		self._mempool_id = uuid4().hex
+		self._mempool_changes = 0
+		# 链锁：出块（取链尾、工作量证明、new_block）、链替换与重置互斥，新区块总是接在当前链尾之后；
+		# 持有链锁时可以再取跨链复制等组件的锁，反之不行
+		self.lock = threading.RLock()
 
 		# 加载持久化区块链数据
-		self.chain_file = "data/blockchain.json"
+		self.chain_file = chain_file
+		self.name = os.path.splitext(os.path.basename(chain_file))[0]
+		# 所属的主机名分片（见shards.py），请求邻居时带上
+		self.shard = 0
+		self.nodes = PeerTable(self.name)
+		self.read_only = read_only
+		self.store = BlockStore(os.path.splitext(chain_file)[0], legacy_file=chain_file, read_only=read_only)
+		self._pow_seconds = POW_SECONDS.labels(self.name)
+		self._pow_attempts = POW_ATTEMPTS.labels(self.name)
+		self._block_transactions = BLOCK_TRANSACTIONS.labels(self.name)
+		self._save_seconds = SAVE_SECONDS.labels(self.name)
+		self._reorg_depth = REORG_DEPTH.labels(self.name)
+		MEMPOOL_DEPTH.labels(self.name, 'transactions').set_function(lambda: len(self.current_transactions))
 		self.load_chain()
 
-		if not self.chain:
+		if not self.chain and not read_only:
 			# 创建创世区块
 			# 这是一个硬编码的区块，作为第一个区块
 			# 它不包含任何数据
 			self.new_block(previous_hash = '1', proof=100)
 
+	def _notify(self, event, block=None):
+		self._tip = None
+		for listener in self.listeners:
+			try:
+				listener(self, event, block)
+			except Exception as e:
+				logger.exception("区块链监听者处理 %s 事件失败: %s", event, e)
+
 	def register_node(self, address):
 		"""
 		添加新节点到节点列表
 		
 		:param address: 网络中新节点的地址
 		"""
-		# print(address)
 		# parsed_url = urlparse(address)
 		# self.nodes.add(parsed_url.netloc)
 		self.nodes.add(address)
-		# print(self.nodes)
 
 	@property
 	def quota(self):
@@ -73,10 +219,10 @@ class Blockchain(object):
 		"""
 		属性方法，返回链中的尾部区块
 		"""
-		if not self.chain:
+		if not self.chain and not self.read_only:
 			# 如果链为空，先创建创世区块
 			self.new_block(previous_hash='1', proof=100)
-			print(f"在last_block属性中创建创世区块完成")
+			logger.info("在last_block属性中创建创世区块完成")
 		return self.chain[-1]
 
 	@property
@@ -89,14 +235,11 @@ class Blockchain(object):
 	@staticmethod
 	def hash(block):
 		"""
-		创建区块的SHA-256哈希
+		创建区块的SHA-256哈希；带交易根的区块只对区块头取哈希，见merkle.block_hash
 		
 		:param block: 区块
 		"""
-
-		# 对字典进行排序以确保哈希一致
-		block_string = json.dumps(block, sort_keys=True).encode()
-		return hashlib.sha256(block_string).hexdigest()
+		return block_hash(block)
 
 	@staticmethod
 	def valid_proof(last_proof,proof):
@@ -121,18 +264,25 @@ class Blockchain(object):
 			yield num
 			num += 1
 			if num%100 == 0:
-				print("生成盐值...")
+				logger.debug("生成盐值... %d", num)
 
 	def proof_of_work(self, last_proof):
 		"""
 		工作量证明算法。迭代不同的盐值
 		查看哪个盐值满足valid_proof
 		"""
-		salt_gen = self.salt_generator()
-		salt = next(salt_gen)
-		while not self.valid_proof(last_proof,salt):
-			salt = next(salt_gen)
-		print("POW已生成")
+		start = perf_counter()
+		with tracing.span('pow'):
+			if pow_executor is not None:
+				salt = pow_executor.submit(_search_proof, last_proof).result()
+			else:
+				salt_gen = self.salt_generator()
+				salt = next(salt_gen)
+				while not self.valid_proof(last_proof,salt):
+					salt = next(salt_gen)
+		self._pow_seconds.observe(perf_counter() - start)
+		self._pow_attempts.inc(salt + 1)
+		logger.debug("POW已生成")
 		return salt
 
 	def new_transaction(self,transaction):
@@ -144,68 +294,84 @@ class Blockchain(object):
 		:return: 当前交易缓冲区中的交易数量
 		"""
 		self.current_transactions.append(transaction)
+		self._mempool_changes += 1
 		self.transaction_counter += 1  # 增加交易计数
 		
 		# 当交易数达到10条时，自动出块
 		if self.transaction_counter >= 10:
-			# 检查区块链是否为空，如果为空则先创建创世区块
-			if not self.chain:
-				self.new_block(previous_hash='1', proof=100)
-				print(f"创建创世区块完成")
-			
-			last_block = self.chain[-1]  # 直接访问最后一个区块，避免使用last_block属性
-			last_proof = last_block['proof']
-			proof = self.proof_of_work(last_proof)
-			previous_hash = self.hash(last_block)
-			self.new_block(proof, previous_hash)
+			self.mine()
 			self.transaction_counter = 0  # 重置计数器
-			print(f"自动出块完成，区块链文件：{self.chain_file}")
+			logger.debug("自动出块完成，区块链文件：%s", self.chain_file)
 		
 		return len(self.current_transactions)
 
+	def add_transactions(self, transactions):
+		"""
+		批量加入交易池，不触发自动出块，由调用方决定何时出块
+
+		:param transactions: 交易列表
+		:return: 当前交易缓冲区中的交易数量
+		"""
+		self.current_transactions.extend(transactions)
+		self._mempool_changes += 1
+		return len(self.current_transactions)
+
 	def save_chain(self):
 		"""
-		保存区块链数据到文件，采用追加模式（a+），不覆盖原有内容
+		保存区块链数据：新区块在追加到链时已写入区块日志，这里只记录存储的版本
 		"""
 		try:
-			import os
-			data_dir = os.path.dirname(self.chain_file)
-			if not os.path.exists(data_dir):
-				os.makedirs(data_dir)
-			# 先读取原有内容
-			chain_data = []
-			if os.path.exists(self.chain_file):
-				with open(self.chain_file, 'r', encoding='utf-8') as f:
-					content = f.read().strip()
-					if content:
-						chain_data = json.loads(content)
-			# 只追加新块
-			if len(chain_data) < len(self.chain):
-				new_blocks = self.chain[len(chain_data):]
-				chain_data.extend(new_blocks)
-				with open(self.chain_file, 'w', encoding='utf-8') as f:
-					json.dump(chain_data, f, indent=4, ensure_ascii=False)
-			print(f"成功保存区块链数据，共 {len(self.chain)} 个区块")
+			self._file_stamp = self.store.stamp()
+			logger.debug("成功保存区块链数据，共 %d 个区块", len(self.chain))
 		except Exception as e:
-			print(f"保存区块链数据失败: {e}")
+			logger.error("保存区块链数据失败: %s", e)
+
+	def refresh(self):
+		"""
+		仅当区块存储自上次加载或保存后被（其他进程）修改时才重新加载
+		"""
+		if self.store.stamp() != self._file_stamp:
+			self.load_chain()
 
 	def load_chain(self):
 		"""
-		从文件加载区块链数据
+		从区块存储加载区块链数据
 		"""
 		try:
-			import os
-			if os.path.exists(self.chain_file):
-				with open(self.chain_file, 'r') as f:
-					import json
-					self.chain = json.load(f)
-				print(f"成功加载区块链数据，共 {len(self.chain)} 个区块")
-			else:
-				print(f"区块链数据文件不存在，创建新的区块链")
-				self.chain = []
+			self.store.refresh()
+			self._file_stamp = self.store.stamp()
+			self.chain = LazyChain(self.store)
+			logger.info("成功加载区块链数据 %s，共 %d 个区块", self.name, len(self.chain))
 		except Exception as e:
-			print(f"加载区块链数据失败: {e}")
-			self.chain = []
+			# 不能把损坏的存储当作空链继续写入
+			logger.error("加载区块链数据失败: %s", e)
+			raise
+		self._notify('reset')
+
+	def reset(self):
+		"""
+		清空本链并重新创建创世区块：监听者先收到'reset'事件、从空链重建派生状态，再收到创世区块的'block'事件
+		"""
+		with self.lock:
+			self.store.clear()
+			self.current_transactions = []
+			self.load_chain()
+			self.new_block(previous_hash='1', proof=100)
+
+	def mine(self):
+		"""
+		在链锁内取链尾、计算工作量证明并出块，期间链不会被同步替换或由其他线程出块
+
+		:return: 新区块
+		"""
+		with self.lock:
+			# 检查区块链是否为空，如果为空则先创建创世区块
+			if not self.chain:
+				self.new_block(previous_hash='1', proof=100)
+				logger.info("创建创世区块完成")
+			last_block = self.chain[-1]  # 直接访问最后一个区块，避免使用last_block属性
+			proof = self.proof_of_work(last_block['proof'])
+			return self.new_block(proof, self.hash(last_block))
 
 	def new_block(self,proof,previous_hash):
 		"""
@@ -215,6 +381,10 @@ class Blockchain(object):
 		:param previous_hash: 前一个区块的哈希
 		:return: 新区块
 		"""
+		with self.lock:
+			return self._new_block(proof, previous_hash)
+
+	def _new_block(self, proof, previous_hash):
 		# 处理previous_hash，确保在链为空时不会尝试访问self.chain[-1]
 		if previous_hash is None and len(self.chain) > 0:
 			previous_hash = self.hash(self.chain[-1])
@@ -224,51 +394,103 @@ class Blockchain(object):
 			'source': self.wallet_address,  # 使用钱包地址
 			'timestamp': time(),
 			'transactions': self.current_transactions,
+			'tx_root': merkle_root(self.current_transactions),
 			'proof': proof,
 			'previous_hash': previous_hash,
 		}
 
 		# 重置当前交易列表
 		self.current_transactions = []
-
-		self.chain.append(block)
-		self.save_chain()
+		self._mempool_changes += 1
+
+		with self._save_seconds.timer(), tracing.span(f'save:{self.name}'):
+			self.chain.append(block)
+			self.save_chain()
+		self._block_transactions.observe(len(block['transactions']))
+		with tracing.span(f'listeners:{self.name}'):
+			self._notify('block', block)
 		return block        
 
+	def peer_params(self):
+		"""
+		:return: 请求邻居时的查询参数
+		"""
+		params = {'type': self.chain_type} if self.chain_type else {}
+		if self.shard:
+			params['shard'] = self.shard
+		return params
+
 	def resolve_conflicts(self):
 		"""
 		这是我们的共识算法，它通过用网络中最长的链替换我们的链来解决冲突
+		先拉取区块头选出更长的有效链，再从多个邻居并行下载分叉点之后的区块，见chainsync
 		
 		:return: 如果我们的链被替换则为True，否则为False
 		"""
+		import chainsync
+		return chainsync.HeaderSync(self).run()
 
-		neighbours = self.nodes
-		new_chain = None
+	def _traced_valid_branch(self, chain):
+		branch = self.branch_of(chain)
+		with tracing.span('valid_chain'):
+			if not self.valid_chain(branch):
+				return False
+		# 交易池中验证过的交易命中已验证缓存，只有未见过的交易需要验签
+		with tracing.span('verify_signatures'):
+			return signing.verifier.verify_blocks(branch)
 
-		# 我们只寻找比我们更长的链
-		max_length = len(self.chain)
+	def branch_of(self, chain):
+		"""
+		取出chain中需要验证的部分：分叉点之前的区块与本链相同、已经验证过，
+		只需从分叉点前的最后一个公共区块开始验证
 
-		# 从网络中的所有节点获取并验证链
-		for node in neighbours:
-			node_addr = f'http://{node}/nodes/chain'
-			# print(node_addr)
-			response = requests.get(node_addr)
+		:param chain: 邻居节点的链
+		:return: chain的后缀，以最后一个公共区块开头（没有公共区块时为整条链）
+		"""
+		fork = self.chain.fork_point(chain)
+		return chain[max(fork - 1, 0):]
 
-			if response.status_code == 200:
-				length = response.json()['length']
-				chain = response.json()['chain']
+	@property
+	def mempool_version(self):
+		return self._mempool_id, self._mempool_changes
 
-				# 检查长度是否更长且链是否有效
-				if length > max_length and self.valid_chain(chain):
-					max_length = length
-					new_chain = chain
+	@property
+	def best_tip(self):
+		"""
+		:return: 主链末端区块的哈希，按链长度缓存
+		"""
+		length = len(self.chain)
+		tip = self._tip
+		if tip is None or tip[0] != length:
+			tip = self._tip = (length, self.hash(self.chain[-1]) if length else None)
+		return tip[1]
 
-		# 如果我们发现了一个新的、有效的、比我们更长的链，则替换我们的链
-		if new_chain:
-			self.chain = new_chain
-			return True
+	def get_block(self, block_hash):
+		"""
+		在分支区块中按哈希查找区块
 
-		return False
+		:return: 区块，不存在时为None
+		"""
+		return self.branches.get(block_hash)
+
+	def replace_chain(self, new_chain):
+		"""
+		用共识选出的链替换本地链：回滚到分叉点后只写入新分支的区块，
+		被移出的区块保留为分支区块，监听者收到描述这次重组的'reorg'事件
+
+		:param new_chain: 已验证的更长的链
+		"""
+		with self.lock:
+			fork, removed = self.chain.replace(new_chain)
+			self._file_stamp = self.store.stamp()
+			for block in removed:
+				self.branches[self.hash(block)] = block
+			while len(self.branches) > MAX_BRANCH_BLOCKS:
+				self.branches.popitem(last=False)
+			self._reorg_depth.observe(len(removed))
+			if removed:
+				logger.info("区块链 %s 重组: 回滚 %d 个区块，追加 %d 个区块", self.name, len(removed), len(new_chain) - fork)
+			self._notify('reorg', Reorg(fork, removed, list(new_chain[fork:])))
 
 	@classmethod
 	def valid_chain(cls,chain):
@@ -281,12 +503,13 @@ class Blockchain(object):
 
 		last_block = chain[0]
 		current_index = 1
+		# 从创世区块开始时第一个区块同样来自邻居
+		if not cls.valid_transactions(last_block):
+			return False
 
 		while current_index < len(chain):
 			block = chain[current_index]
-			print(f'{last_block}')
-			print(f'{block}')
-			print("\n-----------\n")
+			logger.debug('%s\n%s\n-----------', last_block, block)
 			# 检查区块的哈希是否正确
 			if block['previous_hash'] != cls.hash(last_block):
 				return False
@@ -295,11 +518,55 @@ class Blockchain(object):
 			if not cls.valid_proof(last_block['proof'], block['proof']):
 				return False
 
+			# 带有交易根的区块检查交易根是否与交易一致
+			if 'tx_root' in block and block['tx_root'] != merkle_root(block['transactions']):
+				return False
+
+			# 主机名与记录必须能被派生状态解析，见records.check_transaction
+			if not cls.valid_transactions(block):
+				return False
+
 			last_block = block
 			current_index += 1
 
 		return True
 
+	@staticmethod
+	def valid_transactions(block):
+		"""
+		检查区块中每条交易的主机名与记录格式
+
+		:return: 如果全部有效则为True，否则为False
+		"""
+		try:
+			for transaction in block['transactions']:
+				rec.check_transaction(transaction)
+		except (ValueError, TypeError) as e:
+			logger.warning("区块 %s 的交易无效: %s", block.get('index'), e)
+			return False
+		return True
+
+	@classmethod
+	def valid_headers(cls, anchor, headers):
+		"""
+		只用区块头检查一段链：高度连续、previous_hash指向上一个区块头的哈希、工作量证明正确
+
+		:param anchor: 第一个区块头之前的区块头（两条链的最后一个公共区块），从创世区块开始时为None
+		:param headers: 区块头列表，见chainsync.block_header
+		:return: 如果有效则为True，否则为False
+		"""
+		last = anchor
+		for header in headers:
+			if last is not None:
+				if header['index'] != last['index'] + 1 or header['previous_hash'] != last['hash']:
+					return False
+				if not cls.valid_proof(last['proof'], header['proof']):
+					return False
+			elif header['index'] != 1:
+				return False
+			last = header
+		return True
+
 
 
 
@@ -0,0 +1,180 @@
+"""
+区块号/时间/哈希索引
+
+每条链旁边维护一个 .blkidx 文件，每个区块一条定长记录（小端序）：
+    timestamp(f64) block_hash(32)
+第i条记录对应高度i+1的区块。按高度取区块直接使用区块存储的偏移表；
+按哈希查找使用由该文件建立的内存字典；按时间范围查找在时间戳的前缀最大值与
+后缀最小值数组上二分。各节点的时钟不同，区块时间戳不一定随高度单调，
+二分给出的是包含全部范围内区块的最短高度区间，调用方再逐块按时间戳过滤。
+
+索引随链的事件增量更新：新区块只追加一条记录，重组只截断到分叉点再追加。
+只读进程（reader）不写文件，加载后在内存中补齐其余进程追加的区块。
+"""
+
+import logging
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+ENTRY = struct.Struct('<d32s')
+
+
+def index_path(chain_file):
+    """
+    链文件对应的区块索引路径，例如 data/domains.json -> data/domains.blkidx
+    """
+    return os.path.splitext(chain_file)[0] + '.blkidx'
+
+
+class BlockIndex(object):
+    def __init__(self, blockchain, read_only=False):
+        """
+        :param blockchain: 要索引的Blockchain
+        :param read_only: 只读模式，不写索引文件也不注册链监听者
+        """
+        self.blockchain = blockchain
+        self.read_only = read_only
+        self.path = index_path(blockchain.chain_file)
+        self.times = array('d')
+        # 前缀最大值 max(times[:i+1]) 与后缀最小值 min(times[i:])，都随高度单调不减
+        self.max_times = array('d')
+        self.min_times = array('d')
+        self.hashes = []
+        self.heights = {}
+        self._lock = threading.RLock()
+        self._load()
+        self.sync()
+        if not read_only:
+            blockchain.listeners.append(self._on_chain_event)
+
+    def __len__(self):
+        return len(self.times)
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = b''
+        # 忽略写了一半的最后一条记录
+        count = len(data) // ENTRY.size
+        for timestamp, digest in ENTRY.iter_unpack(data[:count * ENTRY.size]):
+            self._add(timestamp, digest.hex())
+        if not self.read_only and len(data) != count * ENTRY.size:
+            self._truncate_file(count)
+
+    def _add(self, timestamp, block_hash):
+        self.times.append(timestamp)
+        self.max_times.append(max(self.max_times[-1], timestamp) if self.max_times else timestamp)
+        # 新区块的时间戳更早时，之前各高度的后缀最小值随之降低
+        min_times = self.min_times
+        min_times.append(timestamp)
+        i = len(min_times) - 2
+        while i >= 0 and min_times[i] > timestamp:
+            min_times[i] = timestamp
+            i -= 1
+        self.hashes.append(block_hash)
+        self.heights[block_hash] = len(self.hashes)
+
+    def _truncate_file(self, length):
+        if os.path.exists(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(length * ENTRY.size)
+
+    def truncate(self, length):
+        """
+        只保留前length个区块的索引
+        """
+        with self._lock:
+            if length >= len(self.hashes):
+                return
+            for block_hash in self.hashes[length:]:
+                if self.heights.get(block_hash, 0) > length:
+                    del self.heights[block_hash]
+            del self.times[length:]
+            del self.max_times[length:]
+            del self.min_times[length:]
+            del self.hashes[length:]
+            # 被截掉的区块可能拉低了之前的后缀最小值，从末尾重新计算到不再变化为止
+            following = None
+            for i in range(length - 1, -1, -1):
+                value = self.times[i] if following is None else min(self.times[i], following)
+                if value == self.min_times[i] and following is not None:
+                    break
+                self.min_times[i] = following = value
+            if not self.read_only:
+                self._truncate_file(length)
+
+    def _fork_point(self):
+        """
+        二分查找索引中仍与链一致的前缀长度
+        """
+        chain = self.blockchain.chain
+        lo, hi = 0, min(len(self.hashes), len(chain))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.hashes[mid] == self.blockchain.hash(chain[mid]):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def sync(self):
+        """
+        使索引与链一致：截掉已不在链上的记录，再追加缺少的区块
+        """
+        with self._lock:
+            chain = self.blockchain.chain
+            length = len(chain)
+            if len(self.hashes) > length:
+                self.truncate(length)
+            if self.hashes and self.hashes[-1] != self.blockchain.hash(chain[len(self.hashes) - 1]):
+                self.truncate(self._fork_point())
+            if len(self.hashes) >= length:
+                return
+            data = bytearray()
+            for block in chain.iter(len(self.hashes)):
+                block_hash = self.blockchain.hash(block)
+                self._add(block['timestamp'], block_hash)
+                data += ENTRY.pack(block['timestamp'], bytes.fromhex(block_hash))
+            if not self.read_only:
+                with open(self.path, 'ab') as f:
+                    f.write(data)
+
+    def _on_chain_event(self, blockchain, event, block):
+        if event == 'reorg':
+            self.truncate(block.fork_point)
+        self.sync()
+
+    # ---- 查询 ----
+
+    def block_hash(self, height):
+        """
+        :param height: 区块高度（block['index']，从1开始）
+        """
+        return self.hashes[height - 1]
+
+    def height_of(self, block_hash):
+        """
+        :return: 区块哈希对应的高度，不在链上时为None
+        """
+        return self.heights.get(block_hash)
+
+    def height_range(self, start=None, end=None):
+        """
+        包含全部时间戳在[start, end)内的区块的最短高度范围；时间戳不单调时范围内可能有
+        时间戳不在[start, end)内的区块，由调用方过滤
+
+        :return: 元组 (第一个高度, 最后一个高度之后的高度)，没有区块时两者相等
+        """
+        with self._lock:
+            # 第一个前缀最大值 >= start 的高度之前，所有区块都早于start
+            lo = 0 if start is None else bisect_left(self.max_times, start)
+            # 第一个后缀最小值 >= end 的高度及之后，所有区块都不早于end
+            hi = len(self.times) if end is None else bisect_left(self.min_times, end)
+        return lo + 1, max(hi, lo) + 1
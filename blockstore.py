@@ -0,0 +1,421 @@
+"""
+追加写的区块存储
+
+每条链由两个文件组成：
+    <name>.blocks   每行一个紧凑JSON格式的区块
+    <name>.offsets  每个区块在 .blocks 中的结束偏移（u64，小端序）
+追加新区块只写入新的一行和8字节偏移，不再重写整个链文件；
+按高度读取单个区块或从某个高度开始顺序读取都不需要解析之前的区块。
+首次打开时如果只有旧格式的JSON数组链文件，会自动导入。
+可写的打开在 <name>.lock 文件锁下导入旧链文件并修复崩溃留下的不完整写入，追加与截断也持有该锁，
+多个进程或同一进程中的多个实例同时打开时，修复不会截掉另一个实例正在进行的追加；
+只读打开（reader进程、导出快照、钱包信息等）从不创建、导入、修复或截断文件，只忽略不完整的末尾。
+
+LazyChain在BlockStore之上提供与列表兼容的只读序列（len、下标、切片、遍历）
+以及append，供Blockchain.chain使用。
+"""
+
+import json
+import logging
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Sequence
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内的锁
+    fcntl = None
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# LazyChain常驻内存的链尾区块数
+RESIDENT_BLOCKS = 64
+# LazyChain中较早区块的LRU缓存容量
+CACHE_BLOCKS = 1024
+
+BLOCK_BYTES = metrics.Histogram('dns_block_bytes', '写入区块存储的区块大小（字节）', ['chain'],
+                                buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576))
+CHAIN_CACHE = metrics.Counter('dns_chain_cache_total', 'LazyChain按下标读取较早区块时LRU缓存的命中/未命中次数',
+                              ['chain', 'result'])
+
+
+class BlockStore(object):
+    def __init__(self, base_path, legacy_file=None, read_only=False):
+        """
+        :param base_path: 不带扩展名的路径，例如 data/domains
+        :param legacy_file: 旧格式（JSON数组）的链文件，存储为空时从中导入（只读打开时忽略）
+        :param read_only: 只读打开，不写任何文件；追加与截断抛出PermissionError
+        """
+        self.name = os.path.basename(base_path)
+        self.log_path = base_path + '.blocks'
+        self.offsets_path = base_path + '.offsets'
+        self.lock_path = base_path + '.lock'
+        self.read_only = read_only
+        self._lock = threading.RLock()
+        self._locked = False  # 是否持有文件锁，只在持有_lock时访问
+        self._offsets = array('Q')
+        self._stamp = None
+        if read_only:
+            self.refresh()
+            return
+        directory = os.path.dirname(self.log_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._file_lock():
+            if not os.path.exists(self.log_path) and legacy_file and os.path.exists(legacy_file):
+                self._import_legacy(legacy_file)
+            self._recover()
+
+    # ---- 打开与恢复 ----
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        写入者之间的互斥：进程内的锁加上跨进程的文件锁
+        """
+        if self.read_only:
+            raise PermissionError(f'block store {self.name} is opened read-only')
+        with self._lock:
+            if self._locked:
+                # 同一线程重入（例如导入旧链文件时追加），文件锁已经持有
+                yield
+                return
+            with open(self.lock_path, 'ab') as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                self._locked = True
+                try:
+                    yield
+                finally:
+                    self._locked = False
+
+    def _import_legacy(self, legacy_file):
+        try:
+            with open(legacy_file, 'r', encoding='utf-8') as f:
+                content = f.read().strip()
+            blocks = json.loads(content) if content else []
+        except (OSError, ValueError) as e:
+            logger.error("导入旧链文件 %s 失败: %s", legacy_file, e)
+            return
+        self._open_files()
+        self.extend(blocks)
+        logger.info("已从 %s 导入 %d 个区块", legacy_file, len(blocks))
+
+    def _open_files(self):
+        for path in (self.log_path, self.offsets_path):
+            if not os.path.exists(path):
+                open(path, 'ab').close()
+
+    def _recover(self):
+        """
+        加载偏移表，并修复崩溃留下的不完整写入：
+        偏移表缺失或超出日志长度时从日志重建，日志末尾不完整的行被截断
+        """
+        with self._file_lock():
+            self._open_files()
+            log_size = os.path.getsize(self.log_path)
+            offsets = self._read_offsets()
+            if (offsets and offsets[-1] > log_size) or (not offsets and log_size):
+                offsets = self._scan_log()
+                self._write_offsets(offsets)
+            end = offsets[-1] if offsets else 0
+            if log_size > end:
+                with open(self.log_path, 'r+b') as f:
+                    f.truncate(end)
+            self._offsets = offsets
+            self._stamp = self.stamp()
+
+    def _reload(self):
+        """
+        持有文件锁时调用：另一个写入者（其他进程或同一路径的另一个实例）追加、截断过，
+        或留下了不完整的写入时，从磁盘重新加载并修复偏移表，新区块总是写在磁盘上的末尾之后
+        """
+        end = self._offsets[-1] if self._offsets else 0
+        if self.stamp() != self._stamp or os.path.getsize(self.log_path) != end:
+            self._recover()
+
+    def _read_offsets(self):
+        offsets = array('Q')
+        try:
+            with open(self.offsets_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            if not self.read_only:
+                raise
+            return offsets
+        # 忽略写了一半的最后一项
+        data = data[:len(data) - len(data) % offsets.itemsize]
+        offsets.frombytes(data)
+        if self.read_only:
+            # 不修复：只使用已经完整写入日志的区块
+            try:
+                log_size = os.path.getsize(self.log_path)
+            except OSError:
+                log_size = 0
+            while offsets and offsets[-1] > log_size:
+                offsets.pop()
+        return offsets
+
+    def _write_offsets(self, offsets):
+        tmp_path = f'{self.offsets_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(offsets.tobytes())
+        os.replace(tmp_path, self.offsets_path)
+
+    def _scan_log(self):
+        offsets = array('Q')
+        pos = 0
+        with open(self.log_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                pos += len(line)
+                offsets.append(pos)
+        return offsets
+
+    def stamp(self):
+        """
+        存储文件的版本标记，其他进程追加或截断后会变化
+        """
+        try:
+            st = os.stat(self.offsets_path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def refresh(self):
+        """
+        如果存储被其他进程修改，重新加载偏移表
+        :return: 是否发生了变化
+        """
+        if self.stamp() == self._stamp:
+            return False
+        with self._lock:
+            self._offsets = self._read_offsets()
+            self._stamp = self.stamp()
+        return True
+
+    # ---- 读取 ----
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _span(self, i):
+        start = self._offsets[i - 1] if i > 0 else 0
+        return start, self._offsets[i] - start
+
+    def get(self, i):
+        """
+        :param i: 从0开始的区块位置（即 block['index'] - 1）
+        """
+        if i < 0:
+            i += len(self._offsets)
+        if not 0 <= i < len(self._offsets):
+            raise IndexError('block index out of range')
+        start, length = self._span(i)
+        with open(self.log_path, 'rb') as f:
+            f.seek(start)
+            return json.loads(f.read(length))
+
+    def iter(self, start=0, stop=None):
+        """
+        从start开始顺序读取区块，只打开一次文件
+        """
+        offsets = self._offsets
+        stop = len(offsets) if stop is None else min(stop, len(offsets))
+        if start >= stop:
+            return
+        begin = offsets[start - 1] if start > 0 else 0
+        with open(self.log_path, 'rb') as f:
+            f.seek(begin)
+            for _ in range(start, stop):
+                yield json.loads(f.readline())
+
+    def __iter__(self):
+        return self.iter()
+
+    # ---- 写入 ----
+
+    @staticmethod
+    def _encode(block):
+        return json.dumps(block, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    def append(self, block):
+        self.extend([block])
+
+    def extend(self, blocks):
+        """
+        追加区块：先写日志再写偏移，读者看到的偏移总是指向完整写入的数据
+        """
+        with self._file_lock():
+            if not blocks:
+                return
+            self._reload()
+            pos = self._offsets[-1] if self._offsets else 0
+            new_offsets = array('Q')
+            data = bytearray()
+            block_bytes = BLOCK_BYTES.labels(self.name)
+            for block in blocks:
+                encoded = self._encode(block)
+                block_bytes.observe(len(encoded))
+                data += encoded
+                pos += len(encoded)
+                new_offsets.append(pos)
+            with open(self.log_path, 'ab') as f:
+                f.write(data)
+            with open(self.offsets_path, 'ab') as f:
+                f.write(new_offsets.tobytes())
+            self._offsets.extend(new_offsets)
+            self._stamp = self.stamp()
+
+    def truncate(self, length):
+        """
+        只保留前length个区块
+        """
+        with self._file_lock():
+            self._reload()
+            if length >= len(self._offsets):
+                return
+            end = self._offsets[length - 1] if length > 0 else 0
+            offsets = self._offsets[:length]
+            self._write_offsets(offsets)
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(end)
+            self._offsets = offsets
+            self._stamp = self.stamp()
+
+    def clear(self):
+        self.truncate(0)
+
+
+
+class LazyChain(Sequence):
+    def __init__(self, store, resident=None, cache_size=None):
+        """
+        以区块存储为后端的惰性链：最近的resident个区块常驻内存，
+        更早的区块按需从存储读取并放入有界的LRU缓存，内存占用与链长度无关
+
+        :param store: BlockStore
+        :param resident: 常驻的链尾区块数，默认为RESIDENT_BLOCKS
+        :param cache_size: LRU缓存容量，默认为CACHE_BLOCKS
+        """
+        self.store = store
+        self.resident = resident or RESIDENT_BLOCKS
+        self.cache_size = cache_size or CACHE_BLOCKS
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()
+        self._hits = CHAIN_CACHE.labels(store.name, 'hit')
+        self._misses = CHAIN_CACHE.labels(store.name, 'miss')
+        length = len(store)
+        self._tail_start = max(0, length - self.resident)
+        self._tail = list(store.iter(self._tail_start))
+
+    def __len__(self):
+        return self._tail_start + len(self._tail)
+
+    def _normalize(self, i):
+        length = len(self)
+        if i < 0:
+            i += length
+        if not 0 <= i < length:
+            raise IndexError('chain index out of range')
+        return i
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1:
+                return list(self.iter(start, stop))
+            return [self[j] for j in range(start, stop, step)]
+        with self._lock:
+            i = self._normalize(i)
+            if i >= self._tail_start:
+                return self._tail[i - self._tail_start]
+            block = self._cache.get(i)
+            if block is not None:
+                self._cache.move_to_end(i)
+                self._hits.inc()
+                return block
+            self._misses.inc()
+            block = self.store.get(i)
+            self._remember(i, block)
+            return block
+
+    def _remember(self, i, block):
+        self._cache[i] = block
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def iter(self, start=0, stop=None):
+        """
+        顺序遍历区块，用于全链扫描；不经过LRU缓存，不会把热点区块挤出缓存
+        """
+        with self._lock:
+            # append与replace重新绑定_tail而不原地修改，遍历使用的是取出时的链尾
+            tail_start, tail = self._tail_start, self._tail
+        length = tail_start + len(tail)
+        stop = length if stop is None else min(stop, length)
+        if start < tail_start:
+            for block in self.store.iter(start, min(stop, tail_start)):
+                yield block
+            start = tail_start
+        for i in range(start, stop):
+            yield tail[i - tail_start]
+
+    def __iter__(self):
+        return self.iter()
+
+    def append(self, block):
+        """
+        追加新区块：写入存储，并放入常驻的链尾
+        """
+        with self._lock:
+            self.store.append(block)
+            tail = self._tail + [block]
+            if len(tail) > self.resident:
+                self._remember(self._tail_start, tail[0])
+                tail = tail[1:]
+                self._tail_start += 1
+            self._tail = tail
+
+    def _fork_point(self, blocks):
+        """
+        二分查找本链与blocks的第一个不同位置（两条链在分叉点之前完全相同）
+        """
+        lo, hi = 0, min(len(self), len(blocks))
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid] == blocks[mid]:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def fork_point(self, blocks):
+        """
+        :return: 本链与blocks的第一个不同位置，blocks[:fork]与本链的前fork个区块相同
+        """
+        with self._lock:
+            return self._fork_point(blocks)
+
+    def replace(self, blocks):
+        """
+        用另一条链替换本链：只截断分叉点之后的区块并写入新区块，开销与分叉深度成正比
+
+        :return: 元组 (分叉点, 被移除的区块列表)
+        """
+        with self._lock:
+            fork = self._fork_point(blocks)
+            removed = list(self.iter(fork))
+            self.store.truncate(fork)
+            self.store.extend(blocks[fork:])
+            self._cache.clear()
+            length = len(self.store)
+            self._tail_start = max(0, length - self.resident)
+            self._tail = list(self.store.iter(self._tail_start))
+            return fork, removed
@@ -1,13 +1,17 @@
 import os
 import json
-import hashlib
 import binascii
 import ecdsa
+import logging
 import time
+import tracing
 from typing import Dict, List, Tuple, Optional
 from blockchain import Blockchain
+from signing import address_from_public_key
 from dns import dns_layer
 
+logger = logging.getLogger(__name__)
+
 
 class Wallet:
     """
@@ -49,11 +53,7 @@ class Wallet:
         self.public_key = vk.to_string().hex()
         
         # 从公钥生成地址 (类似比特币的地址生成算法)
-        public_key_bytes = binascii.unhexlify(self.public_key)
-        sha256_hash = hashlib.sha256(public_key_bytes).digest()
-        ripemd160_hash = hashlib.new('ripemd160')
-        ripemd160_hash.update(sha256_hash)
-        self.address = 'DC' + binascii.hexlify(ripemd160_hash.digest()).decode('utf-8')
+        self.address = address_from_public_key(self.public_key)
         
     def _import_wallet(self, private_key: str):
         """从私钥导入钱包"""
@@ -70,11 +70,7 @@ class Wallet:
             self.public_key = vk.to_string().hex()
             
             # 从公钥生成地址
-            public_key_bytes = binascii.unhexlify(self.public_key)
-            sha256_hash = hashlib.sha256(public_key_bytes).digest()
-            ripemd160_hash = hashlib.new('ripemd160')
-            ripemd160_hash.update(sha256_hash)
-            self.address = 'DC' + binascii.hexlify(ripemd160_hash.digest()).decode('utf-8')
+            self.address = address_from_public_key(self.public_key)
         except Exception as e:
             raise ValueError(f"无效的私钥: {str(e)}")
             
@@ -103,7 +99,7 @@ class Wallet:
         """
         wallet_file = os.path.join(self.data_dir, "wallet.json")
         try:
-            with open(wallet_file, 'r') as f:
+            with tracing.span('wallet:read'), open(wallet_file, 'r') as f:
                 wallets = json.load(f)
                 # 遍历钱包列表查找匹配地址
                 for wallet in wallets:
@@ -112,7 +108,7 @@ class Wallet:
                 # 地址不存在时返回默认余额
                 return 10.0
         except Exception as e:
-            print(f"从本地钱包文件获取余额失败: {str(e)}")
+            logger.warning("从本地钱包文件获取余额失败: %s", e)
             return 10.0  # 异常时返回默认余额
     def add_balance(self, amount: float):
         """
@@ -137,10 +133,10 @@ class Wallet:
                     "balance": amount
                 })
             # 保存钱包文件
-            with open(wallet_file, 'w') as f:
+            with tracing.span('wallet:write'), open(wallet_file, 'w') as f:
                 json.dump(wallets, f, indent=2)
         except Exception as e:
-            print(f"更新本地钱包文件失败: {str(e)}")
+            logger.warning("更新本地钱包文件失败: %s", e)
 
     def get_domains(self) -> List[Dict]:
         """
@@ -186,7 +182,7 @@ class Wallet:
             if domains:
                 return domains
         except Exception as e:
-            print(f"从区块链获取域名失败: {str(e)}")
+            logger.warning("从区块链获取域名失败: %s", e)
         
         # 如果从区块链查询失败或没有域名，尝试从本地文件获取
         domains_file = os.path.join(self.data_dir, "domains.json")
@@ -238,7 +234,7 @@ class Wallet:
             with open(balance_file, 'w') as f:
                 json.dump(balances, f, indent=2)
         except Exception as e:
-            print(f"保存示例数据时出错: {str(e)}")
+            logger.warning("保存示例数据时出错: %s", e)
     
     def sign_message(self, message: str) -> str:
         """
@@ -0,0 +1,285 @@
+"""
+基于状态快照的新节点快速引导
+
+引导包包含两条链的派生状态（主机名索引、租约、余额、配额）及其链尾，以及跨链复制水位：
+    {'version', 'created', 'chains': {'register': {'height', 'tip_hash', 'checksum', 'state'}, 'dns': {...}},
+     'replication': {'height', 'hash'}, 'digest', 可选的 'public_key' 与 'signature'}
+digest是除各链state之外内容的规范JSON的SHA-256，各链state由其checksum覆盖；
+导出节点的钱包持有私钥时对digest签名。设置DNS_BOOTSTRAP_TRUSTED（逗号分隔的钱包地址）后
+只接受由其中之一签名的引导包。
+
+导入时把各链状态写成普通快照，并在 data/bootstrap.json 中记录其高度、链尾与校验和。
+链还没有同步到该高度时ChainTracker直接采用该快照提供查询；HistoryVerifier在后台
+向邻居同步链，同步完成后从创世区块重放到快照高度，校验和一致才算验证通过，
+不一致时丢弃该快照并从链重建状态。
+
+命令行（在仓库根目录，节点未运行时）：
+    python bootstrap.py export -o bootstrap.json
+    python bootstrap.py import bootstrap.json
+    python bootstrap.py import --peer host:port
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import blockchain as bc
+import metrics
+import signing
+import snapshot
+from chainstate import ChainState, ChainTracker
+from replication import watermark_path, write_watermark
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_VERSION = 1
+MARKER_FILE = 'bootstrap.json'
+# 逗号分隔的受信任的引导包签名者地址，为空时只校验校验和
+TRUSTED_SIGNERS = [a for a in os.environ.get('DNS_BOOTSTRAP_TRUSTED', '').split(',') if a]
+# 后台验证在链尚未同步到快照高度时重试同步的间隔（秒）
+SYNC_INTERVAL = 5
+
+BOOTSTRAP_PENDING = metrics.Gauge('dns_bootstrap_pending', '已采用引导快照、历史尚未验证的链', ['chain'])
+BOOTSTRAP_VERIFICATIONS = metrics.Counter('dns_bootstrap_verifications_total', '引导快照的历史验证结果', ['result'])
+
+
+class BootstrapError(ValueError):
+    pass
+
+
+def marker_path(data_dir):
+    return os.path.join(data_dir, MARKER_FILE)
+
+
+def read_marker(data_dir):
+    """
+    :return: 引导记录 {'chains': {name: {'height', 'tip_hash', 'checksum'}}, 'peers': [...]}，没有时为None
+    """
+    try:
+        with open(marker_path(data_dir), 'r', encoding='utf-8') as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return marker if marker.get('chains') else None
+
+
+def write_marker(data_dir, marker):
+    path = marker_path(data_dir)
+    if marker.get('chains'):
+        bc.atomic_write_json(path, marker)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def bundle_digest(bundle):
+    summary = {
+        'version': bundle['version'],
+        'created': bundle['created'],
+        'chains': {name: {k: chain[k] for k in ('height', 'tip_hash', 'checksum')}
+                   for name, chain in bundle['chains'].items()},
+        'replication': bundle.get('replication'),
+    }
+    encoded = json.dumps(summary, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def make_bundle(trackers, data_dir, wallet=None):
+    """
+    :param trackers: 链名 -> ChainTracker
+    :param wallet: 可选的持有私钥的Wallet，用于对引导包签名
+    :return: 引导包
+    """
+    chains = {}
+    for name, tracker in trackers.items():
+        state, checksum = tracker.export_state()
+        chains[name] = {'height': state['height'], 'tip_hash': state['tip_hash'],
+                        'checksum': checksum, 'state': state}
+    try:
+        with open(watermark_path(data_dir), 'r', encoding='utf-8') as f:
+            replication = json.load(f)
+    except (OSError, ValueError):
+        replication = None
+    bundle = {'version': BUNDLE_VERSION, 'created': time.time(), 'chains': chains, 'replication': replication}
+    bundle['digest'] = bundle_digest(bundle)
+    if wallet is not None and wallet.private_key:
+        bundle['public_key'] = wallet.public_key
+        bundle['signature'] = wallet.sign_message(bundle['digest'])
+    return bundle
+
+
+def verify_bundle(bundle, trusted=None):
+    """
+    校验引导包的版本、各链状态的校验和、摘要与签名
+
+    :param trusted: 受信任的签名者地址列表，默认为TRUSTED_SIGNERS；为空时不要求签名
+    :return: 各链的 链名 -> ChainState
+    :raise BootstrapError: 校验失败
+    """
+    trusted = TRUSTED_SIGNERS if trusted is None else trusted
+    try:
+        if bundle.get('version') != BUNDLE_VERSION:
+            raise BootstrapError(f"unsupported bundle version: {bundle.get('version')}")
+        states = {}
+        for name, chain in bundle['chains'].items():
+            state = ChainState.from_dict(chain['state'])
+            if state.checksum() != chain['checksum'] or state.height != chain['height'] \
+                    or state.tip_hash != chain['tip_hash']:
+                raise BootstrapError(f'checksum mismatch for chain {name}')
+            states[name] = state
+        if bundle_digest(bundle) != bundle['digest']:
+            raise BootstrapError('bundle digest mismatch')
+    except (KeyError, TypeError, AttributeError) as e:
+        raise BootstrapError(f'malformed bundle: {e}')
+    if 'signature' in bundle:
+        signer = signing.address_from_public_key(bundle['public_key'])
+        if not signing.verify_message(bundle['digest'], bundle['public_key'], bundle['signature'], signer):
+            raise BootstrapError('invalid bundle signature')
+        if trusted and signer not in trusted:
+            raise BootstrapError(f'bundle signed by untrusted address {signer}')
+    elif trusted:
+        raise BootstrapError('unsigned bundle')
+    return states
+
+
+def install_bundle(bundle, data_dir, peers=()):
+    """
+    校验并安装引导包：写入各链的快照、引导记录与复制水位
+
+    :param peers: 后台同步历史时使用的邻居地址
+    :raise BootstrapError: 校验失败
+    """
+    states = verify_bundle(bundle)
+    snapshot_dir = os.path.join(data_dir, 'snapshots')
+    marker = {'chains': {}, 'peers': list(peers)}
+    for name, state in states.items():
+        snapshot.write_snapshot(snapshot_dir, name, state)
+        chain = bundle['chains'][name]
+        marker['chains'][name] = {k: chain[k] for k in ('height', 'tip_hash', 'checksum')}
+    write_marker(data_dir, marker)
+    replication = bundle.get('replication')
+    if replication:
+        write_watermark(watermark_path(data_dir), replication['height'], replication['hash'])
+    logger.info("已安装引导快照: %s",
+                ', '.join(f'{name}@{chain["height"]}' for name, chain in marker['chains'].items()))
+
+
+class HistoryVerifier(object):
+    def __init__(self, layer, marker):
+        """
+        :param layer: dns_layer，其trackers已采用引导快照
+        :param marker: read_marker的结果
+        """
+        self.layer = layer
+        self.marker = marker
+        self._thread = None
+        for name in marker['chains']:
+            BOOTSTRAP_PENDING.labels(name).set_function(lambda name=name: int(name in self.marker['chains']))
+
+    def start(self):
+        for blockchain in (self.layer.register_blockchain, self.layer.dns_blockchain):
+            for peer in self.marker.get('peers', ()):
+                blockchain.register_node(peer)
+        self._thread = threading.Thread(target=self._run, name='bootstrap-verifier', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self.marker['chains']:
+            for name in list(self.marker['chains']):
+                tracker = self.layer.trackers[name]
+                try:
+                    if tracker.bootstrapping or len(tracker.blockchain.chain) < self.marker['chains'][name]['height']:
+                        tracker.blockchain.resolve_conflicts()
+                    if not tracker.bootstrapping:
+                        self._verify(name, tracker)
+                except Exception as e:
+                    logger.exception("验证引导快照 %s 失败: %s", name, e)
+            if self.marker['chains']:
+                time.sleep(SYNC_INTERVAL)
+
+    def _verify(self, name, tracker):
+        """
+        从创世区块重放到快照高度，与快照的校验和比较；链还没有同步到快照高度时继续等待
+        """
+        info = self.marker['chains'][name]
+        blockchain = tracker.blockchain
+        height = info['height']
+        if len(blockchain.chain) < height:
+            # 例如链在同步中被重新加载、跟踪器不再使用快照：还不能判断快照是否与历史一致
+            logger.info("链 %s 只有 %d 个区块，等待同步到引导快照高度 %d", name, len(blockchain.chain), height)
+            return
+        state = ChainState()
+        try:
+            for block in blockchain.chain.iter(0, height):
+                state.apply_block(block, blockchain.hash(block))
+        except ValueError as e:
+            logger.error("重放链 %s 失败: %s", name, e)
+            state = None
+        if state is not None and state.tip_hash == info['tip_hash'] and state.checksum() == info['checksum']:
+            BOOTSTRAP_VERIFICATIONS.labels('valid').inc()
+            logger.info("引导快照 %s@%d 的历史验证通过", name, height)
+        else:
+            # 快照与链的历史不一致：丢弃快照，从链重建状态
+            BOOTSTRAP_VERIFICATIONS.labels('invalid').inc()
+            logger.error("引导快照 %s@%d 与链的历史不一致，从链重建状态", name, height)
+            snapshot.remove_snapshots(tracker.snapshot_dir, name, height)
+            tracker.bootstrap = None
+            tracker.start()
+        del self.marker['chains'][name]
+        write_marker(self.layer.data_dir, self.marker)
+
+
+def _open_trackers(data_dir):
+    snapshot_dir = os.path.join(data_dir, 'snapshots')
+    trackers = {}
+    for name, chain_file in (('register', 'register.json'), ('dns', 'domains.json')):
+        # 节点可能正在运行：只读打开，不修复存储、不写索引与快照
+        blockchain = bc.Blockchain('', os.path.join(data_dir, chain_file), name, read_only=True)
+        trackers[name] = ChainTracker(blockchain, name, snapshot_dir, read_only=True)
+        trackers[name].start()
+    return trackers
+
+
+def main(argv=None):
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description='export or import a state snapshot bundle')
+    parser.add_argument('--data-dir', default='data', help='node data directory (default: data)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    export = sub.add_parser('export', help='write a bundle from the local chains')
+    export.add_argument('-o', '--output', default='bootstrap.json', help='output file')
+    imp = sub.add_parser('import', help='install a bundle from a file or a peer')
+    imp.add_argument('file', nargs='?', help='bundle file written by export')
+    imp.add_argument('--peer', help='download the bundle from this peer (host:port)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level='INFO', format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    if args.command == 'export':
+        bundle = make_bundle(_open_trackers(args.data_dir), args.data_dir)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(bundle, f, ensure_ascii=False, separators=(',', ':'))
+        print(f"wrote {args.output}: " +
+              ', '.join(f"{name}@{chain['height']}" for name, chain in bundle['chains'].items()))
+        return 0
+
+    if bool(args.file) == bool(args.peer):
+        parser.error('import needs either a bundle file or --peer')
+    if args.peer:
+        response = bc.peer_get(args.peer, '/nodes/snapshot', timeout=120)
+        if response.status_code != 200:
+            parser.error(f'{args.peer} returned {response.status_code}')
+        bundle = response.json()
+    else:
+        with open(args.file, 'r', encoding='utf-8') as f:
+            bundle = json.load(f)
+    os.makedirs(args.data_dir, exist_ok=True)
+    try:
+        install_bundle(bundle, args.data_dir, peers=[args.peer] if args.peer else ())
+    except BootstrapError as e:
+        parser.error(f'invalid bundle: {e}')
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,125 @@
+"""
+缓存工具
+
+TTLCache: 带过期时间的有界LRU缓存
+SingleFlight: 合并对同一个键的并发请求，只有第一个调用者真正执行，其余等待其结果
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheEntry(object):
+    __slots__ = ('value', 'expires', 'ttl', 'hits')
+
+    def __init__(self, value, expires, ttl):
+        self.value = value
+        self.expires = expires
+        self.ttl = ttl
+        self.hits = 0
+
+    def remaining(self, now):
+        return self.expires - now
+
+
+class TTLCache(object):
+    def __init__(self, capacity, clock=time.monotonic):
+        """
+        :param capacity: 最多缓存的条目数，超出时淘汰最久未使用的条目
+        :param clock: 时钟函数，便于替换
+        """
+        self.capacity = capacity
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def entry(self, key):
+        """
+        :return: 未过期的CacheEntry（同时计一次命中），不存在或已过期时为None
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            entry.hits += 1
+            return entry
+
+    def get(self, key, default=None):
+        entry = self.entry(key)
+        return default if entry is None else entry.value
+
+    def set(self, key, value, ttl):
+        """
+        :param ttl: 存活时间（秒），不大于0时不缓存
+        """
+        if ttl <= 0:
+            return
+        entry = CacheEntry(value, self.clock() + ttl, ttl)
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry.value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """
+        执行fn()并返回结果；同一个键上已有进行中的调用时等待它的结果（或异常）
+
+        :return: 元组 (结果, 是否与进行中的调用合并)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self, key):
+        return key in self._calls
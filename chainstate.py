@@ -0,0 +1,345 @@
+"""
+由区块链推导出的状态：主机名索引、租约表、代币余额、配额和链尾
+
+ChainState可以逐块增量更新，也可以序列化为快照；ChainTracker把一条链的
+ChainState与主机名索引文件、快照文件绑定在一起，启动时加载最近的快照并只
+重放快照之后的区块，之后随每个新区块增量更新；索引文件随新区块原地插入新主机名，
+只有重新加载时整体重建（见hostindex.IndexWriter）。
+ChainState为最近的UNDO_DEPTH个区块保留撤销记录，链重组时只撤销分叉点之后的
+区块再应用新分支的区块，索引文件也只删除、替换这些区块涉及的主机名，开销与分叉深度
+成正比；更深的重组退回到从快照恢复。
+"""
+
+import hashlib
+import itertools
+import json
+import threading
+from collections import deque
+
+import snapshot
+import tracing
+from blockchain import SAVE_SECONDS
+from hostindex import HostIndex, IndexWriter, index_path, make_record
+
+# 一年租期对应的秒数
+LEASE_SECONDS = 31536000
+# 初始代币/配额
+INITIAL_TOKENS = 10
+# 每隔多少个区块写一次快照
+SNAPSHOT_INTERVAL = 100
+# 保留撤销记录的区块数，即能增量处理的最大重组深度
+UNDO_DEPTH = 1000
+
+_MISSING = object()
+
+
+class ChainState(object):
+    def __init__(self):
+        self.height = 0
+        self.tip_hash = None
+        self.records = {}     # hostname -> 索引记录，同一主机名以最早上链的为准
+        self.leases = {}      # hostname -> 租约到期时间
+        self.balances = {}    # node_id -> 相对初始值的代币变化
+        self.rewards = {}     # wallet -> 奖励交易的总额（配额）
+        self.source_txs = {}  # 区块来源地址 -> 其区块中不属于自己的交易数（配额）
+        # 最近区块的撤销记录 (应用前的height, 应用前的tip_hash, [(表, 键, 原值)])，不写入快照
+        self.undo = deque(maxlen=UNDO_DEPTH)
+
+    @staticmethod
+    def _set(changes, table, key, value):
+        changes.append((table, key, table.get(key, _MISSING)))
+        table[key] = value
+
+    def _add(self, changes, table, key, amount):
+        self._set(changes, table, key, table.get(key, 0) + amount)
+
+    def apply_block(self, block, block_hash):
+        """
+        把一个区块应用到状态上
+
+        :param block: 区块
+        :param block_hash: 该区块的哈希
+        :return: 该区块首次上链的主机名列表
+        :raise ValueError: 区块中有无法解析的交易，此时状态保持不变
+        """
+        changes = []
+        try:
+            self._apply_transactions(block, changes)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            # 整个区块解析成功后才生效：撤销已做的修改
+            self._revert(changes)
+            raise ValueError(f"block {block.get('index')} cannot be applied: {e}")
+        self.undo.append((self.height, self.tip_hash, changes))
+        self.height = block['index']
+        self.tip_hash = block_hash
+        return [key for table, key, _ in changes if table is self.records]
+
+    def _apply_transactions(self, block, changes):
+        source = block.get('source')
+        for tx in block['transactions']:
+            hostname = tx.get('hostname')
+            if hostname is not None and hostname not in self.records:
+                self._set(changes, self.records, hostname, make_record(tx, block))
+                self._set(changes, self.leases, hostname, block['timestamp'] + tx.get('lease_years', 1) * LEASE_SECONDS)
+
+            # 配额，与Blockchain.quota的计算方式一致
+            wallet = tx.get('wallet')
+            if wallet is not None:
+                self._add(changes, self.rewards, wallet, tx.get('reward', 0))
+            if wallet != source:
+                self._add(changes, self.source_txs, source, 1)
+
+            # 代币余额，与dns_layer.get_user_tokens的计算方式一致
+            if 'node' in tx and 'reward' in tx:
+                self._add(changes, self.balances, tx['node'], tx['reward'])
+            elif tx.get('type') == 'token_payment':
+                self._add(changes, self.balances, tx['from'], -tx['amount'])
+            elif tx.get('type') == 'token_transfer':
+                self._add(changes, self.balances, tx['from'], -tx['amount'])
+                if tx['to'] != tx['from']:
+                    self._add(changes, self.balances, tx['to'], tx['amount'])
+
+    @staticmethod
+    def _revert(changes):
+        for table, key, previous in reversed(changes):
+            if previous is _MISSING:
+                del table[key]
+            else:
+                table[key] = previous
+
+    def can_rollback(self, height):
+        """
+        :return: 撤销记录是否足以回滚到height
+        """
+        return 0 <= self.height - height <= len(self.undo)
+
+    def undone_records(self, height):
+        """
+        :return: dict, 回滚到height个区块时会被撤销的区块首次上链的 hostname -> 当前记录
+        """
+        records = {}
+        for _, _, changes in itertools.islice(reversed(self.undo), self.height - height):
+            for table, key, _ in changes:
+                if table is self.records:
+                    records[key] = self.records[key]
+        return records
+
+    def undo_block(self):
+        """
+        撤销最近应用的一个区块
+        """
+        height, tip_hash, changes = self.undo.pop()
+        self._revert(changes)
+        self.height = height
+        self.tip_hash = tip_hash
+
+    def quota(self, address):
+        return INITIAL_TOKENS + self.rewards.get(address, 0) - self.source_txs.get(address, 0)
+
+    def tokens(self, node_id):
+        """
+        已上链交易决定的代币余额（不含交易池中的交易）
+        """
+        return INITIAL_TOKENS + self.balances.get(node_id, 0)
+
+    def to_dict(self):
+        return {
+            'height': self.height,
+            'tip_hash': self.tip_hash,
+            'records': self.records,
+            'leases': self.leases,
+            'balances': self.balances,
+            'rewards': self.rewards,
+            'source_txs': self.source_txs,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        for key, value in data.items():
+            setattr(state, key, value)
+        return state
+
+    def checksum(self):
+        encoded = json.dumps(self.to_dict(), sort_keys=True, separators=(',', ':')).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()
+
+
+class ChainTracker(object):
+    def __init__(self, blockchain, name, snapshot_dir, snapshot_interval=None, bootstrap=None, read_only=False):
+        """
+        :param blockchain: 要跟踪的区块链
+        :param name: 链名（'register' 或 'dns'），用作快照文件名
+        :param snapshot_dir: 快照目录
+        :param snapshot_interval: 每隔多少个区块写一次快照，默认为SNAPSHOT_INTERVAL
+        :param bootstrap: 可选的引导快照 {'height', 'tip_hash', 'checksum'}（见bootstrap.py），
+            链还没有同步到该高度时直接采用该快照
+        :param read_only: 只在内存中推导状态，不写索引文件与快照（例如在运行中的节点旁导出快照）
+        """
+        self.blockchain = blockchain
+        self.name = name
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval or SNAPSHOT_INTERVAL
+        self.bootstrap = bootstrap
+        self.read_only = read_only
+        # 是否正在使用链上还没有的引导快照提供查询
+        self.bootstrapping = False
+        self.index = HostIndex(index_path(blockchain.chain_file))
+        self._index_writer = IndexWriter(self.index.path, self._index_snapshot)
+        self.state = ChainState()
+        self._snapshot_height = 0
+        self._index_seconds = SAVE_SECONDS.labels(f'{blockchain.name}.idx')
+        self._snapshot_seconds = SAVE_SECONDS.labels(f'{name}.snapshot')
+        # 出块线程与同步线程可能同时通知同一条链的事件，状态的修改与快照需要串行
+        self._lock = threading.RLock()
+        blockchain.listeners.append(self.on_chain_event)
+
+    def _matches_chain(self, state):
+        chain = self.blockchain.chain
+        if state.height == 0:
+            return True
+        if state.height > len(chain):
+            return False
+        return self.blockchain.hash(chain[state.height - 1]) == state.tip_hash
+
+    def start(self):
+        """
+        加载与当前链一致的最新快照，重放其后的区块，并保证索引文件与状态一致
+        """
+        with self._lock:
+            self._start()
+
+    def _is_bootstrap(self, state):
+        return self.bootstrap is not None and state.height > len(self.blockchain.chain) and \
+            (state.height, state.tip_hash) == (self.bootstrap['height'], self.bootstrap['tip_hash'])
+
+    def _start(self):
+        state = None
+        self.bootstrapping = False
+        for candidate in snapshot.load_snapshots(self.snapshot_dir, self.name):
+            if self._matches_chain(candidate):
+                state = candidate
+                break
+            if self._is_bootstrap(candidate):
+                # 链还没有同步到引导快照的高度：先用快照提供查询，链追上后再按普通快照加载
+                self.bootstrapping = True
+                self.state = candidate
+                self._snapshot_height = candidate.height
+                if self.index.tip != (candidate.height, candidate.tip_hash):
+                    self._write_index()
+                return
+        if state is None:
+            state = ChainState()
+        self._snapshot_height = state.height
+        self.state = state
+        self._replay()
+        if self.index.tip != (self.state.height, self.state.tip_hash):
+            self._write_index()
+
+    def _replay(self):
+        for block in self.blockchain.chain.iter(self.state.height):
+            self.state.apply_block(block, self.blockchain.hash(block))
+        self._maybe_snapshot()
+
+    def _index_snapshot(self):
+        with self._lock:
+            return dict(self.state.records), self.state.height, self.state.tip_hash
+
+    def _write_index(self):
+        if self.read_only:
+            return
+        with self._index_seconds.timer(), tracing.span(f'index:{self.name}'):
+            self._index_writer.rebuild(self.state.records, self.state.height, self.state.tip_hash)
+
+    def _update_index(self, hostnames):
+        if self.read_only:
+            return
+        records = {hostname: self.state.records[hostname] for hostname in hostnames}
+        with self._index_seconds.timer(), tracing.span(f'index:{self.name}'):
+            self._index_writer.add(records, self.state.height, self.state.tip_hash)
+
+    def _patch_index(self, undone, hostnames):
+        """
+        :param undone: 被撤销的区块首次上链的 hostname -> 重组前的记录
+        :param hostnames: 新分支的区块首次上链的主机名
+        """
+        if self.read_only:
+            return
+        records = self.state.records
+        changed = {hostname: records[hostname] for hostname in hostnames if records[hostname] != undone.get(hostname)}
+        removed = [hostname for hostname in undone if hostname not in records]
+        with self._index_seconds.timer(), tracing.span(f'index:{self.name}'):
+            self._index_writer.patch(changed, removed, self.state.height, self.state.tip_hash)
+
+    def _maybe_snapshot(self):
+        if self.state.height - self._snapshot_height >= self.snapshot_interval:
+            self.write_snapshot()
+
+    def write_snapshot(self):
+        if self.read_only:
+            return
+        with self._snapshot_seconds.timer(), tracing.span(f'snapshot:{self.name}'):
+            snapshot.write_snapshot(self.snapshot_dir, self.name, self.state)
+        self._snapshot_height = self.state.height
+
+    def rollback(self, height):
+        """
+        用撤销记录把状态回滚到height个区块
+
+        :return: 回滚后的状态与当前链一致时为True；撤销记录不足时不做任何修改并返回False
+        """
+        if not self.state.can_rollback(height):
+            return False
+        while self.state.height > height:
+            self.state.undo_block()
+        return self._matches_chain(self.state)
+
+    def on_chain_event(self, blockchain, event, block):
+        with self._lock:
+            self._on_chain_event(blockchain, event, block)
+
+    def export_state(self):
+        """
+        :return: 元组 (状态的可序列化副本, 校验和)
+        """
+        with self._lock:
+            data = self.state.to_dict()
+            data = {key: dict(value) if isinstance(value, dict) else value for key, value in data.items()}
+            return data, self.state.checksum()
+
+    def records(self):
+        """
+        :return: 当前全部 (主机名, 索引记录) 的列表副本
+        """
+        with self._lock:
+            return list(self.state.records.items())
+
+    def _on_chain_event(self, blockchain, event, block):
+        if self.bootstrapping:
+            # 引导快照之前的历史区块不影响状态，链同步到快照高度后重新加载
+            if len(blockchain.chain) >= self.state.height:
+                self._start()
+            return
+        if event == 'block':
+            self._update_index(self.state.apply_block(block, blockchain.hash(block)))
+            self._maybe_snapshot()
+        elif event == 'reorg' and self.state.can_rollback(block.fork_point):
+            # 只撤销分叉点之后的区块并应用新分支的区块
+            undone = self.state.undone_records(block.fork_point)
+            if not self.rollback(block.fork_point):
+                self._start()
+                return
+            hostnames = []
+            for added in block.added:
+                hostnames += self.state.apply_block(added, blockchain.hash(added))
+            if undone:
+                self._patch_index(undone, hostnames)
+            else:
+                # 没有撤销任何主机名（例如只是追加了区块）：与新区块一样原地插入
+                self._update_index(hostnames)
+            # 分叉点之后的快照已不在主链上，加载时会按链尾哈希跳过
+            self._snapshot_height = min(self._snapshot_height, block.fork_point)
+            self._maybe_snapshot()
+        else:
+            # 链被重新加载或重组超出撤销记录：从与新链一致的快照恢复
+            self._start()
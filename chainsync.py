@@ -0,0 +1,293 @@
+"""
+先同步区块头、再并行下载区块体的链同步
+
+1. 并行向链尾信息过期的邻居探测链高度与链尾哈希（GET /nodes/tip）
+2. 按链高度、分数从高到低选择宣告了更长链的邻居，分批拉取紧凑的区块头
+   （index, previous_hash, proof, timestamp, tx_root, hash，见block_header），
+   向前回溯找到与本链的最后一个公共区块，只用区块头检查高度、哈希链接与工作量证明
+3. 把分叉点之后的区块按BODY_RANGE个一段，并行地从所有宣告了足够长链的邻居下载，
+   每段校验区块的哈希、高度、前一区块哈希、工作量证明与交易根都与已验证的区块头一致，失败时换一个邻居重试
+4. 从最后一个公共区块起用valid_chain验证下载的区块，并校验交易签名后，以 本链[:分叉点] + 下载的区块 替换本链
+
+不支持区块头接口的旧节点（/nodes/headers返回404）退回到拉取整条链。
+"""
+
+import logging
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import blockchain as bc
+import metrics
+import signing
+import tracing
+from merkle import block_tx_root, merkle_root
+
+logger = logging.getLogger(__name__)
+
+# 服务端一次返回的最多区块头数与区块数
+MAX_HEADERS = 2000
+MAX_BODY_RANGE = 200
+# 每个下载任务的区块数
+BODY_RANGE = 50
+# 每段区块最多尝试的邻居数
+RANGE_RETRIES = 3
+# 探测与下载的并发数
+SYNC_WORKERS = 8
+# 寻找分叉点时首次回溯的区块数，不匹配时加倍
+LOOKBACK = 16
+
+SYNCED_BLOCKS = metrics.Counter('dns_sync_blocks_total', '链同步下载的区块数', ['chain'])
+SYNC_RETRIES = metrics.Counter('dns_sync_range_retries_total', '链同步中换邻居重试的区块段数', ['chain'])
+
+
+class SyncError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def _valid_chain(chain):
+    """
+    验证下载的区块；运行时提供了进程池（blockchain.pow_executor）时在进程池中执行，
+    验证期间不占用本进程的GIL
+    """
+    if bc.pow_executor is None:
+        return bc.Blockchain.valid_chain(chain)
+    return bc.pow_executor.submit(bc.Blockchain.valid_chain, chain).result()
+
+
+def block_header(block, block_hash):
+    """
+    :param block_hash: 区块的哈希，由调用方提供以便使用已有的索引
+    :return: 区块头
+    """
+    return {
+        'index': block['index'],
+        'previous_hash': block['previous_hash'],
+        'proof': block['proof'],
+        'timestamp': block['timestamp'],
+        'tx_root': block_tx_root(block),
+        'hash': block_hash,
+    }
+
+
+def matches_header(block, header, block_hash):
+    """
+    旧区块的哈希覆盖整个区块，区块头中的其余字段只是邻居的声明，需要逐一与区块比较
+
+    :param block_hash: 区块的哈希
+    :return: 区块与区块头一致时为True，区块格式不正确时为False
+    """
+    try:
+        return block_hash == header['hash'] and block['index'] == header['index'] and \
+            block['previous_hash'] == header['previous_hash'] and block['proof'] == header['proof'] and \
+            merkle_root(block['transactions']) == header['tx_root']
+    except (KeyError, TypeError):
+        return False
+
+
+class _Splice(Sequence):
+    """
+    本链的前fork个区块加上新下载的区块，不需要把本链读入内存
+    """
+
+    def __init__(self, base, fork, tail):
+        self.base = base
+        self.fork = fork
+        self.tail = tail
+
+    def __len__(self):
+        return self.fork + len(self.tail)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return self.base[i] if i < self.fork else self.tail[i - self.fork]
+
+
+class HeaderSync(object):
+    def __init__(self, blockchain, workers=SYNC_WORKERS):
+        """
+        :param blockchain: 要同步的Blockchain，从它的邻居节点表选择邻居
+        :param workers: 探测与下载的并发数
+        """
+        self.blockchain = blockchain
+        self.peers = blockchain.nodes
+        self.workers = workers
+        self._synced = SYNCED_BLOCKS.labels(blockchain.name)
+        self._retries = SYNC_RETRIES.labels(blockchain.name)
+
+    def _get(self, node, path, **params):
+        params.update(self.blockchain.peer_params())
+        try:
+            response = bc.peer_get(node, path, peers=self.peers, params=params)
+        except requests.RequestException as e:
+            raise SyncError(f'请求 {node}{path} 失败: {e}')
+        if response.status_code != 200:
+            raise SyncError(f'{node}{path} 返回 {response.status_code}', response.status_code)
+        return response.json()
+
+    def probe(self):
+        """
+        并行探测链尾信息过期的邻居
+        """
+        nodes = self.peers.stale_tips()
+        if not nodes:
+            return
+
+        def probe_one(node):
+            try:
+                data = self._get(node, '/nodes/tip')
+            except SyncError as e:
+                logger.warning("探测链尾失败: %s", e)
+                return
+            self.peers.observe_tip(node, data['length'], data['tip'])
+
+        with ThreadPoolExecutor(min(self.workers, len(nodes))) as pool:
+            list(pool.map(probe_one, nodes))
+
+    def _local_hash(self, height):
+        return self.blockchain.hash(self.blockchain.chain[height - 1])
+
+    def fetch_headers(self, node, remote_length):
+        """
+        从node拉取本链与它的最后一个公共区块之后的区块头
+
+        :return: 元组 (分叉点, 公共区块的区块头或None, 分叉点之后的区块头列表)
+        :raise SyncError: 请求失败
+        """
+        local = len(self.blockchain.chain)
+        lookback = LOOKBACK
+        while True:
+            start = max(min(local, remote_length) - lookback + 1, 1)
+            headers = self._get(node, '/nodes/headers', start=start, limit=MAX_HEADERS)['headers']
+            if not headers:
+                raise SyncError(f'{node} 没有返回区块头')
+            fork = start - 1
+            for header in headers:
+                if header['index'] > local or header['hash'] != self._local_hash(header['index']):
+                    break
+                fork = header['index']
+            # 第一个区块头就不同时继续向前回溯，回溯到创世区块仍不同则两条链没有公共区块
+            if fork >= start or start == 1:
+                break
+            lookback *= 2
+
+        tail = [header for header in headers if header['index'] > fork]
+        while len(headers) == MAX_HEADERS and tail and tail[-1]['index'] < remote_length:
+            headers = self._get(node, '/nodes/headers', start=tail[-1]['index'] + 1, limit=MAX_HEADERS)['headers']
+            tail += headers
+        anchor = None
+        if fork:
+            block = self.blockchain.chain[fork - 1]
+            anchor = block_header(block, self.blockchain.hash(block))
+        return fork, anchor, tail
+
+    def fetch_bodies(self, headers, nodes):
+        """
+        按段并行下载headers对应的区块，每段轮换邻居重试
+
+        :param nodes: 可下载的邻居地址，至少一个
+        :return: 区块列表
+        :raise SyncError: 某一段在所有重试后仍然失败
+        """
+        chunks = [headers[i:i + BODY_RANGE] for i in range(0, len(headers), BODY_RANGE)]
+
+        def download(k):
+            chunk = chunks[k]
+            for attempt in range(RANGE_RETRIES):
+                node = nodes[(k + attempt) % len(nodes)]
+                if attempt:
+                    self._retries.inc()
+                try:
+                    blocks = self._get(node, '/nodes/blocks', start=chunk[0]['index'],
+                                       end=chunk[-1]['index'] + 1)['blocks']
+                except SyncError as e:
+                    logger.warning("下载区块失败: %s", e)
+                    continue
+                if len(blocks) == len(chunk) and \
+                        all(matches_header(block, header, self.blockchain.hash(block))
+                            for block, header in zip(blocks, chunk)):
+                    return blocks
+                logger.warning("邻居 %s 返回的区块 %d-%d 与区块头不一致", node, chunk[0]['index'], chunk[-1]['index'])
+            raise SyncError(f"区块 {chunk[0]['index']}-{chunk[-1]['index']} 下载失败")
+
+        pool = ThreadPoolExecutor(min(self.workers, len(chunks)))
+        try:
+            results = list(pool.map(download, range(len(chunks))))
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        return [block for blocks in results for block in blocks]
+
+    def _sync_from(self, node, remote_length):
+        chain = self.blockchain.chain
+        with tracing.span(f'headers:{node}'):
+            fork, anchor, headers = self.fetch_headers(node, remote_length)
+        if fork + len(headers) <= len(chain):
+            return False
+        if not self.blockchain.valid_headers(anchor, headers):
+            logger.warning("邻居 %s 的区块头无效", node)
+            return False
+
+        # 所有宣告了更长链的邻居都参与下载，区块头的来源排在最前
+        sources = [node] + [n for n in self.peers.sync_candidates(fork, limit=self.workers) if n != node]
+        with tracing.span('bodies'):
+            blocks = self.fetch_bodies(headers, sources)
+        self._synced.inc(len(blocks))
+        # 区块头只证明了邻居声明的链接，区块本身仍需从最后一个公共区块起完整验证
+        with tracing.span('valid_chain'):
+            if not _valid_chain(([chain[fork - 1]] if fork else []) + blocks):
+                logger.warning("邻居 %s 的区块无效", node)
+                return False
+        with tracing.span('verify_signatures'):
+            if not signing.verifier.verify_blocks(blocks):
+                return False
+
+        # 下载期间本链可能已经变化；检查与替换在链锁内完成，期间不会有新区块
+        with self.blockchain.lock:
+            chain = self.blockchain.chain
+            if fork > len(chain) or (fork and self._local_hash(fork) != anchor['hash']) or \
+                    fork + len(blocks) <= len(chain):
+                return False
+            self.blockchain.replace_chain(_Splice(chain, fork, blocks))
+        return True
+
+    def _sync_full(self, node):
+        """
+        从不支持区块头接口的邻居拉取整条链
+        """
+        data = self._get(node, '/nodes/chain')
+        chain = data['chain']
+        if data['length'] <= len(self.blockchain.chain) or not self.blockchain._traced_valid_branch(chain):
+            return False
+        with self.blockchain.lock:
+            if data['length'] <= len(self.blockchain.chain):
+                return False
+            self.blockchain.replace_chain(chain)
+        return True
+
+    def run(self):
+        """
+        :return: 如果本链被替换则为True，否则为False
+        """
+        self.probe()
+        for node in self.peers.sync_candidates(len(self.blockchain.chain)):
+            peer = self.peers.get(node)
+            if peer is None:
+                continue
+            try:
+                try:
+                    if self._sync_from(node, peer.tip_height):
+                        return True
+                except SyncError as e:
+                    if e.status != 404:
+                        raise
+                    if self._sync_full(node):
+                        return True
+            except SyncError as e:
+                logger.warning("从邻居 %s 同步失败: %s", node, e)
+        return False
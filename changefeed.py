@@ -0,0 +1,278 @@
+"""
+链上变更的推送订阅
+
+每条链一个EventFeed，作为链监听者由Blockchain.new_block（以及重组、重新加载）直接驱动，
+把事件放进有界的内存环形缓冲区并唤醒等待中的订阅者。事件类型：
+    hostname       区块中的一条域名交易（新注册或记录变更）
+    block          新区块，排在该区块的hostname事件之后
+    lease_expired  域名租约到期，由订阅者等待时按租约到期时间检查
+    reorg          链重组回滚到fork_point个区块，之后是新分支的区块事件
+    reset          链被重新加载，订阅者应重新获取状态
+
+每个事件的id即游标：链事件为 '区块高度:交易序号'（block事件的交易序号为区块的交易数，
+即排在区块内所有交易之后）；其余事件在当前链位置之后加 '~序号'。
+订阅者带上最后收到的游标恢复订阅：游标仍在缓冲区内时从缓冲区续传；
+已被挤出缓冲区（或进程重启）时按游标的链位置从区块存储重放链事件，
+此时缓冲区外的lease_expired事件不会补发。
+
+等待事件的订阅者（长轮询与事件流）各占用一个线程，同时等待的订阅者数以MAX_SUBSCRIBERS为上限，
+超出时拒绝新订阅；异步节点在独立的有界线程池中处理订阅，不占用处理普通请求的线程（见aio_node）。
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+import records as rec
+from chainstate import LEASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# 缓冲区保留的最近事件数
+FEED_BUFFER = 4096
+# 一次返回的最多事件数
+MAX_EVENTS = 500
+# 同时等待事件的订阅者上限
+MAX_SUBSCRIBERS = int(os.environ.get('DNS_FEED_SUBSCRIBERS', '64'))
+
+EVENTS_PUBLISHED = metrics.Counter('dns_feed_events_total', '发布到变更订阅的事件数', ['chain', 'type'])
+FEED_REPLAYS = metrics.Counter('dns_feed_replays_total', '游标不在缓冲区内、从区块存储重放的订阅次数')
+FEED_SUBSCRIBERS = metrics.Gauge('dns_feed_subscribers', '正在等待事件的订阅者数')
+FEED_REJECTED = metrics.Counter('dns_feed_rejected_total', '超出订阅者上限被拒绝的订阅数')
+
+_subscribers = threading.BoundedSemaphore(MAX_SUBSCRIBERS)
+_active = 0
+_active_lock = threading.Lock()
+FEED_SUBSCRIBERS.labels().set_function(lambda: _active)
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+def subscribe():
+    """
+    占用一个订阅者名额
+
+    :return: 释放名额的函数，重复调用只释放一次
+    :raise TooManySubscribers: 订阅者已达上限
+    """
+    global _active
+    if not _subscribers.acquire(blocking=False):
+        FEED_REJECTED.inc()
+        raise TooManySubscribers(f'too many event subscribers (max {MAX_SUBSCRIBERS})')
+    with _active_lock:
+        _active += 1
+    released = []
+
+    def release():
+        global _active
+        with _active_lock:
+            if released:
+                return
+            released.append(True)
+            _active -= 1
+        _subscribers.release()
+    return release
+
+
+def parse_cursor(cursor):
+    """
+    :param cursor: 事件id，'区块高度:交易序号' 或 '区块高度:交易序号~序号'
+    :return: 元组 (区块高度, 交易序号)
+    :raise ValueError: 游标格式不正确
+    """
+    height, tx_index = cursor.split('~', 1)[0].split(':', 1)
+    height, tx_index = int(height), int(tx_index)
+    if height < 0 or tx_index < 0:
+        raise ValueError(f'invalid cursor: {cursor}')
+    return height, tx_index
+
+
+def block_events(chain_name, block, block_hash, after=-1):
+    """
+    由区块生成链事件：每条域名交易一个hostname事件，最后是block事件
+
+    :param after: 只生成交易序号大于after的事件
+    """
+    events = []
+    transactions = block['transactions']
+    for i in range(after + 1, len(transactions)):
+        tx = transactions[i]
+        if 'hostname' not in tx:
+            continue
+        events.append({
+            'id': f"{block['index']}:{i}",
+            'type': 'hostname',
+            'chain': chain_name,
+            'hostname': tx['hostname'],
+            'block_index': block['index'],
+            'tx_index': i,
+            'node_id': tx.get('node_id'),
+            'records': rec.record_sets(tx),
+            'expires': block['timestamp'] + tx.get('lease_years', 1) * LEASE_SECONDS,
+        })
+    if after < len(transactions):
+        events.append({
+            'id': f"{block['index']}:{len(transactions)}",
+            'type': 'block',
+            'chain': chain_name,
+            'block_index': block['index'],
+            'hash': block_hash,
+            'timestamp': block['timestamp'],
+            'transactions': len(transactions),
+        })
+    return events
+
+
+class EventFeed(object):
+    def __init__(self, blockchain, chain_name, leases=None, clock=time.time):
+        """
+        :param blockchain: 订阅的Blockchain
+        :param chain_name: 'register' 或 'dns'
+        :param leases: 无参函数，返回当前的 主机名 -> 租约到期时间；None时不产生lease_expired事件
+        :param clock: 时钟函数，便于替换
+        """
+        self.blockchain = blockchain
+        self.chain_name = chain_name
+        self.leases = leases
+        self.clock = clock
+        self.seq = 0
+        self._events = deque(maxlen=FEED_BUFFER)
+        self._positions = {}  # 事件id -> seq，用于按游标定位
+        self._expiries = []   # 堆 (到期时间, 主机名)
+        self._cond = threading.Condition()
+        self._position = self._tip_position()
+        if leases is not None:
+            now = clock()
+            self._expiries = [(expires, hostname) for hostname, expires in leases().items() if expires > now]
+            heapq.heapify(self._expiries)
+        blockchain.listeners.append(self._on_chain_event)
+
+    def _tip_position(self):
+        chain = self.blockchain.chain
+        if not len(chain):
+            return 0, 0
+        return len(chain), len(chain[-1]['transactions'])
+
+    def tip_cursor(self):
+        return '%d:%d' % self._tip_position()
+
+    def _publish(self, events):
+        with self._cond:
+            for event in events:
+                if event['type'] in ('block', 'hostname'):
+                    self._position = (event['block_index'], int(event['id'].split(':')[1]))
+                else:
+                    event['id'] = '%d:%d~%d' % (self._position + (self.seq + 1,))
+                if len(self._events) == self._events.maxlen:
+                    self._positions.pop(self._events[0][1]['id'], None)
+                self.seq += 1
+                self._events.append((self.seq, event))
+                self._positions[event['id']] = self.seq
+                EVENTS_PUBLISHED.labels(self.chain_name, event['type']).inc()
+                if event['type'] == 'hostname':
+                    heapq.heappush(self._expiries, (event['expires'], event['hostname']))
+            self._cond.notify_all()
+
+    def _on_chain_event(self, blockchain, event, block):
+        if event == 'block':
+            self._publish(block_events(self.chain_name, block, blockchain.hash(block)))
+        elif event == 'reorg':
+            fork = block.fork_point
+            with self._cond:
+                self._position = (fork, len(blockchain.chain[fork - 1]['transactions']) if fork else 0)
+            events = [{'type': 'reorg', 'chain': self.chain_name, 'fork_point': block.fork_point,
+                       'removed': len(block.removed)}]
+            for added in block.added:
+                events += block_events(self.chain_name, added, blockchain.hash(added))
+            self._publish(events)
+        elif event == 'reset':
+            with self._cond:
+                self._position = self._tip_position()
+            self._publish([{'type': 'reset', 'chain': self.chain_name, 'length': len(blockchain.chain)}])
+
+    def check_leases(self):
+        """
+        发布已到期租约的lease_expired事件
+
+        :return: 距下一个租约到期的秒数，没有待到期的租约时为None
+        """
+        if self.leases is None:
+            return None
+        now = self.clock()
+        expired = []
+        with self._cond:
+            leases = self.leases()
+            while self._expiries and self._expiries[0][0] <= now:
+                expires, hostname = heapq.heappop(self._expiries)
+                # 主机名以最早上链的为准，后来的交易不改变租约
+                if leases.get(hostname) == expires:
+                    expired.append({'type': 'lease_expired', 'chain': self.chain_name,
+                                    'hostname': hostname, 'expires': expires})
+            if expired:
+                self._publish(expired)
+            return self._expiries[0][0] - now if self._expiries else None
+
+    def _replay(self, cursor, limit):
+        """
+        按游标的链位置从区块存储重放链事件
+        """
+        FEED_REPLAYS.inc()
+        height, tx_index = parse_cursor(cursor)
+        chain = self.blockchain.chain
+        events = []
+        if height > len(chain):
+            # 游标所在的区块已被重组移除或链被替换
+            return [{'id': '%d:%d~0' % self._tip_position(), 'type': 'reset',
+                     'chain': self.chain_name, 'length': len(chain)}]
+        if height > 0:
+            block = chain[height - 1]
+            events += block_events(self.chain_name, block, self.blockchain.hash(block), tx_index)
+        for block in chain.iter(height):
+            if len(events) >= limit:
+                break
+            events += block_events(self.chain_name, block, self.blockchain.hash(block))
+        return events[:limit]
+
+    def events_after(self, cursor=None, limit=MAX_EVENTS):
+        """
+        :param cursor: 最后收到的事件id，None表示只要之后的新事件
+        :return: 元组 (游标之后的事件列表, 当前seq)，seq用于wait
+        :raise ValueError: 游标格式不正确
+        """
+        with self._cond:
+            seq = self.seq
+            if cursor is None:
+                return [], seq
+            start = self._positions.get(cursor)
+            if start is not None:
+                offset = start - self._events[0][0] + 1
+                return [event for _, event in itertools.islice(self._events, offset, offset + limit)], seq
+        if parse_cursor(cursor) == self._tip_position():
+            return [], seq
+        return self._replay(cursor, limit), seq
+
+    def wait(self, seq, timeout):
+        """
+        等待seq之后的新事件或租约到期
+
+        :return: 是否有新事件
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            next_expiry = self.check_leases()
+            with self._cond:
+                if self.seq != seq:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                if next_expiry is not None:
+                    remaining = min(remaining, max(next_expiry, 0.01))
+                self._cond.wait(remaining)
@@ -1,195 +1,512 @@
 import blockchain as bc
+import bootstrap
+import metrics
+import records as rec
+import signing
+from replication import Replicator
+from cache import SingleFlight, TTLCache
+import tracing
+from blockindex import BlockIndex
+from changefeed import EventFeed
+from chainsync import MAX_BODY_RANGE, MAX_HEADERS, block_header
+from chainstate import ChainTracker
+from follower import Follower
+from hostindex import HostIndex, index_path, make_record
+from merkle import light_header, merkle_proof
+from shards import ShardRouter, shard_dir, shard_file
+import logging
+import multiprocessing
 import requests
 import re
 import json
 import os
-from time import time
+from time import time, perf_counter
 """
 Define the format of DNS transaction here
 dns_transaction = {
 	'hostname':hostname,
 	'ip':ip,
-	'port':port
+	'port':port,
+	'records':[{'type':'A','value':ip,'ttl':300}, ...]  # 可选，见records.py
 }
 """
 import atexit
 import threading
-import time as _time
+from concurrent.futures import ProcessPoolExecutor
 
-TMP_REGISTER_FILE = os.path.join('data', 'tmp_register.json')
-TMP_DOMAINS_FILE = os.path.join('data', 'tmp_domains.json')
+# 定时强制出块的间隔（秒）
+FLUSH_INTERVAL = 60
+# 查询缓存的容量和存活时间（秒）。本进程出块或写入临时缓冲时立即失效；
+# 只读进程看不到writer的事件，其结果最多滞后LOOKUP_CACHE_TTL秒
+LOOKUP_CACHE_SIZE = 10000
+LOOKUP_CACHE_TTL = 5
+
+# 区块浏览接口每页的默认/最大条数
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# 可选的节点运行时（见aio_node.AsyncNode）。设置后由它负责定时出块、
+# 广播和共识请求，dns_layer不再为此创建线程
+node_runtime = None
+
+logger = logging.getLogger(__name__)
+
+# 查询结果按来源统计：dns链、未上链的tmp缓冲或未命中（miss）
+LOOKUPS = metrics.Counter('dns_lookups_total', '主机名查询次数', ['source'])
+LOOKUP_SECONDS = metrics.Histogram('dns_lookup_seconds', '主机名查询耗时（秒）', ['source'])
+_LOOKUP_SOURCES = {source: (LOOKUPS.labels(source), LOOKUP_SECONDS.labels(source))
+	for source in ('dns', 'tmp', 'miss')}
+LOOKUP_CACHE = metrics.Counter('dns_lookup_cache_total',
+	'查询缓存：hit命中，miss未命中并查询索引，coalesced合并到进行中的相同查询', ['result'])
+_CACHE_HIT, _CACHE_MISS, _CACHE_COALESCED = (LOOKUP_CACHE.labels(r) for r in ('hit', 'miss', 'coalesced'))
+
+
+def _pending_entries(path):
+	try:
+		with open(path, 'r', encoding='utf-8') as f:
+			content = f.read().strip()
+		return len(json.loads(content)) if content else 0
+	except (OSError, ValueError):
+		return 0
+
+
+
+def open_shards(node_identifier, count=1, data_dir='data', **kwargs):
+	"""
+	打开主机名空间的各个分片，见shards.py
+	:param count: 分片数
+	:param kwargs: 传给每个dns_layer的参数（read_only、follow）
+	:return: ShardRouter，0号分片使用data_dir本身
+	"""
+	if count > 1 and bc.pow_executor is None and not kwargs.get('read_only') and not kwargs.get('follow'):
+		# 各分片的出块线程在进程池中并行计算PoW，不受GIL限制
+		bc.pow_executor = ProcessPoolExecutor(max_workers=min(count, os.cpu_count() or 1),
+											  mp_context=multiprocessing.get_context('spawn'))
+	return ShardRouter([dns_layer(node_identifier, shard=shard, data_dir=data_dir, **kwargs)
+						for shard in range(count)])
 
 class dns_layer(object):
-	def __init__(self, node_identifier):
+	def __init__(self, node_identifier, read_only=False, follow=None, shard=0, data_dir='data'):
 		"""
 		初始化区块链对象
 		BUFFER_MAX_LEN是每个区块的条目数
+		:param read_only: 只读模式（多进程部署中的读进程），不出块、不保存、不启动定时器，
+			只在链文件变化时重新加载
+		:param follow: 上游节点地址列表，给出时作为只读跟随节点运行（见follower.py）：
+			不出块、不做跨链复制、不启动定时器，只从上游同步区块
+		:param shard: 分片号（见shards.py），0号分片使用data_dir本身和原来的文件名
+		:param data_dir: 节点的数据目录
 		"""
-		self.register_blockchain = bc.Blockchain(node_identifier)
-		self.dns_blockchain = bc.Blockchain(node_identifier)
 		self.BUFFER_MAX_LEN = 10  # 修改为10条交易自动出块
 		self.MINE_REWARD = 10
 		self.node_identifier = node_identifier
-		self.data_dir = "data"
-		
-		# 为两个区块链设置不同的数据文件
-		self.register_blockchain.chain_file = os.path.join(self.data_dir, "register.json")  # 修改文件名
-		self.dns_blockchain.chain_file = os.path.join(self.data_dir, "domains.json")  # 修改文件名
-		
+		self.read_only = read_only
+		self.shard = shard
+		self.data_dir = shard_dir(data_dir, shard)
+		# 所属的ShardRouter，由它构造时设置；按主机名的请求转交负责该主机名的分片
+		self.router = None
+		self.tmp_register_file = shard_file(data_dir, shard, 'tmp_register')
+		self.tmp_domains_file = shard_file(data_dir, shard, 'tmp_domains')
+
 		# 确保数据目录存在
 		if not os.path.exists(self.data_dir):
 			os.makedirs(self.data_dir)
-			
-		# 加载持久化数据
-		self.load_data()
-		# 注册退出时只保存一次数据
-		atexit.register(self.save_data)
+
+		# 为两个区块链设置不同的数据文件，构造时即从区块存储加载
+		self.register_blockchain = bc.Blockchain(node_identifier, shard_file(data_dir, shard, 'register'), 'register',
+												 read_only=read_only)
+		self.dns_blockchain = bc.Blockchain(node_identifier, shard_file(data_dir, shard, 'domains'), 'dns',
+											read_only=read_only)
+		for blockchain, tmp_file in ((self.register_blockchain, self.tmp_register_file),
+									 (self.dns_blockchain, self.tmp_domains_file)):
+			blockchain.shard = shard
+			bc.MEMPOOL_DEPTH.labels(blockchain.name, 'tmp').set_function(lambda tmp_file=tmp_file: _pending_entries(tmp_file))
+		# 区块浏览用的区块号/时间/哈希索引
+		self.block_indexes = {
+			'register': BlockIndex(self.register_blockchain, read_only),
+			'dns': BlockIndex(self.dns_blockchain, read_only),
+		}
+
+		# 派生状态与主机名索引：读进程只映射索引文件；其余情况从最近的快照恢复状态，
+		# 只重放快照之后的区块，之后随每个新区块更新索引并定期写快照
+		self.trackers = {}
+		if read_only:
+			self.register_index = HostIndex(index_path(self.register_blockchain.chain_file))
+			self.dns_index = HostIndex(index_path(self.dns_blockchain.chain_file))
+		else:
+			snapshot_dir = os.path.join(self.data_dir, 'snapshots')
+			# 由引导快照启动的节点先用快照提供查询，在后台同步并验证历史
+			marker = bootstrap.read_marker(self.data_dir) or {'chains': {}}
+			self.trackers['register'] = ChainTracker(self.register_blockchain, 'register', snapshot_dir,
+													 bootstrap=marker['chains'].get('register'))
+			self.trackers['dns'] = ChainTracker(self.dns_blockchain, 'dns', snapshot_dir,
+												bootstrap=marker['chains'].get('dns'))
+			for tracker in self.trackers.values():
+				tracker.start()
+			self.register_index = self.trackers['register'].index
+			self.dns_index = self.trackers['dns'].index
+		# 主机名 -> (来源, 记录) 的查询缓存，未命中的结果同样缓存；
+		# 在索引更新之后才失效，因此监听者注册在ChainTracker之后
+		self.lookup_cache = TTLCache(LOOKUP_CACHE_SIZE)
+		self._lookup_flights = SingleFlight()
+		self._cache_generation = 0
+		for blockchain in (self.register_blockchain, self.dns_blockchain):
+			blockchain.listeners.append(self._on_chain_event)
+		# 推送订阅的事件源，注册在ChainTracker之后，事件发出时状态与索引已经更新
+		self.feeds = {}
+		if not read_only:
+			for name, blockchain in (('register', self.register_blockchain), ('dns', self.dns_blockchain)):
+				tracker = self.trackers[name]
+				self.feeds[name] = EventFeed(blockchain, name, leases=lambda tracker=tracker: tracker.state.leases)
 		self._dns_timer = None
-		self._start_dns_timer()
 		self._register_timer = None
-		self._start_register_timer()
+		self._stopped = threading.Event()
+		self.replicator = None
+		self.follower = None
+		self.history_verifier = None
+		if read_only:
+			return
+		if follow:
+			# 跟随节点的区块全部来自上游，同步时即已写入区块存储
+			self.follower = Follower(self, follow)
+			self.follower.start()
+		else:
+			# 注册链上确认的域名由后台线程异步复制到DNS链，DNS链是查询的唯一来源
+			self.replicator = Replicator(self)
+			# 注册退出时只保存一次数据
+			atexit.register(self.save_data)
+			if node_runtime is not None:
+				node_runtime.attach(self)
+			else:
+				self._start_dns_timer()
+				self._start_register_timer()
+			self.replicator.start()
+		if marker['chains']:
+			self.history_verifier = bootstrap.HistoryVerifier(self, marker)
+			self.history_verifier.start()
+
+	def stop(self):
+		"""
+		停止定时出块、跨链复制与跟随上游的后台线程；换钱包时重新打开dns_layer之前调用，
+		旧的线程不会再对同一组数据文件出块或复制
+		"""
+		self._stopped.set()
+		if self.replicator is not None:
+			self.replicator.stop()
+		if self.follower is not None:
+			self.follower.stop()
 
 	def _start_dns_timer(self):
 		# 每分钟强制出块，将tmp_domains.json中的记录写入domains.json
 		def force_dns_block():
-			while True:
-				_time.sleep(60)
+			while not self._stopped.wait(FLUSH_INTERVAL):
 				self.flush_tmp_domains()
 		t = threading.Thread(target=force_dns_block, daemon=True)
 		t.start()
 		self._dns_timer = t
 
 	def flush_tmp_domains(self):
-		if os.path.exists(TMP_DOMAINS_FILE):
-			with open(TMP_DOMAINS_FILE, 'r', encoding='utf-8') as f:
+		# 与new_entry的缓冲写入和满10条出块在同一把链锁下，缓冲中的条目不会被重复或遗漏
+		with self.dns_blockchain.lock:
+			if not os.path.exists(self.tmp_domains_file):
+				return
+			with open(self.tmp_domains_file, 'r', encoding='utf-8') as f:
 				tmp_data = json.load(f)
-			if tmp_data:
-				for entry in tmp_data:
-					self.dns_blockchain.new_transaction(entry)
-				self.mine_dns_block()
-				with open(TMP_DOMAINS_FILE, 'w', encoding='utf-8') as f:
-					json.dump([], f)
+			if not tmp_data:
+				return
+			for entry in tmp_data:
+				self.dns_blockchain.new_transaction(entry)
+			self.mine_locked('dns')
+			bc.atomic_write_json(self.tmp_domains_file, [])
+		self.publish_block('dns')
 
 	def _start_register_timer(self):
 		# 每分钟强制出块，将tmp_register.json中的记录写入register.json
 		def force_register_block():
-			while True:
-				_time.sleep(60)
+			while not self._stopped.wait(FLUSH_INTERVAL):
 				self.flush_tmp_register()
 		t = threading.Thread(target=force_register_block, daemon=True)
 		t.start()
 		self._register_timer = t
 
 	def flush_tmp_register(self):
-		if os.path.exists(TMP_REGISTER_FILE):
-			with open(TMP_REGISTER_FILE, 'r', encoding='utf-8') as f:
+		# 与new_entry的缓冲写入和满10条出块在同一把链锁下，缓冲中的条目不会被重复或遗漏
+		with self.register_blockchain.lock:
+			if not os.path.exists(self.tmp_register_file):
+				return
+			with open(self.tmp_register_file, 'r', encoding='utf-8') as f:
 				tmp_data = json.load(f)
-			if tmp_data:
-				for entry in tmp_data:
-					self.register_blockchain.new_transaction(entry)
-				self.mine_register_block()
-				with open(TMP_REGISTER_FILE, 'w', encoding='utf-8') as f:
-					json.dump([], f)
+			if not tmp_data:
+				return
+			for entry in tmp_data:
+				self.register_blockchain.new_transaction(entry)
+			self.mine_locked('register')
+			bc.atomic_write_json(self.tmp_register_file, [])
+		self.publish_block('register')
 
 	def lookup(self, hostname):
 		"""
-		先从domains.json（区块链）查找DNS记录，查不到再查tmp_domains.json，查到则返回未上链标记
+		先从DNS链的主机名索引（domains.idx）查找DNS记录，查不到再查tmp_domains.json，查到则返回未上链标记；
+		注册链上的域名经跨链复制进入DNS链后才能查到
 		:param hostname: string, 要查找的目标主机名
 		:return: 一个元组 (ip,port, on_chain)
 		"""
-		self.load_data()  # 每次查询前强制从文件加载最新链数据
-		# 先从DNS区块链中查找
-		for block in self.dns_blockchain.chain:
-			transactions = block['transactions']
-			for transaction in transactions:
-				if 'hostname' in transaction and transaction['hostname'] == hostname:
-					return (transaction['ip'], transaction['port'], True)
-		# 再从注册区块链中查找
-		for block in self.register_blockchain.chain:
-			transactions = block['transactions']
-			for transaction in transactions:
-				if 'hostname' in transaction and transaction['hostname'] == hostname:
-					return (transaction['ip'], transaction['port'], True)
-		
-		
+		source, record = self._owner(hostname)._lookup(hostname)
+		if record is None:
+			raise LookupError('No existing entry matching hostname')
+		return (record.get('ip') or '', record.get('port') or '', source != 'tmp')
+
+	def query(self, hostname, qtype=None):
+		"""
+		查找主机名的完整应答：按类型分组的记录集，并跟随CNAME把目标主机名的记录一并返回
+		:param hostname: string, 要查找的目标主机名
+		:param qtype: string, 只返回该类型（以及途经的CNAME），None表示全部类型
+		:return: dict {'ip', 'port', 'on_chain', 'records'}，records为 {'name','type','ttl','rdata'} 列表
+		"""
+		return self._answer(hostname, self._owner(hostname)._lookup(hostname), qtype)
+
+	def _answer(self, hostname, found, qtype):
+		"""
+		由主机名自身的查找结果组装query的应答，CNAME的目标主机名再逐个查找
+		:param found: 元组 (来源, 记录)，即_lookup的返回值
+		"""
+		source, record = found
+		if record is None:
+			raise LookupError('No existing entry matching hostname')
+		result = {'ip': record.get('ip') or '', 'port': record.get('port') or ''}
+		on_chain = source != 'tmp'
+		answers = []
+		seen = {hostname}
+		name = hostname
+		for _ in range(rec.MAX_CNAME_DEPTH):
+			sets = record.get('records') or {}
+			cname = sets.get('CNAME')
+			if cname and qtype != 'CNAME':
+				answers += [{'name': name, 'type': 'CNAME', 'ttl': cname['ttl'], 'rdata': r} for r in cname['rdata']]
+				name = cname['rdata'][0]
+				if name in seen:
+					break
+				seen.add(name)
+				source, record = self._owner(name)._lookup(name)
+				if record is None:
+					break
+				on_chain = on_chain and source != 'tmp'
+				continue
+			for rtype, rset in sets.items():
+				if qtype is None or rtype == qtype:
+					answers += [{'name': name, 'type': rtype, 'ttl': rset['ttl'], 'rdata': r} for r in rset['rdata']]
+			break
+		result['on_chain'] = on_chain
+		result['records'] = answers
+		return result
+
+	def query_many(self, hostnames, qtype=None):
+		"""
+		批量查询，按顺序对每个主机名产生一个结果，单个主机名的错误不影响其余主机名
+		:param hostnames: 主机名列表
+		:param qtype: 见query
+		:return: 生成器，产生 (hostname, result, error)，result与query的返回值相同，出错时为None
+		"""
+		hostnames = list(hostnames)
+		# 先按分片一次性查出全部主机名：每个分片只打开一次索引、读一次tmp_domains.json
+		shards = {}
+		for hostname in hostnames:
+			if isinstance(hostname, str) and hostname:
+				shards.setdefault(self._owner(hostname), []).append(hostname)
+		found = {}
+		for layer, names in shards.items():
+			found.update(layer._lookup_many(names))
+		for hostname in hostnames:
+			if not isinstance(hostname, str) or not hostname:
+				yield hostname, None, 'invalid hostname'
+				continue
+			try:
+				yield hostname, self._answer(hostname, found[hostname], qtype), None
+			except LookupError:
+				yield hostname, None, 'not found'
+
+	def _owner(self, hostname):
+		"""
+		:return: 负责该主机名的分片的dns_layer，不分片时为self
+		"""
+		return self if self.router is None else self.router.layer_for(hostname)
+
+	def _lookup(self, hostname):
+		"""
+		:return: 元组 (来源, 记录)，来源为'dns'、'tmp'或'miss'，未找到时记录为None
+		"""
+		start = perf_counter()
+		with tracing.span('lookup'):
+			cached = self.lookup_cache.get(hostname)
+			if cached is not None:
+				_CACHE_HIT.inc()
+				source, record = cached
+			else:
+				generation = self._cache_generation
+				(source, record), shared = self._lookup_flights.do(hostname, lambda: self._find_any(hostname))
+				if shared:
+					_CACHE_COALESCED.inc()
+				else:
+					_CACHE_MISS.inc()
+					# 查询期间缓存被失效时不写入，避免缓存失效前的旧结果
+					if generation == self._cache_generation:
+						self.lookup_cache.set(hostname, (source, record), LOOKUP_CACHE_TTL)
+		count, seconds = _LOOKUP_SOURCES[source]
+		count.inc()
+		seconds.observe(perf_counter() - start)
+		return source, record
+
+	def _lookup_many(self, hostnames):
+		"""
+		批量版的_lookup：缓存未命中的主机名一起查找，不参与单个查询的合并
+		:return: dict，主机名 -> (来源, 记录)
+		"""
+		start = perf_counter()
+		found = {}
+		misses = []
+		with tracing.span('lookup_many'):
+			for hostname in dict.fromkeys(hostnames):
+				cached = self.lookup_cache.get(hostname)
+				if cached is not None:
+					_CACHE_HIT.inc()
+					found[hostname] = cached
+				else:
+					misses.append(hostname)
+			if misses:
+				generation = self._cache_generation
+				fresh = self._find_many(misses)
+				_CACHE_MISS.inc(len(misses))
+				for hostname in misses:
+					found[hostname] = fresh[hostname]
+					if generation == self._cache_generation:
+						self.lookup_cache.set(hostname, fresh[hostname], LOOKUP_CACHE_TTL)
+		# 耗时按主机名平均计入各来源
+		seconds = (perf_counter() - start) / max(len(found), 1)
+		for source, _ in found.values():
+			count, histogram = _LOOKUP_SOURCES[source]
+			count.inc()
+			histogram.observe(seconds)
+		return found
+
+	def invalidate_lookup_cache(self):
+		self._cache_generation += 1
+		self.lookup_cache.clear()
+
+	def _on_chain_event(self, blockchain, event, block):
+		self.invalidate_lookup_cache()
+
+	def _find_any(self, hostname):
+		# 先从DNS区块链的索引中查找
+		record = self._find_record(self.dns_index, self.dns_blockchain, hostname)
+		if record is not None:
+			return 'dns', record
+
 		# 查tmp_domains.json
-		if os.path.exists(TMP_DOMAINS_FILE):
-			with open(TMP_DOMAINS_FILE, 'r', encoding='utf-8') as f:
+		if os.path.exists(self.tmp_domains_file):
+			with open(self.tmp_domains_file, 'r', encoding='utf-8') as f:
 				tmp_data = json.load(f)
 			for entry in tmp_data:
 				if entry.get('hostname') == hostname:
-					return (entry.get('ip', ''), entry.get('port', ''), False)
-		raise LookupError('No existing entry matching hostname')
+					return 'tmp', {'ip': entry.get('ip', ''), 'port': entry.get('port', ''),
+								   'records': rec.record_sets(entry)}
+		return 'miss', None
 
-	def mine_register_block(self):
+	def _find_many(self, hostnames):
+		"""
+		批量版的_find_any
+		:return: dict，主机名 -> (来源, 记录)
 		"""
-		挖掘注册区块链的新区块，并自动同步到DNS区块链（domains.json）
-		"""
-		last_block = self.register_blockchain.last_block
-		last_proof = last_block['proof']
-		proof = self.register_blockchain.proof_of_work(last_proof)
-
-		# Forge the new Block by adding it to the chain
-		previous_hash = self.register_blockchain.hash(last_block)
-		block = self.register_blockchain.new_block(proof, previous_hash)
-
-		# --- 跨链：将新上链的注册域名自动同步到DNS区块链 ---
-		for tx in block['transactions']:
-			if 'hostname' in tx and 'ip' in tx and 'port' in tx:
-				dns_tx = {
-					'hostname': tx['hostname'],
-					'ip': tx['ip'],
-					'port': tx['port'],
-					'node_id': tx.get('node_id', self.node_identifier),
-					'lease_years': tx.get('lease_years', 1)
-				}
-				self.dns_blockchain.new_transaction(dns_tx)
-		# 如果DNS缓冲区满则自动出块
-		if len(self.dns_blockchain.current_transactions) >= self.BUFFER_MAX_LEN:
-			self.mine_dns_block()
+		records = self._find_records(self.dns_index, self.dns_blockchain, hostnames)
+		found = {hostname: ('dns', record) for hostname, record in records.items() if record is not None}
+		pending = {hostname for hostname in hostnames if hostname not in found}
+		if pending and os.path.exists(self.tmp_domains_file):
+			with open(self.tmp_domains_file, 'r', encoding='utf-8') as f:
+				tmp_data = json.load(f)
+			for entry in tmp_data:
+				hostname = entry.get('hostname')
+				if hostname in pending:
+					pending.discard(hostname)
+					found[hostname] = ('tmp', {'ip': entry.get('ip', ''), 'port': entry.get('port', ''),
+											   'records': rec.record_sets(entry)})
+		for hostname in pending:
+			found[hostname] = ('miss', None)
+		return found
 
-		# broadcast request for all neighbor to resolve conflict
-		self.broadcast_new_block(blockchain_type='register')
+	@staticmethod
+	def _find_records(index, blockchain, hostnames):
+		"""
+		批量版的_find_record，索引不可用时只扫描一遍区块链
+		:return: dict，主机名 -> 记录字典，不存在时为None
+		"""
+		if index.available:
+			return index.get_many(hostnames)
+		records = dict.fromkeys(hostnames)
+		blockchain.refresh()
+		for block in blockchain.chain:
+			for transaction in block['transactions']:
+				hostname = transaction.get('hostname')
+				if hostname in records and records[hostname] is None:
+					records[hostname] = make_record(transaction, block)
+		return records
+
+	@staticmethod
+	def _find_record(index, blockchain, hostname):
+		"""
+		从主机名索引中查找记录；索引文件尚不可用时退回到扫描区块链
+		"""
+		if index.available:
+			return index.get(hostname)
+		blockchain.refresh()
+		for block in blockchain.chain:
+			for transaction in block['transactions']:
+				if transaction.get('hostname') == hostname:
+					return make_record(transaction, block)
+		return None
+
+	def mine_register_block(self):
+		"""
+		挖掘注册区块链的新区块；新上链的注册域名由Replicator异步复制到DNS区块链
+		"""
+		block = self.mine_locked('register')
+		self.publish_block('register')
+		return block['proof']
 
-		# now add a special transaction that signifies the reward mechanism
-		new_transaction = {
-		'node':self.node_identifier,
-		'block_index':block['index']
-		}
-		self.register_blockchain.new_transaction(new_transaction)
-		
-		# Save blockchain data
-		self.save_data()
-		
-		return proof
-		
 	def mine_dns_block(self):
 		"""
 		挖掘普通DNS区块链的新区块
 		"""
-		last_block = self.dns_blockchain.last_block
-		last_proof = last_block['proof']
-		proof = self.dns_blockchain.proof_of_work(last_proof)
+		block = self.mine_locked('dns')
+		self.publish_block('dns')
+		return block['proof']
 
-		# Forge the new Block by adding it to the chain
-		previous_hash = self.dns_blockchain.hash(last_block)
-		block = self.dns_blockchain.new_block(proof, previous_hash)
+	def mine_locked(self, blockchain_type):
+		"""
+		在链锁内取链尾、出块并加入出块奖励交易，不会与同步、定时出块或跨链复制交错；
+		调用方释放链锁后再调用publish_block
 
-		# broadcast request for all neighbor to resolve conflict
-		self.broadcast_new_block(blockchain_type='dns')
+		:param blockchain_type: 'register' 或 'dns'
+		:return: 新区块
+		"""
+		blockchain = self.register_blockchain if blockchain_type == 'register' else self.dns_blockchain
+		with blockchain.lock:
+			block = blockchain.mine()
+			# now add a special transaction that signifies the reward mechanism
+			blockchain.new_transaction({
+				'node': self.node_identifier,
+				'block_index': block['index']
+			})
+		return block
 
-		# now add a special transaction that signifies the reward mechanism
-		new_transaction = {
-		'node':self.node_identifier,
-		'block_index':block['index']
-		}
-		self.dns_blockchain.new_transaction(new_transaction)
-		
-		# Save blockchain data
+	def publish_block(self, blockchain_type):
+		"""
+		广播新区块并保存数据；在链锁外调用，等待邻居期间不阻塞同步、出块与跨链复制
+
+		:param blockchain_type: 'register' 或 'dns'
+		"""
+		# broadcast request for all neighbor to resolve conflict
+		self.broadcast_new_block(blockchain_type=blockchain_type)
 		self.save_data()
-		
-		return proof
-		
+
 	def mine_block(self):
 		"""
 		为了向后兼容，保留此方法，默认挖掘两个区块链
@@ -204,31 +521,62 @@ class dns_layer(object):
 		update their chain
 		:param blockchain_type: 指定要广播的区块链类型，可选值：'register', 'dns', 'both'
 		"""
-		if blockchain_type == 'register' or blockchain_type == 'both':
-			neighbors = self.register_blockchain.nodes
-			for node in neighbors:
-				print(f"Requesting {node} to resolve register blockchain")
-				response = requests.get(f'http://{node}/nodes/resolve?type=register')
-		
-		if blockchain_type == 'dns' or blockchain_type == 'both':
-			neighbors = self.dns_blockchain.nodes
-			for node in neighbors:
-				print(f"Requesting {node} to resolve dns blockchain")
-				response = requests.get(f'http://{node}/nodes/resolve?type=dns')
+		if node_runtime is not None:
+			node_runtime.broadcast(self, blockchain_type)
+			return
+
+		# 只通知随机选出的一部分邻居，熔断中的邻居不参与
+		for blockchain in self._chains(blockchain_type):
+			for node in blockchain.nodes.gossip_targets():
+				logger.debug("Requesting %s to resolve %s blockchain", node, blockchain.chain_type)
+				try:
+					bc.peer_get(node, '/nodes/resolve', peers=blockchain.nodes, params=blockchain.peer_params())
+				except requests.RequestException as e:
+					logger.warning("广播到 %s 失败: %s", node, e)
 
-		print("Broadcast Complete")
+		logger.debug("Broadcast Complete")
 
-	def new_entry(self, hostname, ip, port, blockchain_type='register', lease_years=1, node_id=None):
+	def resolve_conflicts(self, blockchain_type='both'):
+		"""
+		在后台对指定区块链执行共识算法
+		:param blockchain_type: 指定要解决冲突的区块链类型，可选值：'register', 'dns', 'both'
+		"""
+		chains = []
+		if blockchain_type in ('register', 'both'):
+			chains.append(self.register_blockchain)
+		if blockchain_type in ('dns', 'both'):
+			chains.append(self.dns_blockchain)
+
+		if node_runtime is not None:
+			for chain in chains:
+				node_runtime.resolve(chain)
+			return
+
+		for chain in chains:
+			threading.Thread(target=chain.resolve_conflicts).start()
+
+	def new_entry(self, hostname, ip, port, blockchain_type='register', lease_years=1, node_id=None, records=None,
+				  signature=None, public_key=None, signer=None):
 		"""
 		添加新的DNS记录到指定区块链的交易池
 		:param hostname: string, 主机名
-		:param ip: string, 对应主机名的IP
+		:param ip: string, 对应主机名的IP，为None时取records中的第一个A/AAAA地址
 		:param port: int, 对应IP的端口
 		:param blockchain_type: string, 区块链类型，可选值：'register'或'dns'
 		:param lease_years: int, 租赁年限
 		:param node_id: string, 添加此条目的节点标识符
+		:param records: list, 可选的记录列表（A/AAAA/CNAME/MX/TXT/NS，见records.py）
+		:param signature: string, 可选的交易签名，签名内容见signing.signing_message
+		:param public_key: string, 签名对应的公钥，其地址必须等于node_id
+		:param signer: 可选的Wallet，没有给出signature时用它为交易签名
 		:return: bool, 如果条目添加成功则为True
+		:raise ValueError: records格式不正确
+		:raise signing.SignatureError: 签名无效，或要求签名时没有签名
 		"""
+		owner = self._owner(hostname)
+		if owner is not self:
+			return owner.new_entry(hostname, ip, port, blockchain_type, lease_years, node_id, records,
+								   signature, public_key, signer)
 		# 域名匹配
 		# hostname_pattern = r'^(?!-)[a-z0-9-]{1,63}(?<!-)(?:\.(?!-)[a-z0-9-]{1,63}(?<!-))*$'
 		# if not re.match(hostname_pattern, hostname):
@@ -244,6 +592,10 @@ class dns_layer(object):
 			lease_years = int(lease_years)
 		except ValueError:
 			lease_years = 1
+		if records is not None:
+			records = rec.normalize_records(records)
+			if ip is None:
+				ip = rec.first_address(records)
 		# 创建新的DNS记录交易
 		new_transaction = {
 			'hostname':hostname,
@@ -252,64 +604,67 @@ class dns_layer(object):
 			'node_id':node_id,
             'lease_years':lease_years
 		}
+		if records is not None:
+			new_transaction['records'] = records
+		# 进入交易池前验签，验证通过的交易ID被缓存，出块后的区块验证与同步不再重复验签
+		if signature is not None:
+			new_transaction['public_key'] = public_key
+			new_transaction['signature'] = signature
+		elif signer is not None:
+			signing.sign_transaction(new_transaction, signer)
+		if signing.verifier.verify([new_transaction]):
+			raise signing.SignatureError('invalid or missing transaction signature')
 		
 		# 根据区块链类型选择添加到对应的区块链
 		if blockchain_type.lower() == 'dns':
-			# 先写入tmp_domains.json
-			tmp_entry = {
-				'hostname': hostname,
-				'ip': ip,
-				'port': port,
-				'node_id': node_id,
-				'lease_years': lease_years
-			}
-			if os.path.exists(TMP_DOMAINS_FILE):
-				try:
-					with open(TMP_DOMAINS_FILE, 'r', encoding='utf-8') as f:
-						content = f.read().strip()
-						tmp_data = json.loads(content) if content else []
-				except Exception:
+			with self.dns_blockchain.lock:
+				# 先写入tmp_domains.json
+				tmp_entry = dict(new_transaction)
+				if os.path.exists(self.tmp_domains_file):
+					try:
+						with open(self.tmp_domains_file, 'r', encoding='utf-8') as f:
+							content = f.read().strip()
+							tmp_data = json.loads(content) if content else []
+					except Exception:
+						tmp_data = []
+				else:
 					tmp_data = []
-			else:
-				tmp_data = []
-			tmp_data.append(tmp_entry)
-			with open(TMP_DOMAINS_FILE, 'w', encoding='utf-8') as f:
-				json.dump(tmp_data, f, ensure_ascii=False, indent=2)
-			# 满10条自动出块
-			if len(tmp_data) >= self.BUFFER_MAX_LEN:
-				for entry in tmp_data:
-					self.dns_blockchain.new_transaction(entry)
-				self.mine_dns_block()
-				with open(TMP_DOMAINS_FILE, 'w', encoding='utf-8') as f:
-					json.dump([], f)
+				tmp_data.append(tmp_entry)
+				bc.atomic_write_json(self.tmp_domains_file, tmp_data, ensure_ascii=False, indent=2)
+				self.invalidate_lookup_cache()
+				# 满10条自动出块
+				mined = len(tmp_data) >= self.BUFFER_MAX_LEN
+				if mined:
+					for entry in tmp_data:
+						self.dns_blockchain.new_transaction(entry)
+					self.mine_locked('dns')
+					bc.atomic_write_json(self.tmp_domains_file, [])
+			if mined:
+				self.publish_block('dns')
 			return True
 		if blockchain_type.lower() == 'register':
-			# 先写入tmp_register.json
-			tmp_entry = {
-				'hostname': hostname,
-				'ip': ip,
-				'port': port,
-				'node_id': node_id,
-				'lease_years': lease_years
-			}
-			# 读取临时文件
-			if os.path.exists(TMP_REGISTER_FILE):
-				with open(TMP_REGISTER_FILE, 'r', encoding='utf-8') as f:
-					tmp_data = json.load(f)
-			else:
-				tmp_data = []
-			tmp_data.append(tmp_entry)
-			# 写回临时文件
-			with open(TMP_REGISTER_FILE, 'w', encoding='utf-8') as f:
-				json.dump(tmp_data, f, ensure_ascii=False, indent=2)
-			# 如果达到10条，批量写入区块链
-			if len(tmp_data) >= self.BUFFER_MAX_LEN:
-				for entry in tmp_data:
-					self.register_blockchain.new_transaction(entry)
-				self.mine_register_block()
-				# 清空临时文件
-				with open(TMP_REGISTER_FILE, 'w', encoding='utf-8') as f:
-					json.dump([], f)
+			with self.register_blockchain.lock:
+				# 先写入tmp_register.json
+				tmp_entry = dict(new_transaction)
+				# 读取临时文件
+				if os.path.exists(self.tmp_register_file):
+					with open(self.tmp_register_file, 'r', encoding='utf-8') as f:
+						tmp_data = json.load(f)
+				else:
+					tmp_data = []
+				tmp_data.append(tmp_entry)
+				# 写回临时文件
+				bc.atomic_write_json(self.tmp_register_file, tmp_data, ensure_ascii=False, indent=2)
+				# 如果达到10条，批量写入区块链
+				mined = len(tmp_data) >= self.BUFFER_MAX_LEN
+				if mined:
+					for entry in tmp_data:
+						self.register_blockchain.new_transaction(entry)
+					self.mine_locked('register')
+					# 清空临时文件
+					bc.atomic_write_json(self.tmp_register_file, [])
+			if mined:
+				self.publish_block('register')
 			return True
 			
 	def dump_chain(self, blockchain_type='both'):
@@ -317,25 +672,247 @@ class dns_layer(object):
 		导出区块链数据
 		:param blockchain_type: 指定要导出的区块链类型，可选值：'register', 'dns', 'both'
 		"""
+		self.refresh_data()
 		if blockchain_type == 'register':
 			response = {
-			'chain': self.register_blockchain.chain,
+			'chain': list(self.register_blockchain.chain),
 			'length': len(self.register_blockchain.chain)
 			}
 		elif blockchain_type == 'dns':
 			response = {
-			'chain': self.dns_blockchain.chain,
+			'chain': list(self.dns_blockchain.chain),
 			'length': len(self.dns_blockchain.chain)
 			}
 		else:  # 'both'
 			response = {
-			'register_chain': self.register_blockchain.chain,
+			'register_chain': list(self.register_blockchain.chain),
 			'register_length': len(self.register_blockchain.chain),
-			'dns_chain': self.dns_blockchain.chain,
+			'dns_chain': list(self.dns_blockchain.chain),
 			'dns_length': len(self.dns_blockchain.chain)
 			}
 		return response
 
+	def chain_tip(self, blockchain_type='dns'):
+		"""
+		:param blockchain_type: 'register', 'dns' 或 'both'
+		:return: {'length', 'tip'}；'both'时为按区块链类型分组的dict
+		"""
+		self.refresh_data()
+		tips = {chain.chain_type: {'length': len(chain.chain), 'tip': chain.best_tip}
+				for chain in self._chains(blockchain_type)}
+		return tips if blockchain_type == 'both' else tips[blockchain_type]
+
+	def peer_status(self, blockchain_type='both'):
+		"""
+		:return: 按区块链类型分组的邻居节点表，按分数从高到低排列
+		"""
+		return {chain.chain_type: chain.nodes.snapshot() for chain in self._chains(blockchain_type)}
+
+	def expire_peer_tips(self, host, blockchain_type='both'):
+		for chain in self._chains(blockchain_type):
+			chain.nodes.expire_tips(host)
+
+	def _chains(self, blockchain_type):
+		if blockchain_type == 'register':
+			return (self.register_blockchain,)
+		if blockchain_type == 'dns':
+			return (self.dns_blockchain,)
+		return (self.register_blockchain, self.dns_blockchain)
+
+	def chain_version(self, blockchain_type='both'):
+		"""
+		条件请求用的链版本
+		:param blockchain_type: 'register', 'dns' 或 'both'
+		:return: 相关链的链尾哈希组成的元组
+		"""
+		self.refresh_data()
+		return tuple(chain.best_tip for chain in self._chains(blockchain_type))
+
+	def buffer_version(self, blockchain_type='both'):
+		"""
+		条件请求用的交易池版本
+		:return: 相关链的交易池版本组成的元组
+		"""
+		return tuple(chain.mempool_version for chain in self._chains(blockchain_type))
+
+	def _explorer_chain(self, blockchain_type):
+		if blockchain_type not in self.block_indexes:
+			raise ValueError(f'unknown blockchain type: {blockchain_type}')
+		self.refresh_data()
+		blockchain = self.register_blockchain if blockchain_type == 'register' else self.dns_blockchain
+		index = self.block_indexes[blockchain_type]
+		index.sync()
+		return blockchain, index
+
+	@staticmethod
+	def _block_summary(block, block_hash):
+		return {
+			'index': block['index'],
+			'hash': block_hash,
+			'previous_hash': block['previous_hash'],
+			'timestamp': block['timestamp'],
+			'source': block.get('source'),
+			'transactions': len(block['transactions']),
+		}
+
+	def block_page(self, blockchain_type, before=None, limit=PAGE_SIZE):
+		"""
+		从新到旧分页列出区块摘要（不含交易内容）
+		:param blockchain_type: 'register' 或 'dns'
+		:param before: 游标，只列出高度小于before的区块，None表示从链尾开始
+		:param limit: 每页区块数
+		:return: dict {'length', 'blocks', 'next_cursor'}，没有更早的区块时next_cursor为None
+		:raise ValueError: 未知的区块链类型
+		"""
+		blockchain, index = self._explorer_chain(blockchain_type)
+		length = len(index)
+		top = length if before is None else min(before - 1, length)
+		heights = range(top, max(top - limit, 0), -1)
+		blocks = [self._block_summary(blockchain.chain[h - 1], index.block_hash(h)) for h in heights]
+		next_cursor = heights[-1] if heights and heights[-1] > 1 else None
+		return {'length': length, 'blocks': blocks, 'next_cursor': next_cursor}
+
+	def get_block(self, blockchain_type, ref):
+		"""
+		按高度或哈希获取完整区块
+		:param ref: 区块高度（十进制字符串）或区块哈希
+		:return: dict {'hash', 'block'}，不存在时为None
+		:raise ValueError: 未知的区块链类型
+		"""
+		blockchain, index = self._explorer_chain(blockchain_type)
+		height = int(ref) if ref.isdigit() else index.height_of(ref.lower())
+		if height is None or not 1 <= height <= len(index):
+			return None
+		return {'hash': index.block_hash(height), 'block': blockchain.chain[height - 1]}
+
+	def transactions_between(self, blockchain_type, start=None, end=None, cursor=None, limit=PAGE_SIZE):
+		"""
+		按时间顺序列出区块时间戳在[start, end)内的交易
+		:param start: 起始时间戳（含），None表示不限
+		:param end: 结束时间戳（不含），None表示不限
+		:param cursor: 上一页返回的next_cursor（'区块高度:交易序号'）
+		:param limit: 每页交易数
+		:return: dict {'transactions', 'next_cursor'}，没有更多交易时next_cursor为None
+		:raise ValueError: 未知的区块链类型或游标格式不正确
+		"""
+		blockchain, index = self._explorer_chain(blockchain_type)
+		lo, hi = index.height_range(start, end)
+		height, skip = lo, 0
+		if cursor:
+			height, skip = (int(part) for part in cursor.split(':', 1))
+			if height < lo:
+				height, skip = lo, 0
+		items = []
+		for block in blockchain.chain.iter(height - 1, hi - 1):
+			# 区块时间戳不一定随高度单调，高度范围内的区块逐个按时间戳过滤
+			if (start is not None and block['timestamp'] < start) or (end is not None and block['timestamp'] >= end):
+				skip = 0
+				continue
+			transactions = block['transactions']
+			for i in range(skip, len(transactions)):
+				if len(items) >= limit:
+					return {'transactions': items, 'next_cursor': f"{block['index']}:{i}"}
+				items.append({
+					'block_index': block['index'],
+					'block_hash': index.block_hash(block['index']),
+					'timestamp': block['timestamp'],
+					'tx_index': i,
+					'transaction': transactions[i],
+				})
+			skip = 0
+		return {'transactions': items, 'next_cursor': None}
+
+	def hostname_proof(self, hostname, checkpoint=None):
+		"""
+		主机名记录在DNS链上的包含证明，供轻客户端验证（见lightclient.py）
+		:param checkpoint: 客户端信任的检查点高度，默认为链尾
+		:return: dict {'hostname', 'block_index', 'tx_index', 'record', 'proof', 'headers', 'checkpoint', 'shard'}，
+			检查点与区块头属于负责该主机名的分片的DNS链
+		:raise LookupError: 链上没有该主机名
+		:raise ValueError: 检查点超出链的范围，或与记录所在区块相距超过MAX_HEADERS个区块
+		"""
+		owner = self._owner(hostname)
+		if owner is not self:
+			return owner.hostname_proof(hostname, checkpoint)
+		self.refresh_data()
+		chain = self.dns_blockchain.chain
+		record = self._find_record(self.dns_index, self.dns_blockchain, hostname)
+		if record is None:
+			raise LookupError('No existing entry matching hostname')
+		height = record['block_index']
+		checkpoint = len(chain) if checkpoint is None else checkpoint
+		if not 1 <= checkpoint <= len(chain):
+			raise ValueError(f'checkpoint out of range: {checkpoint}')
+		low, high = min(height, checkpoint), max(height, checkpoint)
+		if high - low >= MAX_HEADERS:
+			raise ValueError(f'checkpoint more than {MAX_HEADERS} blocks away from block {height}')
+		headers = [light_header(block) for block in chain.iter(low - 1, high)]
+		block = chain[height - 1]
+		transactions = block['transactions']
+		# 同一主机名以区块中第一条交易为准
+		tx_index = next(i for i, tx in enumerate(transactions) if tx.get('hostname') == hostname)
+		return {
+			'hostname': hostname,
+			'block_index': height,
+			'tx_index': tx_index,
+			'record': transactions[tx_index],
+			'proof': merkle_proof(transactions, tx_index) if 'tx_root' in block else None,
+			'headers': headers,
+			'checkpoint': {'height': checkpoint, 'hash': self.dns_blockchain.hash(chain[checkpoint - 1])},
+			'shard': self.shard,
+		}
+
+	def snapshot_bundle(self, wallet=None):
+		"""
+		导出供新节点快速引导的状态快照包，见bootstrap.make_bundle
+		:param wallet: 可选的持有私钥的Wallet，用于签名
+		:raise ValueError: 只读进程没有派生状态
+		"""
+		if not self.trackers:
+			raise ValueError('snapshots are served by the writer process')
+		return bootstrap.make_bundle(self.trackers, self.data_dir, wallet)
+
+	def feed(self, blockchain_type):
+		"""
+		:param blockchain_type: 'register' 或 'dns'
+		:return: 该链的EventFeed
+		:raise ValueError: 未知的区块链类型，或只读进程没有事件源
+		"""
+		if blockchain_type not in ('register', 'dns'):
+			raise ValueError(f'unknown blockchain type: {blockchain_type}')
+		if blockchain_type not in self.feeds:
+			raise ValueError('event feeds are served by the writer process')
+		return self.feeds[blockchain_type]
+
+	def block_headers(self, blockchain_type, start=1, limit=MAX_HEADERS):
+		"""
+		邻居同步用的区块头，见chainsync.block_header
+		:param start: 第一个区块头的高度（从1开始）
+		:param limit: 最多返回的区块头数，不超过MAX_HEADERS
+		:return: dict {'length', 'headers'}
+		:raise ValueError: 未知的区块链类型
+		"""
+		blockchain, index = self._explorer_chain(blockchain_type)
+		length = len(index)
+		stop = min(start - 1 + min(limit, MAX_HEADERS), length)
+		headers = [block_header(block, index.block_hash(block['index']))
+				   for block in blockchain.chain.iter(max(start - 1, 0), stop)]
+		return {'length': length, 'headers': headers}
+
+	def block_range(self, blockchain_type, start, end):
+		"""
+		邻居同步用的一段完整区块
+		:param start: 第一个区块的高度（从1开始）
+		:param end: 最后一个区块之后的高度，最多返回MAX_BODY_RANGE个区块
+		:return: dict {'length', 'blocks'}
+		:raise ValueError: 未知的区块链类型
+		"""
+		blockchain, index = self._explorer_chain(blockchain_type)
+		length = len(index)
+		start = max(start, 1)
+		end = min(end, start + MAX_BODY_RANGE, length + 1)
+		return {'length': length, 'blocks': list(blockchain.chain.iter(start - 1, end - 1))}
+
 	def dump_buffer(self, blockchain_type='both'):
 		"""
 		导出交易缓冲区数据
@@ -356,16 +933,22 @@ class dns_layer(object):
 		获取区块链配额
 		:param blockchain_type: 指定要获取配额的区块链类型，默认为'register'
 		"""
-		if blockchain_type == 'register':
-			return self.register_blockchain.quota
-		elif blockchain_type == 'dns':
-			return self.dns_blockchain.quota
+		self.refresh_data()
+		if blockchain_type in ('register', 'dns'):
+			return self._quota(blockchain_type)
 		else:  # 'both'
 			return {
-				'register': self.register_blockchain.quota,
-				'dns': self.dns_blockchain.quota
+				'register': self._quota('register'),
+				'dns': self._quota('dns')
 			}
 
+	def _quota(self, blockchain_type):
+		tracker = self.trackers.get(blockchain_type)
+		if tracker is not None:
+			return tracker.state.quota(self.node_identifier)
+		blockchain = self.register_blockchain if blockchain_type == 'register' else self.dns_blockchain
+		return blockchain.quota
+
 	def register_node(self, addr, blockchain_type='both'):
 		"""
 		注册节点
@@ -401,9 +984,9 @@ class dns_layer(object):
 		if not os.path.exists(self.data_dir):
 			try:
 				os.makedirs(self.data_dir)
-				print(f"Data directory created: {self.data_dir}")
+				logger.info("Data directory created: %s", self.data_dir)
 			except Exception as e:
-				print(f"Failed to create data directory: {e}")
+				logger.error("Failed to create data directory: %s", e)
 				
 	def load_data(self):
 		"""
@@ -415,13 +998,22 @@ class dns_layer(object):
 		# 只加载两个区块链的数据
 		self.register_blockchain.load_chain()
 		self.dns_blockchain.load_chain()
-		print(f"成功加载注册区块链数据，共 {len(self.register_blockchain.chain)} 个区块")
-		print(f"成功加载DNS区块链数据，共 {len(self.dns_blockchain.chain)} 个区块")
+		logger.info("成功加载注册区块链数据，共 %d 个区块", len(self.register_blockchain.chain))
+		logger.info("成功加载DNS区块链数据，共 %d 个区块", len(self.dns_blockchain.chain))
 		
+	def refresh_data(self):
+		"""
+		仅在链文件被修改后重新加载区块链数据
+		"""
+		self.register_blockchain.refresh()
+		self.dns_blockchain.refresh()
+
 	def save_data(self):
 		"""
 		保存区块链数据到文件
 		"""
+		if self.read_only:
+			return
 		# 确保数据目录存在
 		self.ensure_data_directory()
 		# 避免多次保存导致数据覆盖
@@ -430,8 +1022,8 @@ class dns_layer(object):
 			self.register_blockchain.save_chain()
 			self.dns_blockchain.save_chain()
 			
-			print(f"当前注册区块链长度: {len(self.register_blockchain.chain)}")
-			print(f"当前DNS区块链长度: {len(self.dns_blockchain.chain)}")
+			logger.debug("当前注册区块链长度: %d", len(self.register_blockchain.chain))
+			logger.debug("当前DNS区块链长度: %d", len(self.dns_blockchain.chain))
 						
 			self._data_saved = True
 			
@@ -443,52 +1035,63 @@ class dns_layer(object):
 		:param hostname: 要检查的域名
 		:return: 返回字典 {'exists': bool, 'expired': bool, 'blockchain_type': str}
 		"""
+		owner = self._owner(hostname)
+		if owner is not self:
+			return owner.check_domain_status(hostname)
 		# 先查tmp_register.json
-		if os.path.exists(TMP_REGISTER_FILE):
-			with open(TMP_REGISTER_FILE, 'r', encoding='utf-8') as f:
+		if os.path.exists(self.tmp_register_file):
+			with open(self.tmp_register_file, 'r', encoding='utf-8') as f:
 				tmp_data = json.load(f)
 			for entry in tmp_data:
 				if entry.get('hostname') == hostname:
 					return {'exists': True, 'expired': False, 'blockchain_type': 'tmp', 'on_chain': False}
 		
-		# 原有区块链查找逻辑
-		for block in self.register_blockchain.chain:
-			for transaction in block['transactions']:
-				if 'hostname' in transaction and transaction['hostname'] == hostname:
-					current_time = time()
-					lease_end = block['timestamp'] + (transaction.get('lease_years', 1) * 31536000)
-					return {'exists': True, 'expired': current_time > lease_end, 'blockchain_type': 'register', 'on_chain': True}
-		for block in self.dns_blockchain.chain:
-			for transaction in block['transactions']:
-				if 'hostname' in transaction and transaction['hostname'] == hostname:
-					return {'exists': True, 'expired': False, 'blockchain_type': 'dns', 'on_chain': True}
+		# 从区块链索引中查找
+		record = self._find_record(self.register_index, self.register_blockchain, hostname)
+		if record is not None:
+			lease_end = record['timestamp'] + (record.get('lease_years', 1) * 31536000)
+			return {'exists': True, 'expired': time() > lease_end, 'blockchain_type': 'register', 'on_chain': True}
+		if self._find_record(self.dns_index, self.dns_blockchain, hostname) is not None:
+			return {'exists': True, 'expired': False, 'blockchain_type': 'dns', 'on_chain': True}
 		return {'exists': False, 'expired': False, 'blockchain_type': None, 'on_chain': False}
 
+	def reset_dns_chain(self):
+		"""
+		清空DNS链（连同旧格式的链文件）并重新创建创世区块，
+		主机名索引、派生状态与查询缓存随链事件重建，注册链上的域名由Replicator重新复制
+		"""
+		if os.path.exists(self.dns_blockchain.chain_file):
+			os.remove(self.dns_blockchain.chain_file)
+		self.dns_blockchain.reset()
+
 	def get_user_tokens(self, node_id):
 		"""
 		Calculate the user's token balance
 		:param node_id: string, user's node identifier
 		:return: int, user's token balance
 		"""
-		tokens = 10  # Initial token amount
-		
 		# 只从注册区块链中计算代币余额，因为代币系统只在注册区块链中使用
-		# Traverse all blocks in the register blockchain
-		for block in self.register_blockchain.chain:
-			for transaction in block['transactions']:
-				# Mining reward
-				if 'node' in transaction and transaction['node'] == node_id and 'reward' in transaction:
-					tokens += transaction['reward']
-				# Token payment
-				elif 'type' in transaction and transaction['type'] == 'token_payment' and transaction['from'] == node_id:
-					tokens -= transaction['amount']
-				# Token transfer - sender
-				elif 'type' in transaction and transaction['type'] == 'token_transfer' and transaction['from'] == node_id:
-					tokens -= transaction['amount']
-				# Token transfer - receiver
-				elif 'type' in transaction and transaction['type'] == 'token_transfer' and transaction['to'] == node_id:
-					tokens += transaction['amount']
-		
+		tracker = self.trackers.get('register')
+		if tracker is not None:
+			tokens = tracker.state.tokens(node_id)
+		else:
+			tokens = 10  # Initial token amount
+			# Traverse all blocks in the register blockchain
+			for block in self.register_blockchain.chain:
+				for transaction in block['transactions']:
+					# Mining reward
+					if 'node' in transaction and transaction['node'] == node_id and 'reward' in transaction:
+						tokens += transaction['reward']
+					# Token payment
+					elif 'type' in transaction and transaction['type'] == 'token_payment' and transaction['from'] == node_id:
+						tokens -= transaction['amount']
+					# Token transfer - sender
+					elif 'type' in transaction and transaction['type'] == 'token_transfer' and transaction['from'] == node_id:
+						tokens -= transaction['amount']
+					# Token transfer - receiver
+					elif 'type' in transaction and transaction['type'] == 'token_transfer' and transaction['to'] == node_id:
+						tokens += transaction['amount']
+
 		# Check current unconfirmed transactions in register blockchain
 		for transaction in self.register_blockchain.current_transactions:
 			# Token payment
@@ -0,0 +1,136 @@
+"""
+只读跟随节点
+
+跟随节点没有钱包、不出块、不做跨链复制，只从一个或多个上游节点同步两条链，
+在本地的区块存储、主机名索引与区块索引上提供主机名查询、DNS协议应答与区块浏览，
+用于水平扩展查询能力而不增加参与出块竞争的节点。
+
+每条链一个后台线程，向分数最高的可用上游长轮询 GET /events（见changefeed）：
+收到block事件时把上游宣告的链尾记入邻居表，再用区块头优先同步（chainsync.HeaderSync）
+从所有宣告了更长链的上游拉取新区块，区块在本地校验后写入区块存储，
+派生状态、索引与本地事件源随链监听者更新；reorg/reset事件使上游的链尾信息过期、重新探测。
+订阅从本链链尾的游标开始，上游的缓冲区已不含该游标时由上游从区块存储重放。
+上游不支持 /events（返回404）时退回到每POLL_INTERVAL秒同步一次。
+"""
+
+import logging
+import threading
+
+import requests
+
+import blockchain as bc
+import metrics
+from peers import Peer
+
+logger = logging.getLogger(__name__)
+
+# 长轮询每次等待上游新事件的时间（秒）
+FOLLOW_WAIT = 25
+# 上游不支持事件订阅时的同步间隔（秒）
+POLL_INTERVAL = 10
+# 上游不可用时重试前的等待时间（秒）
+RETRY_DELAY = 5
+
+FOLLOW_LAG = metrics.Gauge('dns_follower_lag_blocks', '跟随节点落后于上游宣告链尾的区块数', ['chain'])
+FOLLOW_EVENTS = metrics.Counter('dns_follower_events_total', '跟随节点从上游收到的事件数', ['chain', 'type'])
+
+
+def parse_upstreams(value):
+    """
+    :param value: 逗号分隔的上游节点地址 host:port
+    :return: 地址列表
+    """
+    return [address.strip() for address in value.split(',') if address.strip()]
+
+
+class Follower(object):
+    def __init__(self, layer, upstreams):
+        """
+        :param layer: 跟随模式的dns_layer
+        :param upstreams: 上游节点地址列表
+        """
+        if not upstreams:
+            raise ValueError('a follower needs at least one upstream node')
+        self.layer = layer
+        self.upstreams = list(upstreams)
+        self._stopped = threading.Event()
+        self._threads = []
+        for name, blockchain in self._chains():
+            FOLLOW_LAG.labels(blockchain.name).set_function(lambda blockchain=blockchain: self.lag(blockchain))
+
+    def _chains(self):
+        return (('register', self.layer.register_blockchain), ('dns', self.layer.dns_blockchain))
+
+    def lag(self, blockchain):
+        """
+        :return: 本链落后于上游宣告的最高链尾的区块数
+        """
+        heights = [peer.tip_height for peer in map(blockchain.nodes.get, self.upstreams)
+                   if peer is not None and peer.tip_height is not None]
+        return max(max(heights, default=0) - len(blockchain.chain), 0)
+
+    def start(self):
+        for name, blockchain in self._chains():
+            for upstream in self.upstreams:
+                blockchain.register_node(upstream)
+            thread = threading.Thread(target=self._run, args=(name, blockchain), name=f'follower-{blockchain.name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+
+    def _source(self, blockchain):
+        """
+        :return: 订阅事件的上游：熔断器允许请求的上游中分数最高的，没有时为None
+        """
+        peers = [peer for peer in blockchain.nodes.available() if peer.address in self.upstreams]
+        return max(peers, key=Peer.score).address if peers else None
+
+    def _run(self, name, blockchain):
+        source, cursor = None, None
+        while not self._stopped.is_set():
+            node = self._source(blockchain)
+            if node is None:
+                self._stopped.wait(RETRY_DELAY)
+                continue
+            try:
+                if node != source:
+                    # 更换上游时先追上，再从本链链尾的位置订阅
+                    blockchain.resolve_conflicts()
+                    source, cursor = node, self.layer.feeds[name].tip_cursor()
+                cursor = self._poll(name, blockchain, node, cursor)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                logger.warning("跟随上游 %s 的 %s 链失败: %s", node, name, e)
+                source = None
+                self._stopped.wait(RETRY_DELAY)
+
+    def _poll(self, name, blockchain, node, cursor):
+        """
+        长轮询一次上游的事件，有新区块时同步
+
+        :return: 下次订阅的游标
+        :raise ValueError: 上游返回错误
+        """
+        params = dict(blockchain.peer_params(), cursor=cursor, wait=FOLLOW_WAIT)
+        response = bc.peer_get(node, '/events', peers=blockchain.nodes, params=params,
+                               timeout=FOLLOW_WAIT + bc.PEER_TIMEOUT)
+        if response.status_code == 404:
+            self._stopped.wait(POLL_INTERVAL)
+            blockchain.resolve_conflicts()
+            return cursor
+        if response.status_code != 200:
+            raise ValueError(f'{node}/events 返回 {response.status_code}')
+        data = response.json()
+        changed = False
+        for event in data['events']:
+            FOLLOW_EVENTS.labels(name, event['type']).inc()
+            if event['type'] == 'block':
+                blockchain.nodes.observe_tip(node, event['block_index'], event['hash'])
+                changed = True
+            elif event['type'] in ('reorg', 'reset'):
+                blockchain.nodes.expire_tips(node.rsplit(':', 1)[0])
+                changed = True
+        if changed:
+            blockchain.resolve_conflicts()
+        return data['cursor']
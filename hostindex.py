@@ -0,0 +1,494 @@
+"""
+内存映射的主机名索引文件
+
+每条链旁边维护一个 .idx 文件，是一个开放寻址的哈希表：
+主机名哈希 -> 记录偏移。查询直接在mmap上探测并只解码命中的那一条记录，
+不需要解析整条链；多个进程（reader、DNS服务器）可以共享同一份页缓存。
+
+主机名上链后不再改变，新区块只会增加主机名，所以每个新区块由IndexWriter原地更新：
+新记录追加到文件末尾，再写入空槽位（先写偏移、最后写键哈希，读者看到键哈希时记录已完整），
+最后在头部的序号保护下更新条目数与链尾。链重组时只删除、替换受影响的主机名：
+整个修改在奇数序号下进行，读者发现序号变化后重读。槽位表装载率超过GROW_LOAD时
+在后台线程按两倍大小重建（压缩）并原子替换；重新加载时整体重建。
+
+文件格式（小端序）：
+    头部 64 字节: magic(8) version(u32) slot_count(u32) entry_count(u32)
+                  tip_height(u32) tip_hash(32) seq(u64，奇数表示头部正在更新)
+    槽位 slot_count * 16 字节: key_hash(u64, 0表示空) offset(u32) length(u32)
+    记录区: hostname_len(u16) hostname(utf-8) record(JSON)
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from records import record_sets
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'DNSIDX1\0'
+VERSION = 2
+HEADER = struct.Struct('<8sIIII32sQ')
+# 头部中可原地更新的部分：entry_count tip_height tip_hash seq
+TIP = struct.Struct('<II32sQ')
+TIP_OFFSET = 16
+SLOT = struct.Struct('<QII')
+SLOT_KEY = struct.Struct('<Q')
+SLOT_POS = struct.Struct('<II')
+# 头部最后的序号，奇数表示写入者正在修改
+SEQ = struct.Struct('<Q')
+SEQ_OFFSET = HEADER.size - SEQ.size
+NAME_LEN = struct.Struct('<H')
+EMPTY_HASH = b'\0' * 32
+# 重建后槽位表的装载率不超过该值
+BUILD_LOAD = 0.25
+# 原地插入后装载率超过该值时在后台重建
+GROW_LOAD = 0.5
+# 原地插入后装载率会超过该值时不再原地插入，改为同步重建
+MAX_LOAD = 0.75
+# 读取头部时等待写入者完成更新的最多次数
+HEADER_RETRIES = 1000
+# 读取时写入者一直没有完成修改
+UNAVAILABLE = object()
+
+
+def key_hash(hostname):
+    h = int.from_bytes(hashlib.blake2b(hostname.encode('utf-8'), digest_size=8).digest(), 'little')
+    return h or 1
+
+
+def make_record(tx, block):
+    """
+    由交易和所在区块生成索引记录
+    """
+    return {
+        'ip': tx.get('ip'),
+        'port': tx.get('port'),
+        'node_id': tx.get('node_id'),
+        'lease_years': tx.get('lease_years', 1),
+        'block_index': block['index'],
+        'timestamp': block['timestamp'],
+        'records': record_sets(tx),
+    }
+
+
+def _encode_entry(hostname, record):
+    name = hostname.encode('utf-8')
+    return NAME_LEN.pack(len(name)) + name + json.dumps(record, separators=(',', ':')).encode('utf-8')
+
+
+def _tip_hash_bytes(tip_hash):
+    return bytes.fromhex(tip_hash) if tip_hash else EMPTY_HASH
+
+
+def index_path(chain_file):
+    """
+    链文件对应的索引文件路径，例如 data/domains.json -> data/domains.idx
+    """
+    return os.path.splitext(chain_file)[0] + '.idx'
+
+
+class HostIndex(object):
+    def __init__(self, path):
+        """
+        只读视图，文件被替换或追加后在下一次访问时自动重新映射；可以在多个线程中同时使用
+
+        :param path: 索引文件路径
+        """
+        self.path = path
+        self._stamp = None
+        # 当前的 (mmap, 槽位数)，整体替换；重新映射时不关闭旧的mmap，
+        # 正在使用它的读者持有引用，读完后由垃圾回收关闭
+        self._view = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        """
+        :return: 当前文件的 (mmap, 槽位数)，文件不存在或格式不符时为None
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            with self._lock:
+                self._view = self._stamp = None
+            return None
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if stamp == self._stamp:
+                return self._view
+            self._view = None
+            self._stamp = stamp
+            if st.st_size < HEADER.size:
+                return None
+            try:
+                with open(self.path, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                self._stamp = None
+                return None
+            magic, version, slots = HEADER.unpack_from(mm, 0)[:3]
+            if magic != MAGIC or version != VERSION:
+                mm.close()
+                return None
+            self._view = (mm, slots)
+            return self._view
+
+    def _consistent(self, mm, read):
+        """
+        在头部序号的保护下读取：条目数与链尾会被原地更新，删除或替换主机名时槽位会被移动，
+        读取期间序号变化说明读到了一半的修改，重新读取
+
+        :param read: 函数，参数为mmap
+        :return: read的结果；写入者中途退出、序号一直为奇数时为UNAVAILABLE
+        """
+        for attempt in range(HEADER_RETRIES):
+            seq = SEQ.unpack_from(mm, SEQ_OFFSET)[0]
+            if seq % 2 == 0:
+                try:
+                    result = read(mm)
+                except (struct.error, ValueError):
+                    if SEQ.unpack_from(mm, SEQ_OFFSET)[0] == seq:
+                        raise
+                else:
+                    if SEQ.unpack_from(mm, SEQ_OFFSET)[0] == seq:
+                        return result
+            time.sleep(0 if attempt < 100 else 0.001)
+        logger.error("索引文件 %s 的头部一直处于更新中，需要重建", self.path)
+        return UNAVAILABLE
+
+    @staticmethod
+    def _read_header(mm):
+        count, tip_height, tip_hash, _ = TIP.unpack_from(mm, TIP_OFFSET)
+        return count, (tip_height, tip_hash.hex() if tip_hash != EMPTY_HASH else None)
+
+    def _header(self, mm):
+        """
+        :return: 元组 (条目数, (链尾高度, 链尾哈希))；写入者中途退出时为None
+        """
+        header = self._consistent(mm, self._read_header)
+        return None if header is UNAVAILABLE else header
+
+    @property
+    def available(self):
+        return self._open() is not None
+
+    @property
+    def tip(self):
+        """
+        索引对应的链尾 (区块高度, 区块哈希)；头部损坏时为 (0, None)，写入者会因此重建索引
+        """
+        view = self._open()
+        header = view and self._header(view[0])
+        return header[1] if header else (0, None)
+
+    def __len__(self):
+        view = self._open()
+        header = view and self._header(view[0])
+        return header[0] if header else 0
+
+    @staticmethod
+    def _read_entry(mm, offset, length):
+        if offset + length > len(mm):
+            # 映射之后才追加的记录，下一次访问重新映射后可见
+            return None, None, None
+        (name_len,) = NAME_LEN.unpack_from(mm, offset)
+        start = offset + NAME_LEN.size
+        name = mm[start:start + name_len].decode('utf-8')
+        return name, start + name_len, offset + length
+
+    @staticmethod
+    def _find(mm, slots, hostname):
+        """
+        线性探测主机名所在的槽位
+
+        :return: 元组 (槽位下标, 记录起点, 记录终点)；不存在时为 (探测到的空槽位下标, None, None)
+        """
+        h = key_hash(hostname)
+        mask = slots - 1
+        i = h & mask
+        while True:
+            slot_hash, offset, length = SLOT.unpack_from(mm, HEADER.size + i * SLOT.size)
+            if slot_hash == 0:
+                return i, None, None
+            if slot_hash == h:
+                name, start, end = HostIndex._read_entry(mm, offset, length)
+                if name == hostname:
+                    return i, start, end
+            i = (i + 1) & mask
+
+    def get(self, hostname):
+        """
+        :return: 主机名对应的记录字典，不存在时为None
+        """
+        view = self._open()
+        if view is None:
+            return None
+        mm, slots = view
+
+        def read(mm):
+            _, start, end = self._find(mm, slots, hostname)
+            return None if start is None else json.loads(mm[start:end])
+
+        record = self._consistent(mm, read)
+        return None if record is UNAVAILABLE else record
+
+    def get_many(self, hostnames):
+        """
+        批量查找：只检查一次映射，并在同一个序号下读出全部主机名
+
+        :param hostnames: 主机名列表
+        :return: dict，主机名 -> 记录字典，不存在时为None
+        """
+        missing = dict.fromkeys(hostnames)
+        view = self._open()
+        if view is None:
+            return missing
+        mm, slots = view
+
+        def read(mm):
+            records = {}
+            for hostname in missing:
+                _, start, end = self._find(mm, slots, hostname)
+                records[hostname] = None if start is None else json.loads(mm[start:end])
+            return records
+
+        records = self._consistent(mm, read)
+        return missing if records is UNAVAILABLE else records
+
+    def __contains__(self, hostname):
+        return self.get(hostname) is not None
+
+    def items(self):
+        """
+        遍历索引中的所有 (hostname, record)
+        """
+        view = self._open()
+        if view is None:
+            return
+        mm, slots = view
+
+        def read(mm):
+            entries = []
+            for i in range(slots):
+                slot_hash, offset, length = SLOT.unpack_from(mm, HEADER.size + i * SLOT.size)
+                if slot_hash:
+                    name, start, end = self._read_entry(mm, offset, length)
+                    if name is not None:
+                        entries.append((name, json.loads(mm[start:end])))
+            return entries
+
+        entries = self._consistent(mm, read)
+        if entries is not UNAVAILABLE:
+            yield from entries
+
+    @staticmethod
+    def write(path, records, tip_height, tip_hash):
+        """
+        生成索引文件并原子替换旧文件
+
+        :param records: dict, hostname -> 可JSON序列化的记录
+        :param tip_height: 索引覆盖到的区块高度
+        :param tip_hash: 该区块的哈希（十六进制）
+        """
+        tmp_path = HostIndex._build(path, records, tip_height, tip_hash)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _build(path, records, tip_height, tip_hash):
+        """
+        :return: 生成的临时文件路径
+        """
+        slots = 8
+        while slots * BUILD_LOAD < len(records):
+            slots *= 2
+        table = bytearray(slots * SLOT.size)
+        data = bytearray()
+        base = HEADER.size + len(table)
+        mask = slots - 1
+        for hostname, record in records.items():
+            entry = _encode_entry(hostname, record)
+            h = key_hash(hostname)
+            i = h & mask
+            while SLOT.unpack_from(table, i * SLOT.size)[0]:
+                i = (i + 1) & mask
+            SLOT.pack_into(table, i * SLOT.size, h, base + len(data), len(entry))
+            data += entry
+
+        header = HEADER.pack(MAGIC, VERSION, slots, len(records), tip_height, _tip_hash_bytes(tip_hash), 0)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(header)
+            f.write(table)
+            f.write(data)
+        return tmp_path
+
+    @staticmethod
+    def insert(path, records, tip_height, tip_hash):
+        """
+        原地插入新主机名的记录并更新链尾，已有的主机名保持不变
+
+        :param records: dict, hostname -> 可JSON序列化的记录
+        :return: 插入后的装载率；文件不存在、格式不符或装载率会超过MAX_LOAD时不做修改并返回None
+        """
+        return HostIndex._modify(path, records, (), tip_height, tip_hash, replace=False)
+
+    @staticmethod
+    def patch(path, records, removed, tip_height, tip_hash):
+        """
+        原地删除主机名、插入或替换主机名的记录并更新链尾（链重组时）
+
+        :param records: dict, hostname -> 可JSON序列化的记录，已有的主机名改为新记录
+        :param removed: 要删除的主机名
+        :return: 同insert
+        """
+        return HostIndex._modify(path, records, removed, tip_height, tip_hash, replace=True)
+
+    @staticmethod
+    def _modify(path, records, removed, tip_height, tip_hash, replace):
+        try:
+            f = open(path, 'r+b')
+        except OSError:
+            return None
+        with f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return None
+            magic, version, slots, count, _, _, seq = HEADER.unpack(header)
+            # 序号为奇数：上一个写入者在更新头部时退出，由调用方重建
+            if magic != MAGIC or version != VERSION or seq % 2 or count + len(records) > slots * MAX_LOAD:
+                return None
+            end = f.seek(0, os.SEEK_END)
+            entries = []
+            data = bytearray()
+            for hostname, record in records.items():
+                entry = _encode_entry(hostname, record)
+                entries.append((hostname, end + len(data), len(entry)))
+                data += entry
+            f.write(data)
+            f.flush()
+            with mmap.mmap(f.fileno(), 0) as mm:
+                if replace:
+                    # 删除与替换会移动、改写已有的槽位，读者在奇数序号期间重读
+                    SEQ.pack_into(mm, SEQ_OFFSET, seq + 1)
+                for hostname in removed:
+                    i, start, _ = HostIndex._find(mm, slots, hostname)
+                    if start is not None:
+                        _delete_slot(mm, slots, i)
+                        count -= 1
+                for hostname, offset, length in entries:
+                    i, start, _ = HostIndex._find(mm, slots, hostname)
+                    pos = HEADER.size + i * SLOT.size
+                    if start is None:
+                        # 先写偏移、最后写键哈希，读者看到键哈希时记录已完整
+                        SLOT_POS.pack_into(mm, pos + SLOT_KEY.size, offset, length)
+                        SLOT_KEY.pack_into(mm, pos, key_hash(hostname))
+                        count += 1
+                    elif replace:
+                        SLOT_POS.pack_into(mm, pos + SLOT_KEY.size, offset, length)
+                SEQ.pack_into(mm, SEQ_OFFSET, seq + 1)
+                TIP.pack_into(mm, TIP_OFFSET, count, tip_height, _tip_hash_bytes(tip_hash), seq + 1)
+                SEQ.pack_into(mm, SEQ_OFFSET, seq + 2)
+        return count / slots
+
+
+def _delete_slot(mm, slots, i):
+    """
+    线性探测表的后移删除：清空槽位i，把其后探测链上的槽位前移填补，不留墓碑
+    """
+    mask = slots - 1
+    j = i
+    while True:
+        j = (j + 1) & mask
+        slot = SLOT.unpack_from(mm, HEADER.size + j * SLOT.size)
+        if slot[0] == 0:
+            break
+        home = slot[0] & mask
+        # 槽位j的理想位置不在环形区间 (i, j] 内时，可以前移到i
+        if (i < j and (home <= i or home > j)) or (i > j and home <= i and home > j):
+            SLOT.pack_into(mm, HEADER.size + i * SLOT.size, *slot)
+            i = j
+    SLOT.pack_into(mm, HEADER.size + i * SLOT.size, 0, 0, 0)
+
+
+class IndexWriter(object):
+    def __init__(self, path, snapshot):
+        """
+        一个索引文件的写入者：新区块原地插入，装载率过高时在后台线程重建
+
+        :param path: 索引文件路径
+        :param snapshot: 无参函数，返回 (全部记录, 链尾高度, 链尾哈希)，用于重建
+        """
+        self.path = path
+        self.snapshot = snapshot
+        self._lock = threading.Lock()
+        # 每次整体重建加一，后台重建完成时版本已变化则丢弃结果
+        self._generation = 0
+        # 后台重建期间插入的记录，替换文件后补写；没有后台重建时为None
+        self._journal = None
+        self._tip = (0, None)
+
+    def rebuild(self, records, tip_height, tip_hash):
+        """
+        整体重建索引文件（启动、重新加载时）
+        """
+        with self._lock:
+            self._rebuild(records, tip_height, tip_hash)
+
+    def _rebuild(self, records, tip_height, tip_hash):
+        self._generation += 1
+        self._journal = None
+        self._tip = (tip_height, tip_hash)
+        HostIndex.write(self.path, records, tip_height, tip_hash)
+
+    def add(self, records, tip_height, tip_hash):
+        """
+        原地插入一个区块新增的主机名并更新链尾
+
+        :param records: dict, 该区块首次上链的 hostname -> 记录
+        """
+        with self._lock:
+            self._tip = (tip_height, tip_hash)
+            if self._journal is not None:
+                self._journal.update(records)
+            self._grow(HostIndex.insert(self.path, records, tip_height, tip_hash))
+
+    def patch(self, records, removed, tip_height, tip_hash):
+        """
+        原地删除、替换链重组影响到的主机名并更新链尾
+
+        :param records: dict, 新分支上首次上链或记录改变的 hostname -> 记录
+        :param removed: 只在被撤销的区块中上链的主机名
+        """
+        with self._lock:
+            self._tip = (tip_height, tip_hash)
+            if self._journal is not None:
+                # 进行中的后台重建取的是重组前的快照，丢弃它，需要时重新开始
+                self._generation += 1
+                self._journal = None
+            self._grow(HostIndex.patch(self.path, records, removed, tip_height, tip_hash))
+
+    def _grow(self, load):
+        if load is None:
+            self._rebuild(*self.snapshot())
+        elif load > GROW_LOAD and self._journal is None:
+            self._journal = {}
+            threading.Thread(target=self._compact, args=(self._generation,),
+                             name='index-compact', daemon=True).start()
+
+    def _compact(self, generation):
+        records, tip_height, tip_hash = self.snapshot()
+        tmp_path = HostIndex._build(self.path, records, tip_height, tip_hash)
+        with self._lock:
+            if generation != self._generation:
+                os.remove(tmp_path)
+                return
+            journal, self._journal = self._journal, None
+            os.replace(tmp_path, self.path)
+            # 取快照之后上链的主机名与链尾
+            HostIndex.insert(self.path, {name: record for name, record in journal.items() if name not in records},
+                             *self._tip)
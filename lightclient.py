@@ -0,0 +1,94 @@
+"""
+轻客户端：不下载整条链，凭包含证明验证主机名记录
+
+GET /dns/proof?hostname=<主机名>&checkpoint=<高度> 返回
+    {'hostname', 'block_index', 'tx_index', 'record': 交易, 'proof': 兄弟节点哈希列表,
+     'headers': 记录所在区块与检查点之间（含两端）按高度升序的区块头, 'checkpoint': {'height', 'hash'},
+     'shard': 分片号}
+节点分片时（见shards.py）区块头与检查点属于负责该主机名的分片的DNS链，客户端信任的检查点须取自同一分片。
+区块头见merkle.light_header。客户端持有受信任的检查点（某个高度的区块哈希，例如从可信节点得到的链尾），验证：
+    1. 区块头高度连续、每个区块头的previous_hash等于前一个区块头的哈希、工作量证明正确
+    2. 检查点高度的区块头哈希等于受信任的哈希
+    3. 记录所在区块：带交易根时沿包含证明算出交易根（O(log n)），旧区块直接比较区块中的交易
+检查点不低于记录所在的区块时，哈希链接从受信任的检查点回溯到该区块；检查点更低时只能证明该区块是检查点的后代。
+包含证明只说明这条交易在链上，同一主机名以最早上链的交易为准，证明不排除更早的交易。
+"""
+
+import requests
+
+from blockchain import Blockchain
+from merkle import block_hash, tx_hash, verify_merkle_proof
+from records import record_sets
+
+
+class ProofError(ValueError):
+    pass
+
+
+def verify_hostname_proof(proof, hostname, checkpoint_height, checkpoint_hash):
+    """
+    :param proof: /dns/proof的应答
+    :param checkpoint_height: 受信任的检查点高度
+    :param checkpoint_hash: 受信任的检查点区块哈希
+    :return: 已验证的记录（交易）
+    :raise ProofError: 验证失败
+    """
+    try:
+        record = proof['record']
+        headers = proof['headers']
+        if record.get('hostname') != hostname or not headers:
+            raise ProofError(f'proof is not for {hostname}')
+        hashes = {}
+        last = None
+        for header in headers:
+            if last is not None:
+                if header['index'] != last['index'] + 1 or header['previous_hash'] != hashes[last['index']]:
+                    raise ProofError(f"header {header['index']} does not link to its parent")
+                if not Blockchain.valid_proof(last['proof'], header['proof']):
+                    raise ProofError(f"header {header['index']} has an invalid proof of work")
+            hashes[header['index']] = block_hash(header)
+            last = header
+        if hashes.get(checkpoint_height) != checkpoint_hash:
+            raise ProofError('header chain does not reach the trusted checkpoint')
+
+        offset = proof['block_index'] - headers[0]['index']
+        index = proof['tx_index']
+        if offset < 0 or index < 0:
+            raise ProofError('record block or transaction out of range')
+        header = headers[offset]
+        if 'tx_root' in header:
+            if not verify_merkle_proof(tx_hash(record), index, proof['proof'], header['tx_root']):
+                raise ProofError('inclusion proof does not match the block tx_root')
+        elif header['transactions'][index] != record:
+            raise ProofError('record is not in the block')
+    except (KeyError, IndexError, TypeError, AttributeError) as e:
+        raise ProofError(f'malformed proof: {e}')
+    return record
+
+
+class LightClient(object):
+    def __init__(self, node, checkpoint_height, checkpoint_hash, timeout=5):
+        """
+        :param node: 提供证明的节点地址 host:port
+        :param checkpoint_height: 受信任的检查点高度
+        :param checkpoint_hash: 受信任的检查点区块哈希
+        """
+        self.node = node
+        self.checkpoint_height = checkpoint_height
+        self.checkpoint_hash = checkpoint_hash
+        self.timeout = timeout
+
+    def lookup(self, hostname):
+        """
+        :return: 已验证的按类型分组的记录集，见records.record_sets
+        :raise LookupError: 节点上没有该主机名
+        :raise ProofError: 节点的应答未通过验证
+        """
+        response = requests.get(f'http://{self.node}/dns/proof', timeout=self.timeout,
+                                params={'hostname': hostname, 'checkpoint': self.checkpoint_height})
+        if response.status_code == 404:
+            raise LookupError(hostname)
+        if response.status_code != 200:
+            raise ProofError(f'{self.node} returned {response.status_code}')
+        record = verify_hostname_proof(response.json(), hostname, self.checkpoint_height, self.checkpoint_hash)
+        return record_sets(record)
@@ -0,0 +1,96 @@
+"""
+区块交易的默克尔树
+
+叶子为交易的规范JSON（键排序、无空白）的SHA-256；每层两两拼接后取SHA-256，
+奇数个节点时最后一个与自身配对。没有交易时根为EMPTY_ROOT。
+新区块带有 'tx_root' 字段，区块哈希只覆盖除交易以外的字段（区块头），由交易根承诺区块中的全部交易，
+因此只凭区块头即可验证区块链接，再凭包含证明（merkle_proof，O(log n)个兄弟节点）验证某条交易在区块中。
+没有tx_root的旧区块的哈希仍覆盖整个区块。
+"""
+
+import hashlib
+import json
+
+EMPTY_ROOT = '0' * 64
+
+
+def tx_hash(tx):
+    """
+    :return: 交易的叶子哈希（hex）
+    """
+    data = json.dumps(tx, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def _parent(left, right):
+    return hashlib.sha256(left + right).digest()
+
+
+def merkle_root(transactions):
+    """
+    :param transactions: 交易列表
+    :return: 默克尔根（hex）
+    """
+    level = [bytes.fromhex(tx_hash(tx)) for tx in transactions]
+    if not level:
+        return EMPTY_ROOT
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [_parent(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+
+def merkle_proof(transactions, index):
+    """
+    :param index: 交易在区块中的序号
+    :return: 从叶子到根的兄弟节点哈希（hex）列表
+    """
+    level = [bytes.fromhex(tx_hash(tx)) for tx in transactions]
+    proof = []
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        proof.append(level[index ^ 1].hex())
+        level = [_parent(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+        index //= 2
+    return proof
+
+
+def verify_merkle_proof(leaf, index, proof, root):
+    """
+    :param leaf: 交易的叶子哈希，见tx_hash
+    :param index: 交易在区块中的序号
+    :param proof: merkle_proof的结果
+    :return: 沿证明算出的根是否等于root
+    """
+    node = bytes.fromhex(leaf)
+    for sibling in proof:
+        sibling = bytes.fromhex(sibling)
+        node = _parent(node, sibling) if index % 2 == 0 else _parent(sibling, node)
+        index //= 2
+    return index == 0 and node.hex() == root
+
+
+def light_header(block):
+    """
+    :return: 轻客户端用的区块头：带交易根的区块去掉交易，旧区块为整个区块；两者的block_hash都等于区块哈希
+    """
+    if 'tx_root' not in block:
+        return block
+    return {key: value for key, value in block.items() if key != 'transactions'}
+
+
+def block_hash(block):
+    """
+    :return: 区块（或light_header）的SHA-256哈希（hex）
+    """
+    block_string = json.dumps(light_header(block), sort_keys=True).encode()
+    return hashlib.sha256(block_string).hexdigest()
+
+
+def block_tx_root(block):
+    """
+    :return: 区块的交易根，旧区块没有tx_root字段时即时计算
+    """
+    return block.get('tx_root') or merkle_root(block['transactions'])
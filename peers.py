@@ -0,0 +1,241 @@
+"""
+邻居节点表
+
+每个邻居记录请求延迟（指数加权平均）、成功率、连续失败次数、最近一次得知的链高度与链尾哈希，
+以及熔断器状态：
+    closed     正常请求
+    open       连续失败FAILURE_THRESHOLD次后熔断，在退避时间内不再请求
+    half_open  退避时间到后放行一次试探请求，成功则恢复closed，失败则加倍退避重新熔断
+同步只向宣告了更高链尾的高分邻居拉取，广播只发给随机选出的至多GOSSIP_FANOUT个邻居，
+熔断中的邻居不参与二者，失效的节点不再拖慢出块与同步。
+"""
+
+import random
+import threading
+import time
+
+import metrics
+
+# 连续失败该次数后熔断
+FAILURE_THRESHOLD = 3
+# 熔断的初始与最长退避时间（秒）
+BASE_BACKOFF = 5
+MAX_BACKOFF = 300
+# 延迟与成功率的指数加权系数
+EWMA_ALPHA = 0.3
+# 尚未测得延迟的邻居按该延迟（秒）计分
+DEFAULT_LATENCY = 0.5
+# 每次广播最多通知的邻居数
+GOSSIP_FANOUT = 8
+# 每次同步最多拉取整条链的邻居数
+SYNC_PEERS = 3
+# 链尾信息超过该时间（秒）视为过期，同步前重新探测
+TIP_MAX_AGE = 10
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+PEERS = metrics.Gauge('dns_peers', '邻居节点数', ['chain', 'state'])
+
+
+class Peer(object):
+    __slots__ = ('address', 'latency', 'reliability', 'failures', 'requests', 'tip_height', 'tip_hash',
+                 'tip_seen', 'last_seen', 'state', 'open_until', 'backoff', 'trial')
+
+    def __init__(self, address):
+        self.address = address
+        self.latency = None       # 请求延迟的指数加权平均（秒）
+        self.reliability = 1.0    # 成功率的指数加权平均
+        self.failures = 0         # 连续失败次数
+        self.requests = 0
+        self.tip_height = None
+        self.tip_hash = None
+        self.tip_seen = 0.0       # 得知链尾信息的时间
+        self.last_seen = None     # 最近一次请求成功的时间
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.backoff = BASE_BACKOFF
+        self.trial = False        # half_open状态下的试探请求是否已放出
+
+    def score(self):
+        """
+        分数越高越优先：成功率高、延迟低
+        """
+        latency = DEFAULT_LATENCY if self.latency is None else self.latency
+        return self.reliability / (latency + 0.05)
+
+    def to_dict(self):
+        return {
+            'address': self.address,
+            'state': self.state,
+            'score': round(self.score(), 3),
+            'latency': self.latency,
+            'reliability': round(self.reliability, 3),
+            'failures': self.failures,
+            'requests': self.requests,
+            'tip_height': self.tip_height,
+            'tip_hash': self.tip_hash,
+            'last_seen': self.last_seen,
+            'open_until': self.open_until if self.state != CLOSED else None,
+        }
+
+
+class PeerTable(object):
+    def __init__(self, chain_name, clock=time.time):
+        """
+        :param chain_name: 所属区块链的名称，用于指标
+        :param clock: 时钟函数，便于替换
+        """
+        self.chain_name = chain_name
+        self.clock = clock
+        self._peers = {}
+        self._lock = threading.Lock()
+        for state in (CLOSED, OPEN, HALF_OPEN):
+            PEERS.labels(chain_name, state).set_function(lambda state=state: self.count(state))
+
+    # ---- 兼容原先的地址集合 ----
+
+    def add(self, address):
+        with self._lock:
+            if address not in self._peers:
+                self._peers[address] = Peer(address)
+
+    def discard(self, address):
+        with self._lock:
+            self._peers.pop(address, None)
+
+    def __contains__(self, address):
+        return address in self._peers
+
+    def __iter__(self):
+        return iter(list(self._peers))
+
+    def __len__(self):
+        return len(self._peers)
+
+    def get(self, address):
+        return self._peers.get(address)
+
+    def count(self, state):
+        return sum(1 for peer in list(self._peers.values()) if peer.state == state)
+
+    # ---- 熔断 ----
+
+    def _allowed(self, peer, now):
+        if peer.state == CLOSED:
+            return True
+        if peer.state == OPEN and now >= peer.open_until:
+            peer.state = HALF_OPEN
+            peer.trial = False
+        return peer.state == HALF_OPEN and not peer.trial
+
+    def _take(self, peers):
+        # half_open的邻居只放出一次试探请求
+        for peer in peers:
+            if peer.state == HALF_OPEN:
+                peer.trial = True
+        return [peer.address for peer in peers]
+
+    def available(self):
+        """
+        :return: 熔断器允许请求的邻居，不占用half_open的试探机会
+        """
+        now = self.clock()
+        with self._lock:
+            return [peer for peer in self._peers.values() if self._allowed(peer, now)]
+
+    def record_success(self, address, latency):
+        """
+        :param latency: 请求耗时（秒）
+        """
+        now = self.clock()
+        with self._lock:
+            peer = self._peers.get(address)
+            if peer is None:
+                return
+            peer.requests += 1
+            peer.latency = latency if peer.latency is None else \
+                EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * peer.latency
+            peer.reliability = EWMA_ALPHA + (1 - EWMA_ALPHA) * peer.reliability
+            peer.failures = 0
+            peer.last_seen = now
+            peer.state = CLOSED
+            peer.backoff = BASE_BACKOFF
+            peer.trial = False
+
+    def observe_tip(self, address, height, tip_hash):
+        """
+        记录邻居宣告的链高度与链尾哈希
+        """
+        with self._lock:
+            peer = self._peers.get(address)
+            if peer is not None:
+                peer.tip_height, peer.tip_hash, peer.tip_seen = height, tip_hash, self.clock()
+
+    def record_failure(self, address):
+        now = self.clock()
+        with self._lock:
+            peer = self._peers.get(address)
+            if peer is None:
+                return
+            peer.requests += 1
+            peer.reliability *= (1 - EWMA_ALPHA)
+            peer.failures += 1
+            if peer.state == HALF_OPEN:
+                # 试探失败，加倍退避
+                peer.backoff = min(peer.backoff * 2, MAX_BACKOFF)
+            elif peer.failures < FAILURE_THRESHOLD:
+                return
+            peer.state = OPEN
+            peer.trial = False
+            # 加入抖动，避免多个节点同时恢复请求
+            peer.open_until = now + peer.backoff * random.uniform(0.8, 1.2)
+
+    # ---- 选择 ----
+
+    def gossip_targets(self, fanout=GOSSIP_FANOUT):
+        """
+        :return: 随机选出的至多fanout个可请求的邻居地址
+        """
+        with self._lock:
+            now = self.clock()
+            peers = [peer for peer in self._peers.values() if self._allowed(peer, now)]
+            if len(peers) > fanout:
+                peers = random.sample(peers, fanout)
+            return self._take(peers)
+
+    def expire_tips(self, host):
+        """
+        把主机host上的邻居的链尾信息标记为过期，例如收到它的新区块广播时
+        """
+        with self._lock:
+            for peer in self._peers.values():
+                if peer.address.rsplit(':', 1)[0] == host:
+                    peer.tip_seen = 0.0
+
+    def stale_tips(self, limit=GOSSIP_FANOUT):
+        """
+        :return: 链尾信息未知或过期、需要探测的邻居地址，信息最旧的优先，同样旧的按分数从高到低，至多limit个
+        """
+        with self._lock:
+            now = self.clock()
+            peers = [peer for peer in self._peers.values()
+                     if self._allowed(peer, now) and now - peer.tip_seen > TIP_MAX_AGE]
+            peers.sort(key=lambda peer: (peer.tip_seen, -peer.score()))
+            return self._take(peers[:limit])
+
+    def sync_candidates(self, height, limit=SYNC_PEERS):
+        """
+        :param height: 本地链高度
+        :return: 宣告的链高度大于height的邻居地址，按链高度、分数从高到低至多limit个
+        """
+        with self._lock:
+            now = self.clock()
+            peers = [peer for peer in self._peers.values()
+                     if peer.tip_height is not None and peer.tip_height > height and self._allowed(peer, now)]
+            peers.sort(key=lambda peer: (peer.tip_height, peer.score()), reverse=True)
+            return self._take(peers[:limit])
+
+    def snapshot(self):
+        with self._lock:
+            peers = sorted(self._peers.values(), key=Peer.score, reverse=True)
+            return [peer.to_dict() for peer in peers]
@@ -0,0 +1,78 @@
+"""
+进程内采样分析器
+
+在调用线程中按固定间隔采样进程内所有其他线程的调用栈，输出火焰图工具
+（flamegraph.pl、speedscope等）可直接读取的折叠栈格式：
+    线程名;最外层函数 (文件:行);...;最内层函数 (文件:行) 采样次数
+只在采样期间有开销；默认不启用，需设置 DNS_PROFILER=1（或server.py的 --profiler）。
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# 是否允许通过 /debug/profile 采样
+ENABLED = os.environ.get('DNS_PROFILER') == '1'
+# 默认采样间隔（秒）
+DEFAULT_INTERVAL = 0.005
+# 单次采样的最长时间（秒）
+MAX_SECONDS = 60
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+_session_lock = threading.Lock()
+
+
+def _frame_label(code, cache):
+    label = cache.get(code)
+    if label is None:
+        label = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+        cache[code] = label
+    return label
+
+
+def sample(seconds, interval=DEFAULT_INTERVAL):
+    """
+    阻塞地采样seconds秒
+
+    :param seconds: 采样时长（秒），不超过MAX_SECONDS
+    :param interval: 采样间隔（秒）
+    :return: Counter，折叠栈 -> 采样次数
+    :raise ProfilerBusy: 已有另一个采样在进行
+    """
+    if not _session_lock.acquire(blocking=False):
+        raise ProfilerBusy('another profiling session is running')
+    try:
+        seconds = min(max(seconds, 0), MAX_SECONDS)
+        me = threading.get_ident()
+        labels = {}
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                parts = []
+                while frame is not None:
+                    parts.append(_frame_label(frame.f_code, labels))
+                    frame = frame.f_back
+                parts.append(names.get(ident, f'thread-{ident}'))
+                parts.reverse()
+                stacks[';'.join(parts)] += 1
+            time.sleep(interval)
+        return stacks
+    finally:
+        _session_lock.release()
+
+
+def collapsed(stacks):
+    """
+    :return: 折叠栈格式的文本，按采样次数从多到少
+    """
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
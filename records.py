@@ -0,0 +1,160 @@
+"""
+DNS记录模型
+
+一条DNS交易可以带有多条记录：
+    'records': [
+        {'type': 'A', 'value': '192.0.2.1', 'ttl': 300},
+        {'type': 'MX', 'value': 'mail.example.com', 'priority': 10},
+        {'type': 'TXT', 'value': 'v=spf1 -all'},
+    ]
+没有records字段的旧交易把ip视为一条A（或AAAA）记录。
+索引中每个主机名保存按类型分组、可以直接应答的记录集：
+    {'A': {'ttl': 300, 'rdata': ['192.0.2.1']}, 'MX': {'ttl': 300, 'rdata': ['10 mail.example.com']}}
+rdata为区域文件格式的文本。
+"""
+
+import ipaddress
+import re
+
+RECORD_TYPES = ('A', 'AAAA', 'CNAME', 'MX', 'TXT', 'NS')
+# 未指定TTL时的默认值（秒）
+DEFAULT_TTL = 300
+MAX_TTL = 2147483647
+DEFAULT_MX_PRIORITY = 10
+# 跟随CNAME的最大层数
+MAX_CNAME_DEPTH = 8
+
+_LABEL = re.compile(r'^(?!-)[A-Za-z0-9_-]{1,63}(?<!-)$')
+
+
+def _domain_name(value):
+    name = str(value).strip().rstrip('.')
+    if not name or len(name) > 253 or not all(_LABEL.match(label) for label in name.split('.')):
+        raise ValueError(f'invalid domain name: {value}')
+    return name
+
+
+def _normalize(record):
+    if not isinstance(record, dict):
+        raise ValueError(f'record must be an object: {record}')
+    rtype = str(record.get('type', '')).upper()
+    if rtype not in RECORD_TYPES:
+        raise ValueError(f'unsupported record type: {record.get("type")}')
+    value = record.get('value')
+    if value is None or value == '':
+        raise ValueError(f'{rtype} record requires a value')
+    try:
+        ttl = int(record.get('ttl', DEFAULT_TTL))
+    except (TypeError, ValueError):
+        raise ValueError(f'invalid ttl: {record.get("ttl")}')
+    if not 0 <= ttl <= MAX_TTL:
+        raise ValueError(f'ttl out of range: {ttl}')
+
+    normalized = {'type': rtype, 'ttl': ttl}
+    if rtype == 'A':
+        normalized['value'] = str(ipaddress.IPv4Address(str(value).strip()))
+    elif rtype == 'AAAA':
+        normalized['value'] = str(ipaddress.IPv6Address(str(value).strip()))
+    elif rtype in ('CNAME', 'NS'):
+        normalized['value'] = _domain_name(value)
+    elif rtype == 'MX':
+        normalized['value'] = _domain_name(value)
+        try:
+            priority = int(record.get('priority', DEFAULT_MX_PRIORITY))
+        except (TypeError, ValueError):
+            raise ValueError(f'invalid MX priority: {record.get("priority")}')
+        if not 0 <= priority <= 65535:
+            raise ValueError(f'MX priority out of range: {priority}')
+        normalized['priority'] = priority
+    else:  # TXT
+        value = str(value)
+        if len(value.encode('utf-8')) > 255:
+            raise ValueError('TXT record longer than 255 bytes')
+        normalized['value'] = value
+    return normalized
+
+
+def normalize_records(records):
+    """
+    校验并规范化用户提交的记录列表
+
+    :param records: list of dict
+    :return: 规范化后的记录列表
+    :raise ValueError: 记录格式不正确，或CNAME与其他类型的记录共存
+    """
+    if not isinstance(records, list) or not records:
+        raise ValueError('records must be a non-empty list')
+    normalized = [_normalize(r) for r in records]
+    types = {r['type'] for r in normalized}
+    if 'CNAME' in types and (len(types) > 1 or len(normalized) > 1):
+        raise ValueError('a CNAME record cannot coexist with other records')
+    return normalized
+
+
+def check_transaction(tx):
+    """
+    校验来自邻居的区块中的一条交易：主机名是非空字符串、租期是整数、记录是normalize_records
+    规范化后的形式，这样应用区块（make_record、record_sets）时不会因记录格式出错
+
+    :raise ValueError: 交易格式不正确
+    """
+    if not isinstance(tx, dict):
+        raise ValueError(f'transaction must be an object: {tx}')
+    if 'hostname' not in tx:
+        return
+    hostname = tx['hostname']
+    if not isinstance(hostname, str) or not hostname:
+        raise ValueError(f'invalid hostname: {hostname}')
+    lease_years = tx.get('lease_years', 1)
+    if not isinstance(lease_years, int) or isinstance(lease_years, bool):
+        raise ValueError(f'invalid lease_years: {lease_years}')
+    if 'records' in tx and normalize_records(tx['records']) != tx['records']:
+        raise ValueError(f'records of {hostname} are not normalized')
+
+
+def _implicit_records(tx):
+    ip = tx.get('ip')
+    if not ip:
+        return []
+    try:
+        address = ipaddress.ip_address(str(ip).strip())
+    except ValueError:
+        return []
+    return [{'type': 'A' if address.version == 4 else 'AAAA', 'value': str(address), 'ttl': DEFAULT_TTL}]
+
+
+def rdata_text(record):
+    if record['type'] == 'MX':
+        return f"{record.get('priority', DEFAULT_MX_PRIORITY)} {record['value']}"
+    return record['value']
+
+
+def record_sets(tx):
+    """
+    由交易生成按类型分组的记录集，集合的TTL取其中最小的TTL
+
+    :return: dict, type -> {'ttl': int, 'rdata': [str]}
+    """
+    records = tx.get('records') or _implicit_records(tx)
+    sets = {}
+    for record in records:
+        rset = sets.get(record['type'])
+        if rset is None:
+            rset = sets[record['type']] = {'ttl': record.get('ttl', DEFAULT_TTL), 'rdata': []}
+        else:
+            rset['ttl'] = min(rset['ttl'], record.get('ttl', DEFAULT_TTL))
+        text = rdata_text(record)
+        if text not in rset['rdata']:
+            rset['rdata'].append(text)
+    return sets
+
+
+def first_address(records):
+    """
+    :return: 记录中的第一个A/AAAA地址，用于兼容只认ip字段的调用方；没有时为None
+    """
+    for rtype in ('A', 'AAAA'):
+        for record in records:
+            if record['type'] == rtype:
+                return record['value']
+    return None
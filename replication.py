@@ -0,0 +1,223 @@
+"""
+注册链到DNS链的跨链复制
+
+注册链上确认的域名由后台线程按批复制到DNS链，注册链出块不再包含DNS链的
+工作量证明与保存。复制进度由水位（已复制到的注册链区块高度及其哈希）表示，
+每批在DNS链出块后才推进水位并写入 data/replication.json。
+复制到DNS链的交易带有来源：
+    'origin': {'block_hash': 注册区块哈希, 'block_index': 注册区块高度, 'tx_index': 交易序号}
+以 (block_hash, tx_index) 为幂等键：DNS链上已有该主机名（主机名以最早上链的为准）
+或同一键已在DNS交易池中时不再投递，因此水位回退后重新扫描不会产生重复交易。
+"""
+
+import json
+import logging
+import os
+import threading
+
+import blockchain as bc
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 每批最多复制的交易数（按整块截断，单个区块不会被拆开）
+BATCH_SIZE = 100
+
+REPLICATED = metrics.Counter('dns_replicated_total', '复制到DNS链的注册交易数')
+REPLICATION_LAG = metrics.Gauge('dns_replication_lag_blocks', '注册链上尚未复制到DNS链的区块数')
+
+
+def replicable(tx):
+    """
+    :return: 交易是否是需要复制到DNS链的域名注册
+    """
+    return 'hostname' in tx and (('ip' in tx and 'port' in tx) or 'records' in tx)
+
+
+def replicated_tx(tx, block_hash, block_index, tx_index, node_id=None):
+    """
+    由注册交易生成复制到DNS链的交易
+    """
+    dns_tx = {
+        'hostname': tx['hostname'],
+        'ip': tx.get('ip'),
+        'port': tx.get('port'),
+        'node_id': tx.get('node_id', node_id),
+        'lease_years': tx.get('lease_years', 1),
+        'origin': {'block_hash': block_hash, 'block_index': block_index, 'tx_index': tx_index},
+    }
+    if 'records' in tx:
+        dns_tx['records'] = tx['records']
+    # 保留原交易的签名：签名内容相同，复制的交易与原交易有相同的交易ID
+    if 'node_id' in tx and 'signature' in tx:
+        dns_tx['public_key'] = tx.get('public_key')
+        dns_tx['signature'] = tx['signature']
+    return dns_tx
+
+
+def origin_key(tx):
+    origin = tx.get('origin')
+    if not origin:
+        return None
+    return origin['block_hash'], origin['tx_index']
+
+
+def watermark_path(data_dir):
+    return os.path.join(data_dir, 'replication.json')
+
+
+def write_watermark(path, height, block_hash):
+    bc.atomic_write_json(path, {'height': height, 'hash': block_hash})
+
+
+class Replicator(object):
+    def __init__(self, layer, batch_size=None):
+        """
+        :param layer: dns_layer，复制其register_blockchain到dns_blockchain
+        :param batch_size: 每批最多复制的交易数，默认为BATCH_SIZE
+        """
+        self.layer = layer
+        self.source = layer.register_blockchain
+        self.target = layer.dns_blockchain
+        self.batch_size = batch_size or BATCH_SIZE
+        self.path = watermark_path(layer.data_dir)
+        self.height, self.tip_hash = self._load_watermark()
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.source.listeners.append(self._on_source_event)
+        self.target.listeners.append(self._on_target_event)
+        REPLICATION_LAG.labels().set_function(lambda: max(len(self.source.chain) - self.height, 0))
+
+    def _load_watermark(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return int(data['height']), data['hash']
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0, None
+
+    def _set_watermark(self, height, block_hash):
+        self.height, self.tip_hash = height, block_hash
+        write_watermark(self.path, height, block_hash)
+
+    def _rewind(self, height):
+        """
+        把水位回退到height个区块，之后的区块会被重新扫描
+        """
+        with self._lock:
+            if height >= self.height:
+                return
+            block_hash = self.source.hash(self.source.chain[height - 1]) if height > 0 else None
+            logger.info("跨链复制水位从 %d 回退到 %d", self.height, height)
+            self._set_watermark(height, block_hash)
+
+    def _check_watermark(self):
+        """
+        水位对应的区块已不在注册链上时（链被替换或重新加载）从头重新扫描
+        """
+        with self._lock:
+            chain = self.source.chain
+            if self.height == 0:
+                return
+            if self.height > len(chain) or self.source.hash(chain[self.height - 1]) != self.tip_hash:
+                self._rewind(0)
+
+    def start(self):
+        """
+        校验水位并启动后台复制线程，立即补齐水位之后的区块
+        """
+        self._check_watermark()
+        self._thread = threading.Thread(target=self._run, name='replicator', daemon=True)
+        self._thread.start()
+        self.kick()
+
+    def stop(self):
+        """
+        停止后台复制线程并不再响应链事件（例如换钱包后重新打开dns_layer时），正在复制的一批会完成
+        """
+        self._stopped.set()
+        for blockchain, listener in ((self.source, self._on_source_event), (self.target, self._on_target_event)):
+            if listener in blockchain.listeners:
+                blockchain.listeners.remove(listener)
+        self._wake.set()
+
+    def kick(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopped.is_set():
+                return
+            try:
+                while self.run_once():
+                    pass
+            except Exception as e:
+                logger.exception("跨链复制失败: %s", e)
+
+    def _delivered(self, key, hostname, pending):
+        return key in pending or hostname in self.layer.trackers['dns'].state.records
+
+    def run_once(self):
+        """
+        复制水位之后的一批区块：把其中的注册交易加入DNS链交易池并出一个块，再推进水位
+
+        :return: 水位推进的区块数，没有新区块时为0
+        """
+        # 先取DNS链的链锁再取本对象的锁：同步线程替换DNS链时持有链锁并在重组事件中回退水位，
+        # 加锁顺序相反会死锁。取批次、出块与推进水位在锁内完成，广播在释放链锁之后
+        with self.target.lock, self._lock:
+            start = self.height
+            pending = {origin_key(tx) for tx in self.target.current_transactions}
+            batch = []
+            end, end_hash = start, self.tip_hash
+            for block in self.source.chain.iter(start):
+                block_hash = self.source.hash(block)
+                for i, tx in enumerate(block['transactions']):
+                    if not replicable(tx):
+                        continue
+                    key = (block_hash, i)
+                    if self._delivered(key, tx['hostname'], pending):
+                        continue
+                    pending.add(key)
+                    batch.append(replicated_tx(tx, block_hash, block['index'], i, self.layer.node_identifier))
+                end, end_hash = block['index'], block_hash
+                if len(batch) >= self.batch_size:
+                    break
+            if end == start:
+                return 0
+            if batch:
+                self.target.add_transactions(batch)
+                self.layer.mine_locked('dns')
+                REPLICATED.inc(len(batch))
+            self._set_watermark(end, end_hash)
+        logger.debug("跨链复制了 %d 条交易，水位 %d", len(batch), end)
+        if batch:
+            self.layer.publish_block('dns')
+        return end - start
+
+    def _on_source_event(self, blockchain, event, block):
+        if event == 'reorg':
+            self._rewind(block.fork_point)
+        elif event == 'reset':
+            self._check_watermark()
+        self.kick()
+
+    def _on_target_event(self, blockchain, event, block):
+        if event == 'reset':
+            # DNS链被清空或重新加载：从头扫描，已在DNS链上的主机名不会重复投递
+            self._rewind(0)
+            self.kick()
+            return
+        if event != 'reorg':
+            return
+        # DNS链重组移除的复制交易需要重新投递：回退到其中最早的来源区块之前
+        kept = {origin_key(tx) for added in block.added for tx in added['transactions']}
+        heights = [tx['origin']['block_index'] for removed in block.removed for tx in removed['transactions']
+                   if origin_key(tx) is not None and origin_key(tx) not in kept]
+        if heights:
+            self._rewind(min(heights) - 1)
+            self.kick()
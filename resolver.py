@@ -1,14 +1,49 @@
 # extracted and modified from https://gist.github.com/samuelcolvin/ca8b429504c96ee738d62a798172b046
 
-from datetime import datetime
-from time import sleep
+import logging
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
 
-from dnslib import DNSLabel, QTYPE, RD, RR
+from dnslib import DNSHeader, DNSLabel, DNSQuestion, DNSRecord, OPCODE, QTYPE, RCODE, RD, RR
 from dnslib import A, AAAA, CNAME, MX, NS, SOA, TXT
-from dnslib.server import DNSServer
+from dnslib.server import DNSHandler, DNSLogger, DNSServer
 
-EPOCH = datetime(1970, 1, 1)
-SERIAL = int((datetime.utcnow() - EPOCH).total_seconds())
+import metrics
+from cache import SingleFlight, TTLCache
+from zone import open_journal
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPSTREAM = ('8.8.8.8', 53)
+# 上游请求超时（秒）
+UPSTREAM_TIMEOUT = 2
+# 上游应答缓存的条目数
+CACHE_SIZE = 10000
+# 剩余TTL低于原TTL的该比例时预取
+PREFETCH_RATIO = 0.1
+PREFETCH_MIN_HITS = 2
+# 没有SOA的否定应答的缓存时间（秒）
+NEGATIVE_TTL = 60
+
+RESOLVER_ANSWERS = metrics.Counter('dns_resolver_answers_total',
+                                   'DNS服务的应答来源：chain、cache、upstream、coalesced（合并到进行中的上游查询）、prefetch、servfail',
+                                   ['source'])
+UPSTREAM_SECONDS = metrics.Histogram('dns_resolver_upstream_seconds', '上游解析器查询耗时（秒）')
+ZONE_TRANSFERS = metrics.Counter('dns_zone_transfers_total',
+                                 '区域传送：axfr完整区域，ixfr增量，ixfr_full无法给出增量而返回完整区域，refused被拒绝',
+                                 ['type'])
+NOTIFY_SENT = metrics.Counter('dns_notify_total', '发送给从服务器的NOTIFY：ack收到应答，timeout重试后仍无应答',
+                              ['result'])
+
+# SOA的refresh、retry、expire、minimum（秒）；序列号为DNS链的高度，见zone.py
+SOA_TIMES = (60 * 60 * 1, 60 * 60 * 3, 60 * 60 * 24, 60 * 60 * 1)
+# 区域传送每个应答消息携带的记录数，保证TCP消息不超过64KB
+TRANSFER_CHUNK = 100
+# NOTIFY的应答超时（秒）与重试次数
+NOTIFY_TIMEOUT = 2
+NOTIFY_RETRIES = 3
 
 TYPE_LOOKUP = {
     A: QTYPE.A,
@@ -20,8 +55,18 @@ TYPE_LOOKUP = {
     TXT: QTYPE.TXT,
 }
 
+# 链上记录类型 -> dnslib的rdata类型
+RDATA_TYPES = {
+    'A': A,
+    'AAAA': AAAA,
+    'CNAME': CNAME,
+    'MX': MX,
+    'NS': NS,
+    'TXT': TXT,
+}
+
 class Record:
-    def __init__(self, rdata_type, *args, rtype=None, rname=None, ttl=None, **kwargs):
+    def __init__(self, rdata_type, *args, rtype=None, rname=None, ttl=None, serial=0, **kwargs):
         if isinstance(rdata_type, RD):
             # actually an instance, not a type
             self._rtype = TYPE_LOOKUP[rdata_type.__class__]
@@ -30,13 +75,7 @@ class Record:
             self._rtype = TYPE_LOOKUP[rdata_type]
             if rdata_type == SOA and len(args) == 2:
                 # add sensible times to SOA
-                args += ((
-                    SERIAL,  # serial number
-                    60 * 60 * 1,  # refresh
-                    60 * 60 * 3,  # retry
-                    60 * 60 * 24,  # expire
-                    60 * 60 * 1,  # minimum
-                ),)
+                args += ((serial,) + SOA_TIMES,)
             rdata = rdata_type(*args)
 
         if rtype:
@@ -68,30 +107,391 @@ class Record:
     def __str__(self):
         return '{} {}'.format(QTYPE[self._rtype], self.kwargs)
 
+def rdata_from_text(rtype, text):
+    """
+    由索引中区域文件格式的rdata文本构造dnslib的RD对象
+    """
+    if rtype == 'MX':
+        preference, exchange = text.split(' ', 1)
+        return MX(exchange, int(preference))
+    return RDATA_TYPES[rtype](text)
+
+
+def _record_rrs(hostname, record):
+    """
+    :return: 索引记录中可应答的全部记录，dnslib的RR列表
+    """
+    rrs = []
+    for rtype, rset in (record.get('records') or {}).items():
+        if rtype not in RDATA_TYPES:
+            continue
+        for text in rset['rdata']:
+            rrs.append(Record(rdata_from_text(rtype, text), rname=hostname + '.', ttl=rset['ttl']).as_rr(None))
+    return rrs
+
+
 class Resolver:
-    def __init__(self,dns_layer):
+    def __init__(self, dns_layer, origin='.', notifier=None, transfer_clients=()):
+        """
+        :param dns_layer: dns_layer实例，或返回当前dns_layer的函数（钱包切换后dns_layer会被替换）
+        :param origin: 链上区域的名称，应答该名称的SOA与区域传送
+        :param notifier: 可选的Notifier，区域变化后通知从服务器
+        :param transfer_clients: 除本机外允许区域传送的客户端地址
+        """
         self.dns_layer = dns_layer
+        self.origin = DNSLabel(origin)
+        self._suffix = '' if origin in ('', '.') else '.' + str(self.origin).rstrip('.').lower()
+        self.notifier = notifier
+        self.transfer_clients = {'127.0.0.1', '::1'} | set(transfer_clients)
+        self._journal = None
+        self._journal_lock = threading.Lock()
+
+    @property
+    def layer(self):
+        return self.dns_layer() if callable(self.dns_layer) else self.dns_layer
+
+    def journal(self):
+        """
+        :return: 当前dns_layer的区域变更日志，dns_layer不可用或没有DNS链的状态时为None
+        """
+        layer = self.layer
+        if layer is None or 'dns' not in layer.trackers:
+            return None
+        with self._journal_lock:
+            journal = self._journal
+            if journal is None or journal.layer is not layer:
+                if journal is not None:
+                    journal.close()
+                journal = self._journal = open_journal(layer)
+                if self.notifier is not None:
+                    journal.listeners.append(self.notifier.notify)
+        return journal
+
+    def _in_zone(self, hostname):
+        return not self._suffix or ('.' + hostname.lower()).endswith(self._suffix)
+
+    def soa_rr(self, serial):
+        origin = str(self.origin).rstrip('.')
+        prefix = origin + '.' if origin else ''
+        return Record(SOA, 'ns.' + prefix, 'hostmaster.' + prefix, serial=serial, rname=self.origin).as_rr(None)
+
+    def transfer(self, request, client, tcp=True):
+        """
+        应答AXFR/IXFR请求（RFC 5936、RFC 1995）
+
+        :param client: 客户端地址
+        :param tcp: 是否经TCP请求；UDP上不做AXFR，IXFR有增量时只返回SOA，让对方改用TCP
+        :return: 应答消息列表，按顺序发送
+        """
+        qtype = request.q.qtype
+        reply = request.reply()
+        journal = self.journal()
+        if client not in self.transfer_clients or journal is None or (qtype == QTYPE.AXFR and not tcp):
+            ZONE_TRANSFERS.labels('refused').inc()
+            reply.header.rcode = RCODE.REFUSED
+            return [reply]
+        if request.q.qname != self.origin:
+            reply.header.rcode = RCODE.NOTAUTH
+            return [reply]
+
+        serial = journal.serial
+        soa = self.soa_rr(serial)
+        changes = None
+        if qtype == QTYPE.IXFR:
+            client_soa = [rr for rr in request.auth if rr.rtype == QTYPE.SOA]
+            if not client_soa:
+                reply.header.rcode = RCODE.FORMERR
+                return [reply]
+            client_serial = client_soa[0].rdata.times[0]
+            changes = journal.changes_since(client_serial)
+            if changes == [] or (changes is not None and not tcp):
+                ZONE_TRANSFERS.labels('ixfr').inc()
+                reply.add_answer(soa)
+                return [reply]
+        if changes is not None:
+            # 主机名只会新增：一个差异序列，删除部分为空
+            ZONE_TRANSFERS.labels('ixfr').inc()
+            rrs = [soa, self.soa_rr(client_serial), soa]
+        else:
+            ZONE_TRANSFERS.labels('ixfr_full' if qtype == QTYPE.IXFR else 'axfr').inc()
+            changes = journal.records()
+            rrs = [soa]
+        for hostname, record in changes:
+            if self._in_zone(hostname):
+                rrs += _record_rrs(hostname, record)
+        rrs.append(soa)
+
+        messages = []
+        for start in range(0, len(rrs), TRANSFER_CHUNK):
+            message = request.reply()
+            for rr in rrs[start:start + TRANSFER_CHUNK]:
+                message.add_answer(rr)
+            messages.append(message)
+        return messages
+
+    def zone_reply(self, request):
+        """
+        :return: 区域名称的SOA应答，不是对区域SOA的查询时为None
+        """
+        if request.q.qtype not in (QTYPE.SOA, QTYPE.ANY) or request.q.qname != self.origin:
+            return None
+        journal = self.journal()
+        if journal is None:
+            return None
+        reply = request.reply()
+        reply.add_answer(self.soa_rr(journal.serial))
+        return reply
+
+    def resolve(self, request, handler):
+        reply = self.zone_reply(request) or self.chain_reply(request)
+        if reply is None:
+            reply = request.reply()
+            reply.header.rcode = RCODE.NXDOMAIN
+        return reply
+
+    def chain_reply(self, request):
+        """
+        从dns_layer的链上记录应答：一次返回所请求类型的完整记录集，
+        主机名是CNAME时一并返回目标主机名的记录
+
+        :return: 应答，主机名不在链上（也不在待上链缓冲中）时为None
+        """
+        layer = self.layer
+        if layer is None:
+            return None
+        qname = request.q.qname
+        qtype = QTYPE.get(request.q.qtype)
+        hostname = str(qname).rstrip('.')
+        try:
+            result = layer.query(hostname, None if qtype == 'ANY' else qtype)
+        except LookupError:
+            return None
+
+        reply = request.reply()
+        for answer in result['records']:
+            if answer['type'] not in RDATA_TYPES:
+                continue
+            record = Record(rdata_from_text(answer['type'], answer['rdata']),
+                            rname=answer['name'] + '.', ttl=answer['ttl'])
+            rr = record.as_rr(qname)
+            logger.debug('%s', rr)
+            reply.add_answer(rr)
+        return reply
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class ForwardingResolver(Resolver):
+    def __init__(self, dns_layer, upstream=DEFAULT_UPSTREAM, timeout=UPSTREAM_TIMEOUT,
+                 cache_size=CACHE_SIZE, prefetch_ratio=PREFETCH_RATIO, prefetch_min_hits=PREFETCH_MIN_HITS,
+                 **kwargs):
+        """
+        链上没有的主机名转发给上游解析器，并缓存上游的应答
+
+        :param upstream: 上游解析器 (host, port)
+        :param timeout: 上游请求超时（秒）
+        :param cache_size: 应答缓存的条目数
+        :param prefetch_ratio: 剩余TTL低于原TTL的该比例时，命中会触发后台刷新
+        :param prefetch_min_hits: 触发预取所需的最少命中次数，只预取热门条目
+        :param kwargs: 见Resolver
+        """
+        super().__init__(dns_layer, **kwargs)
+        self.upstream = upstream
+        self.timeout = timeout
+        self.prefetch_ratio = prefetch_ratio
+        self.prefetch_min_hits = prefetch_min_hits
+        self.cache = TTLCache(cache_size)
+        self.flights = SingleFlight()
+        self._prefetch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='dns-prefetch')
 
     def resolve(self, request, handler):
+        reply = self.zone_reply(request) or self.chain_reply(request)
+        if reply is not None:
+            RESOLVER_ANSWERS.labels('chain').inc()
+            return reply
+        key = (str(request.q.qname).lower(), request.q.qtype, request.q.qclass)
+        entry = self.cache.entry(key)
+        if entry is not None:
+            RESOLVER_ANSWERS.labels('cache').inc()
+            now = self.cache.clock()
+            remaining = entry.remaining(now)
+            if (remaining < entry.ttl * self.prefetch_ratio and entry.hits >= self.prefetch_min_hits
+                    and not self.flights.in_flight(key)):
+                self._prefetch_pool.submit(self._prefetch, key, request.q)
+            return self._from_cache(request, entry.value, entry.ttl - int(remaining))
+        try:
+            response, shared = self.flights.do(key, lambda: self._fetch(key, request.q))
+        except UpstreamError as e:
+            logger.warning('%s', e)
+            RESOLVER_ANSWERS.labels('servfail').inc()
+            reply = request.reply()
+            reply.header.rcode = RCODE.SERVFAIL
+            return reply
+        RESOLVER_ANSWERS.labels('coalesced' if shared else 'upstream').inc()
+        return self._from_cache(request, response, 0)
+
+    def _prefetch(self, key, question):
+        try:
+            self.flights.do(key, lambda: self._fetch(key, question))
+            RESOLVER_ANSWERS.labels('prefetch').inc()
+        except UpstreamError as e:
+            logger.debug('预取失败: %s', e)
+
+    def _fetch(self, key, question):
+        """
+        向上游查询并按应答的TTL写入缓存
+        """
+        query = DNSRecord(q=DNSQuestion(question.qname, question.qtype, question.qclass))
+        start = perf_counter()
+        try:
+            packet = query.send(self.upstream[0], self.upstream[1], timeout=self.timeout)
+            response = DNSRecord.parse(packet)
+        except Exception as e:
+            raise UpstreamError(f'上游解析器 {self.upstream[0]}:{self.upstream[1]} 查询 {question.qname} 失败: {e}')
+        finally:
+            UPSTREAM_SECONDS.observe(perf_counter() - start)
+        if response.header.rcode not in (RCODE.NOERROR, RCODE.NXDOMAIN):
+            # SERVFAIL/REFUSED等不缓存
+            return response
+        self.cache.set(key, response, self._ttl(response))
+        return response
+
+    @staticmethod
+    def _ttl(response):
+        """
+        应答的缓存时间：应答记录中最小的TTL；否定应答（NXDOMAIN或空应答）
+        按RFC 2308取SOA的minimum与其TTL中较小者
+        """
+        if response.rr:
+            return min(rr.ttl for rr in response.rr)
+        for rr in response.auth:
+            if rr.rtype == QTYPE.SOA:
+                return min(rr.ttl, rr.rdata.times[-1])
+        return NEGATIVE_TTL
+
+    @staticmethod
+    def _from_cache(request, response, age):
+        """
+        用缓存的上游应答构造对request的回复，TTL减去已缓存的时间
+        """
         reply = request.reply()
-        # print(request.q.qname)
-        
-        zone = self.zones.get(request.q.qname)
-        if zone is not None:
-            for zone_records in zone:
-                rr = zone_records.try_rr(request.q)
-                print(rr)
-                rr and reply.add_answer(rr)
+        reply.header.rcode = response.header.rcode
+        for section, add in ((response.rr, reply.add_answer), (response.auth, reply.add_auth),
+                             (response.ar, reply.add_ar)):
+            for rr in section:
+                add(RR(rr.rname, rr.rtype, rr.rclass, max(0, rr.ttl - age), rr.rdata))
+        return reply
+
+
+class TransferHandler(DNSHandler):
+    """
+    在dnslib的请求处理之外支持区域传送：一个请求可以有多个TCP应答消息
+    """
+
+    def get_reply(self, data):
+        request = DNSRecord.parse(data)
+        self.server.logger.log_request(self, request)
+        resolver = self.server.resolver
+        if request.q.qtype in (QTYPE.AXFR, QTYPE.IXFR) and isinstance(resolver, Resolver):
+            messages = resolver.transfer(request, self.client_address[0], tcp=self.protocol == 'tcp')
+            # 最后一个消息由handle()发送
+            for message in messages[:-1]:
+                packed = message.pack()
+                self.request.sendall(struct.pack('!H', len(packed)) + packed)
+            reply = messages[-1]
         else:
-            # no direct zone so look for an SOA record for a higher level zone
-            for zone_label, zone_records in self.zones.items():
-                if request.q.qname.matchSuffix(zone_label):
-                    try:
-                        soa_record = next(r for r in zone_records if r.is_soa)
-                    except StopIteration:
-                        continue
-                    else:
-                        reply.add_answer(soa_record.as_rr(zone_label))
-                        break
-
-        return reply
\ No newline at end of file
+            reply = resolver.resolve(request, self)
+        self.server.logger.log_reply(self, reply)
+        rdata = reply.pack()
+        if self.protocol == 'udp' and self.udplen and len(rdata) > self.udplen:
+            truncated_reply = reply.truncate()
+            rdata = truncated_reply.pack()
+            self.server.logger.log_truncated(self, truncated_reply)
+        return rdata
+
+
+class Notifier(object):
+    def __init__(self, origin, secondaries, timeout=NOTIFY_TIMEOUT, retries=NOTIFY_RETRIES):
+        """
+        区域变化后向从服务器发送NOTIFY（RFC 1996），连续的变化合并为一次通知
+
+        :param origin: 区域名称
+        :param secondaries: 从服务器 (host, port) 列表
+        """
+        self.origin = DNSLabel(origin)
+        self.secondaries = list(secondaries)
+        self.timeout = timeout
+        self.retries = retries
+        self.soa_rr = None
+        self._serial = None
+        self._pending = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=max(len(self.secondaries), 1), thread_name_prefix='dns-notify')
+        threading.Thread(target=self._run, name='dns-notifier', daemon=True).start()
+
+    def notify(self, serial):
+        self._serial = serial
+        self._pending.set()
+
+    def _run(self):
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            serial = self._serial
+            list(self._pool.map(lambda secondary: self._send(secondary, serial), self.secondaries))
+
+    def _send(self, secondary, serial):
+        host, port = secondary
+        message = DNSRecord(DNSHeader(opcode=OPCODE.NOTIFY, aa=1, rd=0), q=DNSQuestion(self.origin, QTYPE.SOA))
+        if self.soa_rr is not None:
+            message.add_answer(self.soa_rr(serial))
+        for _ in range(self.retries):
+            try:
+                message.send(host, port, timeout=self.timeout)
+            except Exception as e:
+                logger.debug('NOTIFY %s:%d 失败: %s', host, port, e)
+                continue
+            NOTIFY_SENT.labels('ack').inc()
+            return
+        NOTIFY_SENT.labels('timeout').inc()
+        logger.warning('从服务器 %s:%d 没有应答序列号 %d 的NOTIFY', host, port, serial)
+
+
+def serve(dns_layer, address='0.0.0.0', port=53, upstream=None, origin='.', secondaries=()):
+    """
+    在后台线程中启动UDP和TCP的DNS服务
+
+    :param dns_layer: 见Resolver
+    :param upstream: 上游解析器 (host, port)，为None时只应答链上的主机名
+    :param origin: 链上区域的名称，见Resolver
+    :param secondaries: 从服务器 (host, port) 列表：每个新DNS区块后通知它们，并允许它们区域传送
+    :return: 已启动的DNSServer列表
+    """
+    notifier = Notifier(origin, secondaries) if secondaries else None
+    kwargs = dict(origin=origin, notifier=notifier, transfer_clients=[host for host, _ in secondaries])
+    resolver = ForwardingResolver(dns_layer, upstream, **kwargs) if upstream else Resolver(dns_layer, **kwargs)
+    if notifier is not None:
+        notifier.soa_rr = resolver.soa_rr
+    # 立即开始跟踪DNS链的变更，区块到来时即可通知、增量传送
+    resolver.journal()
+    # dnslib默认把每个请求打印到stdout；只把错误转到日志
+    dns_logger = DNSLogger(log='-recv,-send,-request,-reply,-truncated,-data', prefix=False,
+                           logf=lambda msg: logger.warning('%s', msg))
+    servers = [DNSServer(resolver, port=port, address=address, tcp=tcp, logger=dns_logger, handler=TransferHandler)
+               for tcp in (False, True)]
+    for server in servers:
+        server.start_thread()
+    logger.info('DNS服务运行在 %s:%d%s', address, port,
+                f'，上游 {upstream[0]}:{upstream[1]}' if upstream else '')
+    return servers
+
+
+def parse_upstream(value):
+    """
+    解析 host[:port] 形式的上游地址
+    """
+    host, sep, port = value.rpartition(':')
+    if not sep or not port.isdigit():
+        return value, 53
+    return host, int(port)
@@ -1,6 +1,7 @@
 from flask import Flask
 from flask_cors import CORS
-from api import api
+import logging
+import os
 import secrets
 from datetime import timedelta
 from flask_jwt_extended import JWTManager
@@ -8,9 +9,11 @@ from flask_jwt_extended import JWTManager
 app = Flask(__name__)
 
 def create_app():
+    # 延迟导入api，使运行时可以在dns层初始化之前完成注册
+    from api import api
     app = Flask(__name__)
-    # 设置session密钥
-    app.secret_key = secrets.token_hex(16)
+    # 设置session密钥（多进程模式下由主进程统一生成并通过环境变量传递）
+    app.secret_key = os.environ.get('DNS_SECRET_KEY') or secrets.token_hex(16)
     # 设置session有效期为1小时
     app.permanent_session_lifetime = timedelta(hours=1)
     # JWT配置
@@ -29,10 +32,87 @@ def create_app():
     app.register_blueprint(api)
     return app
 
+def start_dns_server(port, upstream=None, zone='.', notify=None):
+    import api
+    import resolver
+    secondaries = [resolver.parse_upstream(s) for s in notify.split(',') if s] if notify else []
+    return resolver.serve(lambda: api.dns_resolver, port=port,
+                          upstream=resolver.parse_upstream(upstream) if upstream else None,
+                          origin=zone, secondaries=secondaries)
+
 if __name__ == '__main__':
     from argparse import ArgumentParser
     parser = ArgumentParser()
     parser.add_argument('-p', '--port', default=5000, type=int, help='port to listen on')
+    parser.add_argument('--runtime', default='flask', choices=['flask', 'async'],
+                        help='flask: Flask development server; async: asyncio node runtime')
+    parser.add_argument('-w', '--workers', default=0, type=int,
+                        help='number of reader processes; 0 runs a single process node')
+    parser.add_argument('--writer-port', default=None, type=int,
+                        help='internal port of the writer process (default: port + 1)')
+    parser.add_argument('--log-level', default=os.environ.get('DNS_LOG_LEVEL', 'INFO'),
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='logging level (default: $DNS_LOG_LEVEL or INFO)')
+    parser.add_argument('--slow-request-ms', default=None, type=float,
+                        help='log a per-stage breakdown of requests slower than this (default: $DNS_SLOW_REQUEST_MS, off)')
+    parser.add_argument('--profiler', action='store_true',
+                        help='enable the /debug/profile sampling profiler endpoint')
+    parser.add_argument('--dns-port', default=None, type=int,
+                        help='also serve DNS (UDP and TCP) on this port')
+    parser.add_argument('--upstream', default=None,
+                        help='forward names that are not on the chain to this resolver (host[:port])')
+    parser.add_argument('--zone', default='.',
+                        help='name of the on-chain zone served by SOA, AXFR and IXFR (default: the root)')
+    parser.add_argument('--notify', default=None,
+                        help='secondary name servers (host[:port],...) sent NOTIFY on each new DNS block '
+                             'and allowed to transfer the zone')
+    parser.add_argument('--follow', default=None,
+                        help='run as a read-only follower of these nodes (host:port[,host:port...]); '
+                             'no wallet or mining, serves lookups, DNS and the explorer only')
+    parser.add_argument('--shards', default=None, type=int,
+                        help='partition the hostname space across this many parallel chain pairs, '
+                             'each with its own mempool, miner and store (default: $DNS_SHARDS or 1)')
     args = parser.parse_args()
-    app = create_app()
-    app.run(host='0.0.0.0', port=args.port, debug=True)
\ No newline at end of file
+    if args.dns_port and args.workers > 0:
+        parser.error('--dns-port is only supported in single process mode')
+    if args.follow:
+        if args.workers > 0 or args.runtime != 'flask':
+            parser.error('--follow is only supported with the single process flask runtime')
+        os.environ['DNS_NODE_ROLE'] = 'follower'
+        os.environ['DNS_FOLLOW'] = args.follow
+    # 在导入api（以及fork子进程）之前设置，各进程读取相同的配置
+    if args.shards is not None:
+        if args.shards < 1:
+            parser.error('--shards must be at least 1')
+        os.environ['DNS_SHARDS'] = str(args.shards)
+    if args.slow_request_ms is not None:
+        os.environ['DNS_SLOW_REQUEST_MS'] = str(args.slow_request_ms)
+    if args.profiler:
+        os.environ['DNS_PROFILER'] = '1'
+    logging.basicConfig(level=args.log_level,
+                        format='%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s')
+    if args.workers > 0:
+        from workers import WorkerPool
+        WorkerPool(create_app, port=args.port, workers=args.workers,
+                   writer_port=args.writer_port, runtime=args.runtime).run()
+    elif args.runtime == 'async':
+        from aio_node import AsyncNode
+        node = AsyncNode()
+        node.install()
+        app = create_app()
+        if args.dns_port:
+            start_dns_server(args.dns_port, args.upstream, args.zone, args.notify)
+        node.run(app, host='0.0.0.0', port=args.port)
+    elif args.follow:
+        app = create_app()
+        if args.dns_port:
+            start_dns_server(args.dns_port, args.upstream, args.zone, args.notify)
+        # 不使用调试重载器，避免两个进程同时跟随上游写入区块存储
+        app.run(host='0.0.0.0', port=args.port, threaded=True)
+    else:
+        # 调试模式下由重载器启动的子进程提供服务；父进程只监视文件并重启子进程，
+        # 不导入api，也就不会与子进程同时打开可写的区块存储、定时器与跨链复制
+        app = create_app() if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' else Flask(__name__)
+        if args.dns_port and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_dns_server(args.dns_port, args.upstream, args.zone, args.notify)
+        app.run(host='0.0.0.0', port=args.port, debug=True)
\ No newline at end of file
@@ -0,0 +1,78 @@
+"""
+主机名空间分片
+
+主机名按哈希分到DNS_SHARDS个分片，每个分片是一个完整的dns_layer：各自的注册链与DNS链、
+交易池（tmp缓冲）、出块定时器、跨链复制、区块存储与派生状态，互不加锁，
+多个分片可以同时验签、出块和保存，注册吞吐量随分片数增长（PoW在进程池中执行，随CPU核数增长）。
+0号分片使用原来的数据目录与文件名，DNS_SHARDS=1（默认）时与不分片完全相同；
+k号分片的文件位于 <数据目录>/shard-k/，链文件名带 -k 后缀，指标中的链名因此互不相同。
+
+按主机名的请求（查询、注册、状态、包含证明）由dns_layer转交负责的分片；
+按链的请求（链尾、区块头、区块浏览、事件订阅等）用shard查询参数选择分片，默认为0号分片。
+同一网络中的节点必须使用相同的分片数，邻居同步时请求带上shard参数。
+代币余额由钱包文件记录，与分片无关；各分片的配额与奖励分别计算。
+"""
+
+import hashlib
+import os
+
+SHARD_COUNT = int(os.environ.get('DNS_SHARDS', '1'))
+
+
+def shard_of(hostname, count):
+    """
+    :param hostname: 主机名，不区分大小写
+    :param count: 分片数
+    :return: 负责该主机名的分片号
+    """
+    if count <= 1:
+        return 0
+    digest = hashlib.blake2b(hostname.lower().encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
+def shard_dir(data_dir, shard):
+    """
+    :return: 分片的数据目录，0号分片即data_dir本身
+    """
+    return data_dir if shard == 0 else os.path.join(data_dir, f'shard-{shard}')
+
+
+def shard_file(data_dir, shard, name, ext='.json'):
+    """
+    :param name: 不带后缀的文件名，例如 'register'、'tmp_domains'
+    :return: 分片的数据文件路径，例如 data/register.json、data/shard-1/register-1.json
+    """
+    suffix = '' if shard == 0 else f'-{shard}'
+    return os.path.join(shard_dir(data_dir, shard), f'{name}{suffix}{ext}')
+
+
+class ShardRouter(object):
+    def __init__(self, layers):
+        """
+        :param layers: 按分片号排列的dns_layer列表
+        """
+        self.layers = list(layers)
+        for layer in self.layers:
+            layer.router = self
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    def layer(self, shard):
+        """
+        :return: 分片号对应的dns_layer
+        :raise ValueError: 分片号超出范围
+        """
+        if not 0 <= shard < len(self.layers):
+            raise ValueError(f'shard out of range: {shard}, this node has {len(self.layers)} shard(s)')
+        return self.layers[shard]
+
+    def layer_for(self, hostname):
+        """
+        :return: 负责该主机名的dns_layer
+        """
+        return self.layers[shard_of(hostname, len(self.layers))]
@@ -0,0 +1,211 @@
+"""
+交易签名与批量验签
+
+注册交易和DNS交易可以带有钱包签名：
+    'public_key': 公钥（hex）, 'signature': 对签名内容的ECDSA SECP256k1签名（hex）
+签名内容为SIGNED_FIELDS中各字段的规范JSON，公钥对应的地址必须等于交易的node_id。
+跨链复制的交易保留这些字段和签名，因此与原交易有相同的交易ID。
+
+Verifier在进程池中并行验签，验证通过的交易ID进入缓存：交易在进入交易池时
+验证过，之后在区块验证或重新同步时不会再次验签。
+"""
+
+import binascii
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import ecdsa
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 参与签名的交易字段
+SIGNED_FIELDS = ('hostname', 'ip', 'port', 'node_id', 'lease_years', 'records')
+# 为1时拒绝没有签名的域名交易（旧链上的交易没有签名，默认接受）
+REQUIRE_SIGNATURES = os.environ.get('DNS_REQUIRE_SIGNATURES') == '1'
+# 缓存的已验证交易ID个数
+VERIFIED_CACHE_SIZE = 200000
+# 待验签的交易少于该数量时在当前进程中验证，不值得分发到进程池
+PARALLEL_THRESHOLD = 32
+# 每个进程池任务的交易数
+CHUNK_SIZE = 64
+
+VERIFICATIONS = metrics.Counter('dns_signature_verifications_total',
+    '交易验签：valid/invalid为实际验签结果，cached为命中已验证缓存，unsigned为没有签名的交易', ['result'])
+VERIFY_SECONDS = metrics.Histogram('dns_signature_verify_seconds', '一批交易验签的耗时（秒）')
+_VALID, _INVALID, _CACHED, _UNSIGNED = (VERIFICATIONS.labels(r) for r in ('valid', 'invalid', 'cached', 'unsigned'))
+
+
+class SignatureError(ValueError):
+    pass
+
+
+def address_from_public_key(public_key):
+    """
+    由公钥（hex）计算钱包地址，与Wallet的地址算法一致
+    """
+    sha256_hash = hashlib.sha256(binascii.unhexlify(public_key)).digest()
+    ripemd160_hash = hashlib.new('ripemd160')
+    ripemd160_hash.update(sha256_hash)
+    return 'DC' + ripemd160_hash.hexdigest()
+
+
+def signing_message(tx):
+    """
+    :return: 交易的签名内容
+    """
+    payload = {field: tx.get(field) for field in SIGNED_FIELDS if field in tx}
+    return json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def is_signed(tx):
+    return 'signature' in tx and 'public_key' in tx
+
+
+def needs_signature(tx):
+    """
+    :return: 交易是否是需要签名的域名交易
+    """
+    return 'hostname' in tx
+
+
+def tx_id(tx):
+    """
+    :return: 交易ID，签名内容（含node_id）、公钥与签名的哈希；命中已验证缓存时不再检查公钥与地址，
+        所以公钥必须属于交易ID
+    """
+    data = signing_message(tx) + '|' + str(tx.get('public_key', '')) + '|' + str(tx.get('signature', ''))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def sign_transaction(tx, wallet):
+    """
+    用钱包私钥为交易签名，原地添加public_key与signature字段
+
+    :param wallet: blockwallet.Wallet，需要持有私钥
+    :return: tx
+    """
+    tx['public_key'] = wallet.public_key
+    tx['signature'] = wallet.sign_message(signing_message(tx))
+    return tx
+
+
+def _verify_one(message, public_key, signature, node_id):
+    try:
+        if address_from_public_key(public_key) != node_id:
+            return False
+        vk = ecdsa.VerifyingKey.from_string(binascii.unhexlify(public_key), curve=ecdsa.SECP256k1)
+        return vk.verify(binascii.unhexlify(signature), message.encode())
+    except (ecdsa.BadSignatureError, ValueError, TypeError, AssertionError):
+        return False
+
+
+def verify_message(message, public_key, signature, address):
+    """
+    :return: signature是否是address对应的钱包对message的有效签名
+    """
+    return _verify_one(message, public_key, signature, address)
+
+
+def _verify_chunk(items):
+    """
+    在进程池中运行的验签任务，必须是模块级函数以便序列化
+    """
+    return [_verify_one(*item) for item in items]
+
+
+class Verifier(object):
+    def __init__(self, workers=None, cache_size=VERIFIED_CACHE_SIZE):
+        """
+        :param workers: 验签进程数，默认为CPU核数
+        :param cache_size: 缓存的已验证交易ID个数
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_size = cache_size
+        self._verified = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._pool
+
+    def _remember(self, ids):
+        with self._lock:
+            for txid in ids:
+                self._verified[txid] = True
+                self._verified.move_to_end(txid)
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+
+    def is_verified(self, txid):
+        return txid in self._verified
+
+    def verify(self, transactions):
+        """
+        批量验证交易签名，已验证过的交易直接通过
+
+        :param transactions: 交易列表
+        :return: 验证失败的交易列表，全部通过时为空列表
+        """
+        with VERIFY_SECONDS.timer():
+            pending = {}
+            invalid = []
+            for tx in transactions:
+                if not needs_signature(tx):
+                    continue
+                if not is_signed(tx):
+                    _UNSIGNED.inc()
+                    if REQUIRE_SIGNATURES:
+                        invalid.append(tx)
+                    continue
+                txid = tx_id(tx)
+                if txid in self._verified:
+                    _CACHED.inc()
+                elif txid not in pending:
+                    pending[txid] = tx
+            if not pending:
+                return invalid
+
+            ids = list(pending)
+            items = [(signing_message(tx), tx['public_key'], tx['signature'], tx.get('node_id'))
+                     for tx in pending.values()]
+            if len(items) < PARALLEL_THRESHOLD or self.workers <= 1:
+                results = _verify_chunk(items)
+            else:
+                chunks = [items[i:i + CHUNK_SIZE] for i in range(0, len(items), CHUNK_SIZE)]
+                results = [ok for chunk in self._get_pool().map(_verify_chunk, chunks) for ok in chunk]
+
+            valid_ids = [txid for txid, ok in zip(ids, results) if ok]
+            self._remember(valid_ids)
+            _VALID.inc(len(valid_ids))
+            _INVALID.inc(len(ids) - len(valid_ids))
+            invalid += [pending[txid] for txid, ok in zip(ids, results) if not ok]
+            return invalid
+
+    def verify_blocks(self, blocks):
+        """
+        :return: blocks中所有交易的签名是否有效
+        """
+        return not self.verify([tx for block in blocks for tx in block['transactions']])
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+
+# 进程内共享的验签器，已验证缓存在所有链之间共享
+verifier = Verifier()
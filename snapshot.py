@@ -0,0 +1,105 @@
+"""
+链状态快照
+
+快照是 ChainState 的JSON序列化，附带校验和，文件名包含区块高度：
+    <dir>/<name>-<height>.snapshot.json
+写入时先写临时文件再原子替换，只保留最近的 KEEP_SNAPSHOTS 个。
+"""
+
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+KEEP_SNAPSHOTS = 2
+SNAPSHOT_VERSION = 2
+
+
+def _snapshot_files(directory, name):
+    pattern = re.compile(rf'^{re.escape(name)}-(\d+)\.snapshot\.json$')
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return []
+    found = []
+    for entry in entries:
+        m = pattern.match(entry)
+        if m:
+            found.append((int(m.group(1)), os.path.join(directory, entry)))
+    found.sort(reverse=True)
+    return found
+
+
+def write_snapshot(directory, name, state):
+    """
+    写入快照并清理旧快照
+
+    :param directory: 快照目录
+    :param name: 链名
+    :param state: ChainState
+    :return: 快照文件路径
+    """
+    os.makedirs(directory, exist_ok=True)
+    data = {
+        'version': SNAPSHOT_VERSION,
+        'name': name,
+        'state': state.to_dict(),
+        'checksum': state.checksum(),
+    }
+    path = os.path.join(directory, f'{name}-{state.height}.snapshot.json')
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+    for _, old in _snapshot_files(directory, name)[KEEP_SNAPSHOTS:]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+    return path
+
+
+def read_snapshot(path):
+    """
+    读取并校验快照
+
+    :return: ChainState，文件损坏或校验和不匹配时为None
+    """
+    from chainstate import ChainState
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != SNAPSHOT_VERSION:
+            return None
+        state = ChainState.from_dict(data['state'])
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("读取快照 %s 失败: %s", path, e)
+        return None
+    if state.checksum() != data.get('checksum'):
+        logger.warning("快照 %s 校验和不匹配，已忽略", path)
+        return None
+    return state
+
+
+def load_snapshots(directory, name):
+    """
+    按高度从高到低依次产生可用的快照
+    """
+    for _, path in _snapshot_files(directory, name):
+        state = read_snapshot(path)
+        if state is not None:
+            yield state
+
+
+def remove_snapshots(directory, name, min_height=0):
+    """
+    删除高度不低于min_height的快照，例如它们派生自被证明无效的引导快照
+    """
+    for height, path in _snapshot_files(directory, name):
+        if height >= min_height:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
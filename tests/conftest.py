@@ -0,0 +1,113 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# 在子进程中以节点钱包运行一个带合成链的节点
+NODE_SCRIPT = """
+import sys
+from bench import chaingen
+if int(sys.argv[2]):
+    chaingen.generate('data', int(sys.argv[2]))
+import api
+from flask import Flask
+api.dns_resolver = api.open_dns_layers(chaingen.NODE_ID)
+api.wallet_address = chaingen.NODE_ID
+app = Flask(__name__)
+app.register_blueprint(api.api)
+app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)
+"""
+
+# 异步运行时的节点：WSGI线程池只有2个线程，订阅者上限为2
+ASYNC_NODE_SCRIPT = """
+import sys
+from aio_node import AsyncNode
+node = AsyncNode(wsgi_workers=2)
+node.install()
+from bench import chaingen
+chaingen.generate('data', 20)
+import api
+from flask import Flask
+api.dns_resolver = api.open_dns_layers(chaingen.NODE_ID)
+api.wallet_address = chaingen.NODE_ID
+app = Flask(__name__)
+app.register_blueprint(api.api)
+node.run(app, host='127.0.0.1', port=int(sys.argv[1]))
+"""
+
+
+@pytest.fixture
+def node_dir(tmp_path, monkeypatch):
+    """
+    以临时目录为工作目录，dns_layer的 data/ 目录与临时缓冲文件都相对于它
+    """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until(predicate, timeout=20, interval=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def _alive(address):
+    try:
+        return requests.get(f'http://{address}/debug/alive', timeout=1).status_code == 200
+    except requests.RequestException:
+        return False
+
+
+def spawn(args, cwd, address):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    # 独立的进程组，结束节点时连同它的PoW进程池等子进程一起结束
+    process = subprocess.Popen(args, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               start_new_session=True)
+    if not wait_until(lambda: _alive(address), timeout=60):
+        os.killpg(process.pid, signal.SIGKILL)
+        pytest.fail(f'node at {address} did not start')
+    return process
+
+
+@pytest.fixture
+def spawn_node(tmp_path):
+    """
+    启动节点子进程：spawn_node(名称, 交易数) 运行带合成链的节点，
+    spawn_node(名称, args=[...]) 运行 server.py；返回地址 127.0.0.1:port
+    """
+    processes = []
+
+    def start(name, tx_count=0, args=None):
+        directory = tmp_path / name
+        directory.mkdir()
+        port = free_port()
+        address = f'127.0.0.1:{port}'
+        if args is None:
+            command = [sys.executable, '-c', NODE_SCRIPT, str(port), str(tx_count)]
+        else:
+            command = [sys.executable, os.path.join(ROOT, 'server.py'), '-p', str(port)] + args
+        processes.append(spawn(command, directory, address))
+        return address
+
+    yield start
+    for process in processes:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
@@ -0,0 +1,53 @@
+import json
+import os
+import signal
+import socket
+import sys
+
+import requests
+
+from conftest import ASYNC_NODE_SCRIPT, free_port, spawn
+
+
+def _read_response(sock_file):
+    """
+    :return: 元组 (状态码, 小写的响应头字典)，只读取到头部结束
+    """
+    status = int(sock_file.readline().split()[1])
+    headers = {}
+    while True:
+        line = sock_file.readline().decode('latin-1').rstrip('\r\n')
+        if not line:
+            return status, headers
+        name, value = line.split(':', 1)
+        headers[name.strip().lower()] = value.strip()
+
+
+def test_bodiless_responses_have_no_framing(tmp_path):
+    port = free_port()
+    address = f'127.0.0.1:{port}'
+    process = spawn([sys.executable, '-c', ASYNC_NODE_SCRIPT, str(port)], tmp_path, address)
+    try:
+        etag = requests.get(f'http://{address}/nodes/chain', params={'type': 'dns'}, timeout=10).headers['ETag']
+        with socket.create_connection(('127.0.0.1', port), timeout=10) as sock:
+            sock_file = sock.makefile('rb')
+            # 同一连接上依次发送：条件请求（304）、HEAD、普通请求
+            sock.sendall(
+                f'GET /nodes/chain?type=dns HTTP/1.1\r\nHost: {address}\r\nIf-None-Match: {etag}\r\n\r\n'
+                f'HEAD /nodes/tip HTTP/1.1\r\nHost: {address}\r\n\r\n'
+                f'GET /debug/alive HTTP/1.1\r\nHost: {address}\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+
+            status, headers = _read_response(sock_file)
+            assert status == 304
+            assert 'transfer-encoding' not in headers
+            status, headers = _read_response(sock_file)
+            assert status == 200
+            assert 'transfer-encoding' not in headers
+            assert headers['connection'] == 'keep-alive'
+            # 紧接着就是下一个响应的状态行，前两个响应没有多余的消息体或结束块
+            status, headers = _read_response(sock_file)
+            assert status == 200
+            assert json.loads(sock_file.read(int(headers['content-length']))) == 'The node is alive'
+    finally:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
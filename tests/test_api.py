@@ -0,0 +1,79 @@
+import pytest
+from flask import Flask
+
+from bench.chaingen import NODE_ID
+from blockwallet import Wallet
+
+
+@pytest.fixture
+def client(node_dir, monkeypatch):
+    import api
+    monkeypatch.setattr(api, 'shards', None)
+    monkeypatch.setattr(api, 'default_wallet', None)
+    monkeypatch.setattr(api, 'wallet_address', NODE_ID)
+    monkeypatch.setattr(api, 'dns_resolver', api.open_dns_layers(NODE_ID))
+    app = Flask(__name__)
+    app.register_blueprint(api.api)
+    return app.test_client()
+
+
+def _revalidate(client, path, etag):
+    return client.get(path, headers={'If-None-Match': etag})
+
+
+def test_quota_etag_changes_with_chain_and_wallet(client, monkeypatch):
+    import api
+    path = '/debug/get_quota?type=register'
+    etag = client.get(path).headers['ETag']
+    assert _revalidate(client, path, etag).status_code == 304
+
+    # 新区块改变链尾
+    client.get('/debug/force_block?type=register')
+    response = _revalidate(client, path, etag)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    # 链没有变化，但换了钱包：配额属于另一个节点
+    monkeypatch.setattr(api, 'dns_resolver', api.open_dns_layers('other-node'))
+    response = _revalidate(client, path, etag)
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json() == api.dns_resolver.get_chain_quota('register')
+
+
+def test_snapshot_etag_changes_with_signing_wallet(client, monkeypatch):
+    import api
+    path = '/nodes/snapshot'
+    first = client.get(path)
+    assert 'signature' not in first.get_json()
+    assert _revalidate(client, path, first.headers['ETag']).status_code == 304
+
+    # 导入钱包后引导包带签名，旧的ETag不再匹配
+    wallet = Wallet()
+    monkeypatch.setattr(api, 'default_wallet', wallet)
+    response = _revalidate(client, path, first.headers['ETag'])
+    assert response.status_code == 200
+    assert response.get_json()['public_key'] == wallet.public_key
+
+
+def test_batch_lookup_limits_and_streams(client, monkeypatch):
+    import api
+    api.dns_resolver.new_entry('a.test', '10.0.0.1', 80, 'dns')
+    response = client.post('/dns/request', json={'hostnames': ['a.test', 'missing.test', 7]})
+    assert response.status_code == 200
+    assert response.get_json() == {'count': 3, 'results': {
+        'a.test': api.dns_resolver.query('a.test'),
+        'missing.test': {'error': 'not found', 'on_chain': False},
+        '7': {'error': 'invalid hostname', 'on_chain': False}}}
+
+    too_many = ['a.test'] * (api.MAX_BATCH_SIZE + 1)
+    assert client.post('/dns/request', json={'hostnames': too_many}).status_code == 413
+
+    # 大批量流式返回，重复的主机名只出现一次
+    monkeypatch.setattr(api, 'STREAM_BATCH_SIZE', 2)
+    response = client.post('/dns/request', json={'hostnames': ['a.test', 'missing.test', 'a.test'], 'type': 'a'})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['count'] == 2
+    assert body['results']['a.test']['records'] == api.dns_resolver.query('a.test', 'A')['records']
+    assert body['results']['missing.test']['error'] == 'not found'
@@ -0,0 +1,40 @@
+import json
+
+from bench import run
+
+
+def _result(throughput, p50, p99):
+    return {'case': 'lookup', 'size': 100, 'throughput': throughput, 'p50_ms': p50, 'p99_ms': p99}
+
+
+def test_compare_flags_only_regressions_past_threshold():
+    baseline = {'results': [_result(100.0, 1.0, 2.0)]}
+    assert run.compare([_result(95.0, 1.05, 2.1)], baseline, 0.1) == []
+
+    regressions = run.compare([_result(80.0, 1.0, 3.0)], baseline, 0.1)
+    assert {r['metric'] for r in regressions} == {'throughput', 'p99_ms'}
+    # 基线中没有的用例与出错的用例不参与比较
+    assert run.compare([dict(_result(1.0, 9.0, 9.0), size=1000)], baseline, 0.1) == []
+    assert run.compare([dict(_result(1.0, 9.0, 9.0), error='boom')], baseline, 0.1) == []
+
+
+def test_run_reports_json_and_fails_against_a_faster_baseline(tmp_path):
+    output = tmp_path / 'latest.json'
+    args = ['--sizes', '50', '--cases', 'lookup,valid_chain', '--ops-scale', '0.05']
+    assert run.main(args + ['--output', str(output)]) == 0
+    report = json.loads(output.read_text())
+    assert [(r['case'], r['size']) for r in report['results']] == [('lookup', 50), ('valid_chain', 50)]
+    for result in report['results']:
+        assert 'error' not in result
+        assert result['throughput'] > 0 and result['p99_ms'] >= result['p50_ms'] > 0
+        assert result['peak_rss_kb'] > 0
+
+    # 基线快一千倍：每个用例都是回归，退出码非零
+    for result in report['results']:
+        result['throughput'] *= 1000
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps(report))
+    compared = tmp_path / 'compared.json'
+    assert run.main(args + ['--baseline', str(baseline), '--output', str(compared)]) == 1
+    regressions = json.loads(compared.read_text())['regressions']
+    assert {(r['case'], r['metric']) for r in regressions} >= {('lookup', 'throughput'), ('valid_chain', 'throughput')}
@@ -0,0 +1,41 @@
+import threading
+
+from blockchain import Blockchain
+from bench.chaingen import NODE_ID
+
+
+def _run(*targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+        assert not thread.is_alive(), 'deadlock'
+
+
+def test_concurrent_mining_and_replace_keep_a_valid_chain(node_dir):
+    local = Blockchain(NODE_ID, str(node_dir / 'local.json'), 'dns')
+    for _ in range(3):
+        local.mine()
+    remote = Blockchain(NODE_ID, str(node_dir / 'remote.json'), 'dns')
+    remote.replace_chain(list(local.chain))
+    for _ in range(30):
+        remote.mine()
+
+    def miner():
+        for i in range(20):
+            local.new_transaction({'hostname': f'{threading.get_ident()}-{i}.test'})
+            local.mine()
+
+    def syncer():
+        # 与chainsync相同：在链锁内比较长度并替换
+        for _ in range(20):
+            with local.lock:
+                if len(remote.chain) > len(local.chain):
+                    local.replace_chain(list(remote.chain))
+            remote.mine()
+
+    _run(miner, miner, syncer)
+    chain = list(local.chain)
+    assert [block['index'] for block in chain] == list(range(1, len(chain) + 1))
+    assert Blockchain.valid_chain(chain)
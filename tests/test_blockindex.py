@@ -0,0 +1,53 @@
+import types
+
+import blockchain as bc
+import dns
+from bench.chaingen import NODE_ID
+from blockindex import BlockIndex
+
+# 各节点时钟不同，时间戳不随高度单调
+TIMES = [100.0, 200.0, 150.0, 300.0, 120.0, 400.0, 250.0]
+
+
+def _mine(blockchain, times, monkeypatch):
+    for timestamp in times:
+        monkeypatch.setattr(bc, 'time', lambda timestamp=timestamp: timestamp)
+        blockchain.new_transaction({'hostname': f'h{timestamp:g}.test', 'ip': '10.0.0.1', 'port': 80})
+        blockchain.mine()
+
+
+def _transactions(blockchain, index, start, end):
+    layer = types.SimpleNamespace(_explorer_chain=lambda _: (blockchain, index))
+    page = dns.dns_layer.transactions_between(layer, 'dns', start, end, limit=1000)
+    return sorted({item['timestamp'] for item in page['transactions']})
+
+
+def _check(blockchain, index):
+    times = list(index.times)
+    assert list(index.min_times) == [min(times[i:]) for i in range(len(times))]
+    assert list(index.max_times) == [max(times[:i + 1]) for i in range(len(times))]
+    for start in (None, 50, 100, 130, 150, 160, 260, 500):
+        for end in (None, 110, 150, 210, 301, 1000):
+            expected = sorted({block['timestamp'] for block in blockchain.chain if block['transactions']
+                               and (start is None or block['timestamp'] >= start)
+                               and (end is None or block['timestamp'] < end)})
+            assert _transactions(blockchain, index, start, end) == expected, (start, end)
+
+
+def test_time_range_with_non_monotonic_timestamps(node_dir, monkeypatch):
+    monkeypatch.setattr(bc, 'time', lambda: 50.0)
+    blockchain = bc.Blockchain(NODE_ID, str(node_dir / 'domains.json'), 'dns')
+    index = BlockIndex(blockchain)
+    _mine(blockchain, TIMES, monkeypatch)
+    _check(blockchain, index)
+
+    # 重组截掉时间戳最早的区块后，之前高度的后缀最小值恢复
+    branch = list(blockchain.chain)[:4]
+    blockchain.replace_chain(branch)
+    index.truncate(4)
+    assert list(index.times) == [50.0, 100.0, 200.0, 150.0]
+    _mine(blockchain, [500.0, 180.0], monkeypatch)
+    _check(blockchain, index)
+
+    # 从文件重新加载得到相同的索引
+    _check(blockchain, BlockIndex(blockchain))
@@ -0,0 +1,73 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from blockstore import BlockStore
+
+BLOCKS = [{'index': i, 'transactions': [{'hostname': f'h{i}.test'}]} for i in range(1, 51)]
+
+
+def _open(base):
+    store = BlockStore(base, legacy_file=base + '.json')
+    return len(store)
+
+
+def test_concurrent_opens_import_legacy_chain_once(tmp_path):
+    base = str(tmp_path / 'register')
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump(BLOCKS, f)
+
+    with multiprocessing.get_context('fork').Pool(5) as pool:
+        lengths = pool.map(_open, [base] * 5)
+
+    assert lengths == [len(BLOCKS)] * 5
+    assert list(BlockStore(base)) == BLOCKS
+
+
+def test_read_only_open_never_writes(tmp_path):
+    base = str(tmp_path / 'domains')
+    missing = BlockStore(str(tmp_path / 'missing'), legacy_file=base + '.json', read_only=True)
+    assert len(missing) == 0 and os.listdir(tmp_path) == []
+
+    writer = BlockStore(base)
+    writer.extend(BLOCKS[:3])
+    # 写进程正在追加：日志已写入、偏移还没有写入
+    with open(writer.log_path, 'ab') as f:
+        f.write(b'{"index": 4')
+    size = os.path.getsize(writer.log_path)
+
+    reader = BlockStore(base, read_only=True)
+    assert list(reader) == BLOCKS[:3]
+    assert os.path.getsize(writer.log_path) == size
+    with pytest.raises(PermissionError):
+        reader.append(BLOCKS[3])
+
+
+def test_two_writers_on_one_path_append_after_each_other(tmp_path):
+    base = str(tmp_path / 'domains')
+    first = BlockStore(base)
+    second = BlockStore(base)
+    first.append(BLOCKS[0])
+    second.append(BLOCKS[1])
+    first.extend(BLOCKS[2:4])
+    second.truncate(3)
+    first.append(BLOCKS[3])
+    assert list(BlockStore(base)) == BLOCKS[:4]
+    assert list(BlockStore(base, read_only=True)) == BLOCKS[:4]
+
+
+def test_lazy_chain_iteration_overlapping_appends(tmp_path):
+    from blockstore import LazyChain
+    chain = LazyChain(BlockStore(str(tmp_path / 'domains')), resident=4)
+    for block in BLOCKS[:10]:
+        chain.append(block)
+    iterator = chain.iter(5)
+    seen = [next(iterator)]
+    # 遍历途中追加的区块挤出链尾，已开始的遍历仍按取出时的链尾顺序返回
+    for block in BLOCKS[10:20]:
+        chain.append(block)
+    seen += list(iterator)
+    assert seen == BLOCKS[5:10]
+    assert list(chain.iter(5)) == BLOCKS[5:20]
@@ -0,0 +1,56 @@
+import copy
+import types
+
+import pytest
+
+import bootstrap
+from bench import chaingen
+from blockwallet import Wallet
+
+
+@pytest.fixture
+def bundle(node_dir):
+    chaingen.generate('data', 40)
+    trackers = bootstrap._open_trackers('data')
+    wallet = Wallet()
+    return wallet.address, bootstrap.make_bundle(trackers, 'data', wallet)
+
+
+def test_bundle_checksum_and_signer_are_checked(bundle):
+    signer, signed = bundle
+    assert set(bootstrap.verify_bundle(signed, trusted=[signer])) == {'register', 'dns'}
+
+    tampered = copy.deepcopy(signed)
+    tampered['chains']['dns']['state']['records']['forged.test'] = {'ip': '10.6.6.6'}
+    with pytest.raises(bootstrap.BootstrapError, match='checksum'):
+        bootstrap.verify_bundle(tampered, trusted=[])
+
+    # 改写校验和使其与状态一致后摘要不再匹配，签名也无法覆盖
+    tampered['chains']['dns']['checksum'] = bootstrap.ChainState.from_dict(
+        tampered['chains']['dns']['state']).checksum()
+    with pytest.raises(bootstrap.BootstrapError, match='digest'):
+        bootstrap.verify_bundle(tampered, trusted=[])
+
+    with pytest.raises(bootstrap.BootstrapError, match='untrusted'):
+        bootstrap.verify_bundle(signed, trusted=['1SomeOtherAddress'])
+    unsigned = {key: value for key, value in signed.items() if key not in ('signature', 'public_key')}
+    with pytest.raises(bootstrap.BootstrapError, match='unsigned'):
+        bootstrap.verify_bundle(unsigned, trusted=[signer])
+
+
+def test_verifier_waits_while_the_chain_is_shorter_than_the_snapshot(bundle, monkeypatch):
+    _, signed = bundle
+    bootstrap.install_bundle(signed, 'data')
+    marker = bootstrap.read_marker('data')
+    height = marker['chains']['dns']['height']
+    # 链被重新加载、跟踪器不再使用快照，但链还没有同步到快照高度
+    tracker = types.SimpleNamespace(
+        blockchain=types.SimpleNamespace(chain=[None] * (height - 1)), bootstrapping=False, snapshot_dir='data/snapshots',
+        start=lambda: pytest.fail('snapshot must not be discarded'))
+    layer = types.SimpleNamespace(data_dir='data', trackers={'dns': tracker})
+    verifier = bootstrap.HistoryVerifier(layer, marker)
+    monkeypatch.setattr(bootstrap.snapshot, 'remove_snapshots', lambda *args: pytest.fail('snapshot removed'))
+
+    verifier._verify('dns', tracker)
+    assert 'dns' in verifier.marker['chains']
+    assert 'dns' in bootstrap.read_marker('data')['chains']
@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+import dns
+from bench.chaingen import NODE_ID
+from cache import SingleFlight, TTLCache
+
+
+def test_ttl_cache_expires_entries():
+    now = [0.0]
+    cache = TTLCache(10, clock=lambda: now[0])
+    cache.set('a', 1, 5)
+    cache.set('never', 2, 0)
+    assert cache.get('a') == 1
+    assert cache.get('never') is None
+    now[0] = 4.9
+    assert cache.entry('a').remaining(now[0]) == pytest.approx(0.1)
+    now[0] = 5
+    assert cache.get('a', 'gone') == 'gone'
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(2)
+    cache.set('a', 1, 60)
+    cache.set('b', 2, 60)
+    assert cache.get('a') == 1
+    cache.set('c', 3, 60)
+    # 'a' 刚被读过，淘汰的是 'b'
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    # 两次get与这次entry各计一次命中
+    assert cache.entry('a').hits == 3
+    assert cache.pop('a') == 1 and cache.get('a') is None
+
+
+def test_single_flight_coalesces_and_propagates_errors():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+    results = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        raise RuntimeError('backend down')
+
+    def follower():
+        try:
+            flights.do('key', slow)
+        except RuntimeError as e:
+            results.append(('error', str(e)))
+
+    leader = threading.Thread(target=follower)
+    leader.start()
+    while not flights.in_flight('key'):
+        time.sleep(0.001)
+    followers = [threading.Thread(target=follower) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+    # 只执行一次，等待中的调用者收到同一个异常
+    assert calls == [1]
+    assert results == [('error', 'backend down')] * 4
+    assert not flights.in_flight('key')
+    # 出错之后的新调用重新执行
+    assert flights.do('key', lambda: 7) == (7, False)
+
+
+def test_lookup_cache_is_invalidated_by_new_blocks(node_dir):
+    layer = dns.dns_layer(NODE_ID)
+    layer.new_entry('hot.test', '10.0.0.1', 80, 'dns')
+    hits = dns._CACHE_HIT.value
+    assert layer.lookup('hot.test')[2] is False
+    assert layer.lookup('hot.test')[2] is False
+    assert dns._CACHE_HIT.value == hits + 1
+
+    # 出块后缓存失效，查询到上链的结果
+    layer.flush_tmp_domains()
+    assert layer.lookup('hot.test')[2] is True
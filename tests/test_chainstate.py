@@ -0,0 +1,87 @@
+import pytest
+
+from blockchain import Blockchain
+from chainstate import ChainState
+from bench.chaingen import NODE_ID
+
+
+def _block(index, transactions):
+    return {'index': index, 'source': NODE_ID, 'timestamp': 1000.0 + index, 'transactions': transactions,
+            'proof': 0, 'previous_hash': '0'}
+
+
+def test_block_with_malformed_records_leaves_state_unchanged():
+    state = ChainState()
+    state.apply_block(_block(1, [{'hostname': 'good.test', 'ip': '10.0.0.1', 'port': 80}]), 'a' * 64)
+    before = state.checksum()
+
+    bad = _block(2, [
+        {'hostname': 'first.test', 'ip': '10.0.0.2', 'port': 80, 'wallet': NODE_ID, 'reward': 1},
+        {'hostname': 'second.test', 'ip': '10.0.0.3', 'port': 80, 'records': [{'value': 'no type'}]},
+    ])
+    with pytest.raises(ValueError):
+        state.apply_block(bad, 'b' * 64)
+    assert state.checksum() == before
+    assert 'first.test' not in state.records
+    assert len(state.undo) == 1
+
+
+def test_valid_chain_rejects_unparseable_records(node_dir):
+    blockchain = Blockchain(NODE_ID, str(node_dir / 'chain.json'), 'dns')
+    blockchain.new_transaction({'hostname': 'ok.test', 'ip': '10.0.0.1', 'port': 80,
+                                'records': [{'type': 'A', 'value': '10.0.0.1', 'ttl': 300}]})
+    blockchain.mine()
+    assert Blockchain.valid_chain(list(blockchain.chain))
+
+    for tx in ({'hostname': 'bad.test', 'records': [{'type': 'A', 'value': 'not an address'}]},
+               {'hostname': 'bad.test', 'records': 'A 10.0.0.1'},
+               {'hostname': 7, 'ip': '10.0.0.1'},
+               {'hostname': 'bad.test', 'lease_years': '1'}):
+        forged = Blockchain(NODE_ID, str(node_dir / f'forged-{len(tx)}-{id(tx)}.json'), 'dns')
+        forged.replace_chain(list(blockchain.chain))
+        forged.new_transaction(tx)
+        forged.mine()
+        assert not Blockchain.valid_chain(list(forged.chain))
+
+
+def _mine(blockchain, transactions):
+    for tx in transactions:
+        blockchain.new_transaction(tx)
+    return blockchain.mine()
+
+
+def test_reorg_undo_and_reapply_matches_full_replay(node_dir):
+    from chainstate import ChainTracker
+
+    local = Blockchain(NODE_ID, str(node_dir / 'local.json'), 'dns')
+    tracker = ChainTracker(local, 'dns', str(node_dir / 'snapshots'))
+    tracker.start()
+    for i in range(5):
+        _mine(local, [{'hostname': f'shared{i}.test', 'ip': '10.0.0.1', 'port': 80, 'node_id': NODE_ID},
+                      {'node': NODE_ID, 'reward': 2, 'wallet': NODE_ID}])
+
+    remote = Blockchain('other', str(node_dir / 'remote.json'), 'dns')
+    remote.replace_chain(list(local.chain)[:3])
+    # 本链在分叉点之后注册的主机名与转账在新分支上不存在或不同
+    for i in range(3):
+        _mine(local, [{'hostname': f'local{i}.test', 'ip': '10.0.0.2', 'port': 80},
+                      {'type': 'token_transfer', 'from': NODE_ID, 'to': 'alice', 'amount': 1}])
+    for i in range(6):
+        _mine(remote, [{'hostname': f'remote{i}.test', 'ip': '10.0.0.3', 'port': 80},
+                       {'hostname': 'shared4.test', 'ip': '10.9.9.9', 'port': 80},
+                       {'type': 'token_payment', 'from': 'alice', 'amount': 1}])
+
+    # 重组只撤销分叉点之后的区块，不从快照重新加载
+    tracker._start = lambda: pytest.fail('reorg fell back to a full reload')
+    # 索引文件只删除、替换受影响的主机名，不整体重建
+    tracker._index_writer.rebuild = lambda *args: pytest.fail('reorg rebuilt the whole index')
+    local.replace_chain(list(remote.chain))
+    replayed = ChainState()
+    for block in local.chain:
+        replayed.apply_block(block, local.hash(block))
+    assert tracker.state.checksum() == replayed.checksum()
+    assert tracker.state.height == len(local.chain)
+    assert 'local0.test' not in tracker.state.records
+    assert tracker.state.records['shared4.test']['ip'] == '10.9.9.9'
+    assert dict(tracker.index.items()) == replayed.records
+    assert tracker.index.tip == (replayed.height, replayed.tip_hash)
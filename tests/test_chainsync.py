@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import blockchain as bc
+import chainsync
+from merkle import merkle_root
+
+
+def _legacy_block(last, transactions, previous_hash=None):
+    # 不带交易根的旧区块，哈希覆盖整个区块
+    return {
+        'index': last['index'] + 1,
+        'source': 'peer',
+        'timestamp': last['timestamp'] + 60,
+        'transactions': transactions,
+        'proof': bc._search_proof(last['proof']),
+        'previous_hash': previous_hash or bc.Blockchain.hash(last),
+    }
+
+
+def _header(block):
+    return dict(chainsync.block_header(block, bc.Blockchain.hash(block)), tx_root=merkle_root(block['transactions']))
+
+
+def _serve(monkeypatch, headers, bodies):
+    def fake_get(self, node, path, **params):
+        if path == '/nodes/headers':
+            return {'length': len(headers), 'headers': headers[params['start'] - 1:]}
+        return {'length': len(headers), 'blocks': bodies[params['start'] - 2:params['end'] - 2]}
+    monkeypatch.setattr(chainsync.HeaderSync, '_get', fake_get)
+
+
+def _remote(genesis):
+    b2 = _legacy_block(genesis, [{'hostname': 'a.test', 'ip': '10.0.0.1', 'port': 80}])
+    b3 = _legacy_block(b2, [{'hostname': 'b.test', 'ip': '10.0.0.2', 'port': 80}])
+    return b2, b3
+
+
+def test_header_sync_accepts_matching_bodies(node_dir, monkeypatch):
+    blockchain = bc.Blockchain('', os.path.join('data', 'domains.json'), 'dns')
+    genesis = blockchain.chain[0]
+    b2, b3 = _remote(genesis)
+    _serve(monkeypatch, [_header(genesis), _header(b2), _header(b3)], [b2, b3])
+
+    assert chainsync.HeaderSync(blockchain)._sync_from('peer:1', 3)
+    assert list(blockchain.chain) == [genesis, b2, b3]
+
+
+def test_header_sync_rejects_forged_body(node_dir, monkeypatch):
+    blockchain = bc.Blockchain('', os.path.join('data', 'domains.json'), 'dns')
+    genesis = blockchain.chain[0]
+    b2, b3 = _remote(genesis)
+    # 区块头声明的链接正确，区块体的哈希也与区块头一致，但区块本身没有链接到上一个区块
+    forged = _legacy_block(b2, b3['transactions'], previous_hash='0' * 64)
+    header = dict(_header(b3), hash=bc.Blockchain.hash(forged))
+    _serve(monkeypatch, [_header(genesis), _header(b2), header], [b2, forged])
+
+    with pytest.raises(chainsync.SyncError):
+        chainsync.HeaderSync(blockchain)._sync_from('peer:1', 3)
+    assert list(blockchain.chain) == [genesis]
+
+
+def test_header_sync_validates_in_process_pool(node_dir, monkeypatch):
+    submitted = []
+
+    class RecordingPool(ProcessPoolExecutor):
+        def submit(self, fn, *args):
+            submitted.append(fn)
+            return super().submit(fn, *args)
+
+    blockchain = bc.Blockchain('', os.path.join('data', 'domains.json'), 'dns')
+    genesis = blockchain.chain[0]
+    b2, b3 = _remote(genesis)
+    _serve(monkeypatch, [_header(genesis), _header(b2), _header(b3)], [b2, b3])
+
+    with RecordingPool(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        monkeypatch.setattr(bc, 'pow_executor', pool)
+        assert chainsync.HeaderSync(blockchain)._sync_from('peer:1', 3)
+    assert submitted == [bc.Blockchain.valid_chain]
+    assert list(blockchain.chain) == [genesis, b2, b3]
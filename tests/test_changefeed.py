@@ -0,0 +1,43 @@
+import os
+import signal
+import sys
+import threading
+import time
+
+import requests
+
+from conftest import ASYNC_NODE_SCRIPT, free_port, spawn
+
+
+def test_subscribers_are_capped_and_do_not_hold_request_threads(tmp_path, monkeypatch):
+    monkeypatch.setenv('DNS_FEED_SUBSCRIBERS', '2')
+    port = free_port()
+    address = f'127.0.0.1:{port}'
+    process = spawn([sys.executable, '-c', ASYNC_NODE_SCRIPT, str(port)], tmp_path, address)
+    try:
+        stream = requests.get(f'http://{address}/events/stream', stream=True, timeout=10)
+        assert stream.status_code == 200
+        polls = []
+        poller = threading.Thread(target=lambda: polls.append(
+            requests.get(f'http://{address}/events', params={'wait': 5}, timeout=20)))
+        poller.start()
+        time.sleep(1)
+
+        # 两个订阅者占满名额，新订阅被拒绝
+        rejected = requests.get(f'http://{address}/events', params={'wait': 5}, timeout=5)
+        assert rejected.status_code == 503
+        assert rejected.headers['Retry-After']
+        # 订阅者不占用处理普通请求的两个线程
+        start = time.monotonic()
+        for _ in range(4):
+            assert requests.get(f'http://{address}/nodes/tip', timeout=3).status_code == 200
+        assert time.monotonic() - start < 3
+
+        # 长轮询结束后名额释放
+        poller.join()
+        assert polls[0].status_code == 200
+        assert requests.get(f'http://{address}/events', params={'wait': 0}, timeout=5).status_code == 200
+        stream.close()
+    finally:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
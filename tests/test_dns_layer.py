@@ -0,0 +1,131 @@
+import threading
+
+import pytest
+
+import dns
+from bench.chaingen import NODE_ID
+from conftest import wait_until
+
+
+def _on_chain(layer, hostname):
+    try:
+        return layer.lookup(hostname)[2]
+    except LookupError:
+        return False
+
+
+def test_reset_dns_chain_rebuilds_state_and_replays_registrations(node_dir):
+    layer = dns.dns_layer(NODE_ID)
+    layer.new_entry('plain.test', '10.0.0.1', 80, 'dns')
+    layer.flush_tmp_domains()
+    layer.new_entry('registered.test', '10.0.0.2', 80, 'register')
+    layer.flush_tmp_register()
+    assert wait_until(lambda: _on_chain(layer, 'registered.test'))
+
+    layer.reset_dns_chain()
+    with pytest.raises(LookupError):
+        layer.lookup('plain.test')
+    # 注册链上的域名重新复制到清空后的DNS链
+    assert wait_until(lambda: _on_chain(layer, 'registered.test'))
+    tracker = layer.trackers['dns']
+    assert tracker.state.height == len(layer.dns_blockchain.chain)
+    assert tracker.index.get('plain.test') is None
+
+
+def test_flush_timer_new_entry_and_replication_do_not_interleave(node_dir):
+    layer = dns.dns_layer(NODE_ID)
+
+    def writer(kind, prefix):
+        for i in range(25):
+            layer.new_entry(f'{prefix}{i}.test', '10.0.0.1', 80, kind)
+
+    def flusher():
+        for _ in range(25):
+            layer.flush_tmp_domains()
+            layer.flush_tmp_register()
+            layer.replicator.run_once()
+
+    threads = [threading.Thread(target=target) for target in
+               (lambda: writer('dns', 'd'), lambda: writer('register', 'r'), flusher)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=120)
+        assert not thread.is_alive(), 'deadlock'
+    layer.flush_tmp_domains()
+    layer.flush_tmp_register()
+    assert wait_until(lambda: all(_on_chain(layer, f'r{i}.test') for i in range(25)))
+
+    chain = list(layer.dns_blockchain.chain)
+    assert dns.bc.Blockchain.valid_chain(chain)
+    hostnames = [tx['hostname'] for block in chain for tx in block['transactions'] if 'hostname' in tx]
+    # 缓冲中的条目恰好上链一次
+    assert sorted(h for h in hostnames if h.startswith('d')) == sorted(f'd{i}.test' for i in range(25))
+    assert all(_on_chain(layer, f'd{i}.test') for i in range(25))
+
+
+def test_broadcast_runs_outside_the_chain_lock(node_dir, monkeypatch):
+    layer = dns.dns_layer(NODE_ID)
+    held = []
+
+    def broadcast(blockchain_type='both'):
+        # 另一个线程此时能取得链锁，说明广播时没有持有它
+        probe = threading.Thread(target=lambda: held.append(not layer.dns_blockchain.lock.acquire(timeout=1)) or
+                                 layer.dns_blockchain.lock.release())
+        probe.start()
+        probe.join()
+
+    monkeypatch.setattr(layer, 'broadcast_new_block', broadcast)
+    layer.new_entry('replicated.test', '10.0.0.1', 80, 'register')
+    layer.flush_tmp_register()
+    # 后台复制线程出块后同样在链锁外广播
+    assert wait_until(lambda: _on_chain(layer, 'replicated.test'))
+    layer.new_entry('plain.test', '10.0.0.2', 80, 'dns')
+    layer.flush_tmp_domains()
+    assert held == [False, False, False]
+    assert _on_chain(layer, 'plain.test')
+
+
+def test_stop_ends_background_threads(node_dir):
+    layer = dns.dns_layer(NODE_ID)
+    threads = [layer._dns_timer, layer._register_timer, layer.replicator._thread]
+    layer.stop()
+    for thread in threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+    # 不再响应链事件
+    assert layer.replicator._on_source_event not in layer.register_blockchain.listeners
+    assert layer.replicator._on_target_event not in layer.dns_blockchain.listeners
+
+
+def test_query_many_resolves_the_batch_in_one_pass(node_dir, monkeypatch):
+    layer = dns.dns_layer(NODE_ID)
+    layer.new_entry('a.test', None, 80, 'dns', records=[{'type': 'A', 'value': '10.0.0.1'},
+                                                        {'type': 'TXT', 'value': 'hello'}])
+    layer.new_entry('alias.test', None, 80, 'dns', records=[{'type': 'CNAME', 'value': 'a.test'}])
+    layer.flush_tmp_domains()
+    layer.new_entry('pending.test', '10.0.0.2', 80, 'dns')
+    hostnames = ['alias.test', 'a.test', 'pending.test', 'missing.test', '', 5, 'a.test']
+    expected = []
+    for hostname in hostnames:
+        try:
+            expected.append((hostname, layer.query(hostname, 'TXT'), None))
+        except (LookupError, AttributeError, TypeError):
+            expected.append((hostname, None, 'invalid hostname' if hostname in ('', 5) else 'not found'))
+
+    # 缓存清空后整批只查一次索引、不再逐个主机名读取tmp_domains.json
+    layer.invalidate_lookup_cache()
+    batches = []
+    get_many = layer.dns_index.get_many
+    monkeypatch.setattr(layer.dns_index, 'get_many', lambda names: batches.append(list(names)) or get_many(names))
+    monkeypatch.setattr(layer, '_find_any', lambda hostname: pytest.fail(f'{hostname} looked up on its own'))
+    assert list(layer.query_many(hostnames, 'TXT')) == expected
+    assert batches == [['alias.test', 'a.test', 'pending.test', 'missing.test']]
+
+    alias = expected[0][1]
+    assert [(r['name'], r['type'], r['rdata']) for r in alias['records']] == \
+        [('alias.test', 'CNAME', 'a.test'), ('a.test', 'TXT', 'hello')]
+    assert alias['on_chain'] and not expected[2][1]['on_chain']
+    # 结果已写入缓存，再查不访问索引
+    assert list(layer.query_many(hostnames, 'TXT')) == expected
+    assert len(batches) == 1
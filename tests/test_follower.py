@@ -0,0 +1,32 @@
+import requests
+
+from conftest import wait_until
+
+
+def _tip(address, chain='both'):
+    return requests.get(f'http://{address}/nodes/tip', params={'type': chain}, timeout=5).json()
+
+
+def _on_chain(address, hostname):
+    response = requests.post(f'http://{address}/dns/request', json={'hostname': hostname}, timeout=5)
+    return response.status_code == 200 and response.json()['on_chain']
+
+
+def test_follower_mirrors_upstream_and_rejects_writes(spawn_node):
+    upstream = spawn_node('upstream', 200)
+    follower = spawn_node('follower', args=['--follow', upstream])
+
+    assert wait_until(lambda: _tip(follower) == _tip(upstream))
+    # 链尾先于链监听者更新的索引可见，等到查询也追上
+    assert wait_until(lambda: _on_chain(follower, 'dns-100.bench'))
+    assert requests.get(f'http://{follower}/explorer/blocks', params={'type': 'dns'}, timeout=5).status_code == 200
+
+    # 没有钱包、不出块，写请求交给上游
+    assert requests.get(f'http://{follower}/debug/force_block', timeout=5).status_code == 403
+    response = requests.post(f'http://{follower}/dns/register', json={'hostname': 'x.com', 'ip': '1.1.1.1'}, timeout=5)
+    assert response.status_code == 403
+    assert response.json()['upstreams'] == [upstream]
+
+    # 上游的新区块经事件流推送到跟随节点
+    requests.get(f'http://{upstream}/debug/force_block', params={'type': 'dns'}, timeout=30)
+    assert wait_until(lambda: _tip(follower, 'dns') == _tip(upstream, 'dns'), timeout=10)
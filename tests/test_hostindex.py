@@ -0,0 +1,146 @@
+import os
+import random
+import threading
+import time
+
+import hostindex
+from hostindex import HEADER, SLOT_KEY, HostIndex, IndexWriter
+
+
+def _record(i):
+    return {'ip': f'10.0.0.{i % 250}', 'block_index': i}
+
+
+def _wait_compacted(writer):
+    # 后台重建结束后 _journal 复位为None
+    for _ in range(1000):
+        with writer._lock:
+            if writer._journal is None:
+                return
+        time.sleep(0.01)
+    raise AssertionError('compaction did not finish')
+
+
+def test_incremental_updates_match_full_rebuild(tmp_path):
+    path = str(tmp_path / 'domains.idx')
+    records = {}
+    writer = IndexWriter(path, lambda: (dict(records), len(records), f'{len(records):064x}'))
+    writer.rebuild(records, 0, None)
+    reader = HostIndex(path)
+    first_inode = os.stat(path).st_ino
+
+    for i in range(1, 4):
+        new = {f'host{i}.bench': _record(i)}
+        records.update(new)
+        writer.add(new, i, f'{i:064x}')
+        # 原地更新：读者立即看到新主机名与链尾，文件没有被替换
+        assert reader.get(f'host{i}.bench') == _record(i)
+        assert reader.tip == (i, f'{i:064x}')
+        assert len(reader) == i
+    assert os.stat(path).st_ino == first_inode
+
+    # 没有新主机名的区块只更新链尾
+    writer.add({}, 4, f'{4:064x}')
+    assert reader.tip == (4, f'{4:064x}')
+
+    # 装载率超过GROW_LOAD后后台重建，内容与整体重建一致
+    for i in range(5, 200):
+        new = {f'host{i}.bench': _record(i)}
+        records.update(new)
+        writer.add(new, i, f'{i:064x}')
+    _wait_compacted(writer)
+    assert os.stat(path).st_ino != first_inode
+    assert dict(reader.items()) == records
+    assert reader.tip == (199, f'{199:064x}')
+
+    expected = str(tmp_path / 'expected.idx')
+    HostIndex.write(expected, records, 199, f'{199:064x}')
+    assert dict(HostIndex(expected).items()) == dict(reader.items())
+
+
+def test_existing_hostname_is_kept(tmp_path):
+    path = str(tmp_path / 'domains.idx')
+    HostIndex.write(path, {'a.bench': _record(1)}, 1, None)
+    HostIndex.insert(path, {'a.bench': _record(2)}, 2, None)
+    index = HostIndex(path)
+    assert index.get('a.bench') == _record(1)
+    assert len(index) == 1
+
+
+def test_missing_file_needs_rebuild(tmp_path):
+    assert HostIndex.insert(str(tmp_path / 'missing.idx'), {'a.bench': _record(1)}, 1, None) is None
+
+
+def test_readers_in_threads_survive_remaps(tmp_path):
+    path = str(tmp_path / 'domains.idx')
+    records = {}
+    writer = IndexWriter(path, lambda: (dict(records), len(records), f'{len(records):064x}'))
+    writer.rebuild(records, 0, None)
+    reader = HostIndex(path)
+    errors = []
+    done = threading.Event()
+
+    def read():
+        try:
+            while not done.is_set():
+                reader.get('host1.bench')
+                reader.tip
+                len(reader)
+        except Exception as e:
+            errors.append(e)
+
+    # 多个线程共用一个读者，写入者期间原地追加并多次后台重建（替换文件）
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(1, 400):
+        new = {f'host{i}.bench': _record(i)}
+        records.update(new)
+        writer.add(new, i, f'{i:064x}')
+    _wait_compacted(writer)
+    done.set()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert reader.get('host399.bench') == _record(399)
+
+
+def test_header_stuck_mid_update_needs_rebuild(tmp_path, monkeypatch):
+    monkeypatch.setattr(hostindex, 'HEADER_RETRIES', 5)
+    path = str(tmp_path / 'domains.idx')
+    HostIndex.write(path, {'a.bench': _record(1)}, 1, f'{1:064x}')
+    # 写入者在更新头部时退出，序号停在奇数
+    with open(path, 'r+b') as f:
+        f.seek(HEADER.size - SLOT_KEY.size)
+        f.write(SLOT_KEY.pack(1))
+    index = HostIndex(path)
+    assert index.tip == (0, None)
+    assert len(index) == 0
+    assert HostIndex.insert(path, {'b.bench': _record(2)}, 2, None) is None
+
+
+def test_patch_removes_and_replaces_in_place(tmp_path):
+    path = str(tmp_path / 'domains.idx')
+    records = {f'host{i}.bench': _record(i) for i in range(60)}
+    HostIndex.write(path, records, 60, None)
+    reader = HostIndex(path)
+    inode = os.stat(path).st_ino
+
+    # 删除会前移同一探测链上的槽位，其余主机名仍然可以找到
+    rng = random.Random(7)
+    removed = rng.sample(sorted(records), 25)
+    changed = {name: _record(1000) for name in rng.sample(sorted(set(records) - set(removed)), 5)}
+    changed['new.bench'] = _record(2000)
+    for name in removed:
+        del records[name]
+    records.update(changed)
+    assert HostIndex.patch(path, changed, removed, 61, f'{61:064x}') is not None
+
+    assert os.stat(path).st_ino == inode
+    assert dict(reader.items()) == records
+    for name in removed:
+        assert reader.get(name) is None
+    for name, record in records.items():
+        assert reader.get(name) == record
+    assert len(reader) == len(records)
+    assert reader.tip == (61, f'{61:064x}')
@@ -0,0 +1,75 @@
+import copy
+
+import pytest
+
+from bench import chaingen
+from lightclient import ProofError, verify_hostname_proof
+from merkle import merkle_proof, merkle_root, tx_hash, verify_merkle_proof
+
+
+def test_merkle_proof_for_every_position():
+    for count in (1, 2, 3, 7, 10):
+        transactions = [{'hostname': f'h{i}.test', 'ip': f'10.0.0.{i}'} for i in range(count)]
+        root = merkle_root(transactions)
+        for i, tx in enumerate(transactions):
+            proof = merkle_proof(transactions, i)
+            assert verify_merkle_proof(tx_hash(tx), i, proof, root)
+            assert not verify_merkle_proof(tx_hash({'hostname': 'forged'}), i, proof, root)
+
+
+@pytest.fixture
+def layer(node_dir):
+    chaingen.generate('data', 200)
+    import dns
+    return dns.dns_layer(node_identifier=chaingen.NODE_ID)
+
+
+def _checkpoint(layer, height=None):
+    chain = layer.dns_blockchain.chain
+    height = height or len(chain)
+    return height, layer.dns_blockchain.hash(chain[height - 1])
+
+
+def test_hostname_proof_verifies_against_checkpoint(layer):
+    height, tip = _checkpoint(layer)
+    proof = layer.hostname_proof('dns-42.bench')
+    record = verify_hostname_proof(proof, 'dns-42.bench', height, tip)
+    assert record['ip'] == layer.query('dns-42.bench')['ip']
+    # 包含证明只有O(log n)个兄弟节点
+    assert len(proof['proof']) <= 4
+
+    # 检查点低于记录所在区块时区块头向前链接
+    low = proof['block_index'] - 3
+    proof = layer.hostname_proof('dns-42.bench', checkpoint=low)
+    verify_hostname_proof(proof, 'dns-42.bench', *_checkpoint(layer, low))
+
+
+def test_tampered_proofs_are_rejected(layer):
+    height, tip = _checkpoint(layer)
+    proof = layer.hostname_proof('dns-42.bench')
+
+    forged = copy.deepcopy(proof)
+    forged['record']['ip'] = '6.6.6.6'
+    with pytest.raises(ProofError):
+        verify_hostname_proof(forged, 'dns-42.bench', height, tip)
+
+    forged = copy.deepcopy(proof)
+    forged['headers'][0]['tx_root'] = merkle_root([forged['record']])
+    with pytest.raises(ProofError):
+        verify_hostname_proof(forged, 'dns-42.bench', height, tip)
+
+    with pytest.raises(ProofError):
+        verify_hostname_proof(proof, 'dns-42.bench', height, '0' * 64)
+    with pytest.raises(ProofError):
+        verify_hostname_proof(proof, 'dns-43.bench', height, tip)
+
+
+def test_light_client_over_http(spawn_node):
+    import requests
+    from lightclient import LightClient
+    node = spawn_node('node', 100)
+    tip = requests.get(f'http://{node}/nodes/tip', params={'type': 'dns'}, timeout=5).json()
+    client = LightClient(node, tip['length'], tip['tip'])
+    assert client.lookup('dns-7.bench')['A']['rdata']
+    with pytest.raises(LookupError):
+        client.lookup('missing.bench')
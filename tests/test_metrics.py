@@ -0,0 +1,56 @@
+import pytest
+
+import dns
+import metrics
+from bench.chaingen import NODE_ID
+
+
+def test_registry_renders_prometheus_text():
+    registry = metrics.Registry()
+    requests = metrics.Counter('requests_total', 'Requests', ['path'], registry=registry)
+    depth = metrics.Gauge('queue_depth', 'Depth', registry=registry)
+    latency = metrics.Histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0), registry=registry)
+
+    requests.labels('/a"b').inc()
+    requests.labels(path='/a"b').inc(2)
+    queue = [1, 2, 3]
+    depth.labels().set_function(lambda: len(queue))
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total{path="/a\\"b"} 3' in lines
+    assert 'queue_depth 3' in lines
+    # 直方图的分桶是累计的
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'latency_seconds_count 3' in lines
+    assert 'latency_seconds_sum 5.55' in lines
+
+
+def test_registry_rejects_duplicates_and_wrong_labels():
+    registry = metrics.Registry()
+    counter = metrics.Counter('dup_total', 'Dup', ['a'], registry=registry)
+    with pytest.raises(ValueError):
+        metrics.Counter('dup_total', 'Dup', registry=registry)
+    with pytest.raises(ValueError):
+        counter.labels('x', 'y')
+    # 取值失败的仪表不导出
+    gauge = metrics.Gauge('broken', 'Broken', registry=registry)
+    gauge.labels().set_function(lambda: 1 / 0)
+    assert not [line for line in registry.render().splitlines() if line.startswith('broken')]
+
+
+def test_lookups_are_counted_by_source(node_dir):
+    layer = dns.dns_layer(NODE_ID)
+    layer.new_entry('buffered.test', '10.0.0.1', 80, 'dns')
+    hits = dns.LOOKUPS.labels('tmp').value
+    misses = dns.LOOKUPS.labels('miss').value
+    layer.lookup('buffered.test')
+    with pytest.raises(LookupError):
+        layer.lookup('absent.test')
+    assert dns.LOOKUPS.labels('tmp').value == hits + 1
+    assert dns.LOOKUPS.labels('miss').value == misses + 1
+    assert 'dns_lookups_total{source="tmp"}' in metrics.render()
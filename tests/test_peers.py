@@ -0,0 +1,111 @@
+import peers
+from peers import BASE_BACKOFF, CLOSED, FAILURE_THRESHOLD, HALF_OPEN, MAX_BACKOFF, OPEN, TIP_MAX_AGE, PeerTable
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _table(*addresses):
+    clock = Clock()
+    table = PeerTable('test', clock)
+    for address in addresses:
+        table.add(address)
+    return table, clock
+
+
+def test_failures_open_the_breaker_and_trials_back_off(monkeypatch):
+    # 去掉抖动，退避时间即为backoff
+    monkeypatch.setattr(peers.random, 'uniform', lambda a, b: 1.0)
+    table, clock = _table('fast:5000', 'flaky:5000')
+    table.record_success('fast:5000', 0.1)
+    for _ in range(FAILURE_THRESHOLD - 1):
+        table.record_failure('flaky:5000')
+    flaky = table.get('flaky:5000')
+    # 未达到阈值仍可请求，但分数已低于稳定的邻居
+    assert flaky.state == CLOSED
+    assert table.get('fast:5000').score() > flaky.score()
+    assert [peer['address'] for peer in table.snapshot()] == ['fast:5000', 'flaky:5000']
+
+    table.record_failure('flaky:5000')
+    assert flaky.state == OPEN and flaky.open_until == clock.now + BASE_BACKOFF
+    assert table.count(OPEN) == 1
+    assert [peer.address for peer in table.available()] == ['fast:5000']
+    assert table.gossip_targets() == ['fast:5000']
+
+    # 退避结束后只放出一次试探请求
+    clock.now += BASE_BACKOFF
+    assert {peer.address for peer in table.available()} == {'fast:5000', 'flaky:5000'}
+    assert flaky.state == HALF_OPEN
+    assert sorted(table.gossip_targets()) == ['fast:5000', 'flaky:5000']
+    assert table.gossip_targets() == ['fast:5000']
+
+    # 试探失败加倍退避，直到MAX_BACKOFF
+    backoff = BASE_BACKOFF
+    while backoff < MAX_BACKOFF:
+        table.record_failure('flaky:5000')
+        backoff = min(backoff * 2, MAX_BACKOFF)
+        assert flaky.state == OPEN and flaky.backoff == backoff
+        assert flaky.open_until == clock.now + backoff
+        clock.now += backoff
+        assert table.gossip_targets(fanout=2).count('flaky:5000') == 1
+    table.record_failure('flaky:5000')
+    assert flaky.backoff == MAX_BACKOFF
+
+    # 试探成功后恢复，退避复位
+    clock.now += MAX_BACKOFF
+    table.gossip_targets()
+    table.record_success('flaky:5000', 0.2)
+    assert flaky.state == CLOSED and flaky.failures == 0 and flaky.backoff == BASE_BACKOFF
+    assert flaky.last_seen == clock.now
+
+
+def test_sync_candidates_prefer_higher_tips_then_scores():
+    table, clock = _table('a:1', 'b:1', 'c:1', 'd:1', 'e:1', 'unknown:1')
+    for address, height in (('a', 5), ('b', 12), ('c', 12), ('d', 11), ('e', 30)):
+        table.observe_tip(f'{address}:1', height, f'{height:064x}')
+    table.record_success('b:1', 0.5)
+    table.record_success('c:1', 0.05)
+    for _ in range(FAILURE_THRESHOLD):
+        table.record_failure('e:1')
+
+    # 熔断中的e与链尾未知、不高于本地的邻居都不参与同步
+    assert table.sync_candidates(10) == ['c:1', 'b:1', 'd:1']
+    assert table.sync_candidates(10, limit=2) == ['c:1', 'b:1']
+    assert table.sync_candidates(12) == []
+
+
+def test_gossip_targets_are_a_random_subset():
+    addresses = [f'10.0.0.{i}:5000' for i in range(20)]
+    table, _ = _table(*addresses)
+    seen = set()
+    for _ in range(20):
+        targets = table.gossip_targets(fanout=8)
+        assert len(targets) == len(set(targets)) == 8
+        assert set(targets) <= set(addresses)
+        seen.update(targets)
+    assert len(seen) > 8
+    assert sorted(table.gossip_targets(fanout=50)) == sorted(addresses)
+
+
+def test_observed_tips_go_stale_and_expire_by_host():
+    table, clock = _table('10.0.0.1:5000', '10.0.0.1:5001', '10.0.0.2:5000')
+    assert sorted(table.stale_tips()) == ['10.0.0.1:5000', '10.0.0.1:5001', '10.0.0.2:5000']
+    for address in table:
+        table.observe_tip(address, 3, f'{3:064x}')
+    assert table.get('10.0.0.2:5000').tip_height == 3
+    assert table.stale_tips() == []
+
+    # 收到某主机的新区块广播后，该主机上的所有邻居需要重新探测
+    table.expire_tips('10.0.0.1')
+    assert sorted(table.stale_tips()) == ['10.0.0.1:5000', '10.0.0.1:5001']
+    assert table.stale_tips(limit=1) in (['10.0.0.1:5000'], ['10.0.0.1:5001'])
+
+    clock.now += TIP_MAX_AGE + 1
+    assert '10.0.0.2:5000' in table.stale_tips()
+    # 链尾信息过期不影响按已知高度选择同步邻居
+    assert len(table.sync_candidates(2)) == 3
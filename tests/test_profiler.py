@@ -0,0 +1,83 @@
+import logging
+import threading
+import time
+
+import pytest
+
+import profiler
+import tracing
+
+
+def _busy_worker(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sample_returns_collapsed_stacks_of_other_threads():
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_worker, args=(stop,), name='busy')
+    worker.start()
+    try:
+        stacks = profiler.sample(0.2, interval=0.005)
+    finally:
+        stop.set()
+        worker.join()
+    busy = [stack for stack in stacks if stack.startswith('busy;')]
+    assert busy and all('_busy_worker (test_profiler.py:' in stack for stack in busy)
+    # 采样线程自身不出现在结果中
+    assert not any('sample (profiler.py:' in stack for stack in stacks)
+    line = profiler.collapsed(stacks).splitlines()[0]
+    assert line.rsplit(' ', 1)[1] == str(stacks.most_common(1)[0][1])
+
+
+def test_only_one_session_at_a_time():
+    session = threading.Thread(target=profiler.sample, args=(0.5,))
+    session.start()
+    time.sleep(0.1)
+    try:
+        with pytest.raises(profiler.ProfilerBusy):
+            profiler.sample(0.1)
+    finally:
+        session.join()
+
+
+def test_slow_request_logs_stage_breakdown(monkeypatch, caplog):
+    monkeypatch.setattr(tracing, 'SLOW_REQUEST_SECONDS', 0.01)
+    caplog.set_level(logging.WARNING, logger='tracing')
+    tracing.start('POST /dns/register')
+    with tracing.span('pow'):
+        with tracing.span('inner'):
+            time.sleep(0.02)
+    assert tracing.finish() >= 0.02
+    message = caplog.records[-1].getMessage().splitlines()
+    assert message[0].startswith('慢请求 POST /dns/register')
+    assert message[1].startswith('  pow ') and message[2].startswith('    inner ')
+
+    # 低于阈值的请求不记录
+    caplog.clear()
+    tracing.start('GET /debug/alive')
+    assert tracing.finish() < 0.01
+    assert not caplog.records
+
+
+def test_tracing_off_costs_no_trace(monkeypatch):
+    monkeypatch.setattr(tracing, 'SLOW_REQUEST_SECONDS', 0)
+    tracing.start('GET /dns/request')
+    assert tracing.span('lookup') is tracing._NULL_SPAN
+    assert tracing.finish() is None
+
+
+def test_profile_endpoint_is_opt_in(monkeypatch):
+    import api
+    from flask import Flask
+    app = Flask(__name__)
+    app.register_blueprint(api.api)
+    client = app.test_client()
+
+    monkeypatch.setattr(profiler, 'ENABLED', False)
+    assert client.get('/debug/profile?seconds=0.1').status_code == 403
+    monkeypatch.setattr(profiler, 'ENABLED', True)
+    assert client.get('/debug/profile?seconds=-1').status_code == 400
+    response = client.get('/debug/profile?seconds=0.1&interval_ms=5')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
@@ -0,0 +1,150 @@
+import socket
+import threading
+import time
+
+import pytest
+from dnslib import A, DNSRecord, QTYPE, RCODE, RR, SOA
+
+import dns
+from bench.chaingen import NODE_ID
+from cache import TTLCache
+from conftest import wait_until
+
+
+class Upstream(object):
+    """
+    本地的上游解析器替身：按主机名返回固定的应答并记录收到的查询
+    """
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.queries = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = self.sock.getsockname()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while True:
+            try:
+                data, client = self.sock.recvfrom(4096)
+            except OSError:
+                return
+            threading.Thread(target=self._answer, args=(data, client), daemon=True).start()
+
+    def _answer(self, data, client):
+        request = DNSRecord.parse(data)
+        name = str(request.q.qname).rstrip('.')
+        self.queries.append(name)
+        time.sleep(self.delay)
+        reply = request.reply()
+        if name.startswith('missing'):
+            reply.header.rcode = RCODE.NXDOMAIN
+            reply.add_auth(RR('example.', QTYPE.SOA, ttl=600,
+                              rdata=SOA('ns.example', 'hostmaster.example', (1, 0, 0, 0, 30))))
+        elif name.startswith('broken'):
+            reply.header.rcode = RCODE.SERVFAIL
+        else:
+            reply.add_answer(RR(request.q.qname, QTYPE.A, ttl=100, rdata=A('192.0.2.1')))
+            reply.add_answer(RR(request.q.qname, QTYPE.A, ttl=300, rdata=A('192.0.2.2')))
+        self.sock.sendto(reply.pack(), client)
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def forwarding(node_dir):
+    import resolver
+    layer = dns.dns_layer(NODE_ID)
+    upstream = Upstream()
+    now = [1000.0]
+    forwarder = resolver.ForwardingResolver(layer, upstream=upstream.address, timeout=2)
+    forwarder.cache = TTLCache(100, clock=lambda: now[0])
+    yield forwarder, upstream, now, layer
+    upstream.close()
+
+
+def _ask(forwarder, name, qtype='A'):
+    return forwarder.resolve(DNSRecord.question(name, qtype), None)
+
+
+def test_upstream_answers_are_cached_with_aged_ttls(forwarding):
+    forwarder, upstream, now, _ = forwarding
+    first = _ask(forwarder, 'www.example')
+    assert [str(rr.rdata) for rr in first.rr] == ['192.0.2.1', '192.0.2.2']
+    assert upstream.queries == ['www.example']
+
+    # 缓存到最小的TTL为止，期间的应答TTL减去已缓存的时间
+    now[0] += 40
+    cached = _ask(forwarder, 'WWW.example')
+    assert [rr.ttl for rr in cached.rr] == [60, 260]
+    assert upstream.queries == ['www.example']
+    now[0] += 61
+    _ask(forwarder, 'www.example')
+    assert upstream.queries == ['www.example', 'www.example']
+
+
+def test_negative_answers_use_soa_minimum_and_servfail_is_not_cached(forwarding):
+    forwarder, upstream, now, _ = forwarding
+    assert _ask(forwarder, 'missing.example').header.rcode == RCODE.NXDOMAIN
+    now[0] += 29
+    assert _ask(forwarder, 'missing.example').header.rcode == RCODE.NXDOMAIN
+    assert upstream.queries == ['missing.example']
+    now[0] += 2
+    _ask(forwarder, 'missing.example')
+    assert len(upstream.queries) == 2
+
+    for _ in range(2):
+        assert _ask(forwarder, 'broken.example').header.rcode == RCODE.SERVFAIL
+    assert upstream.queries.count('broken.example') == 2
+
+
+def test_chain_names_are_answered_locally(forwarding):
+    forwarder, upstream, _, layer = forwarding
+    layer.new_entry('local.test', '10.0.0.7', 80, 'dns')
+    reply = _ask(forwarder, 'local.test')
+    assert [str(rr.rdata) for rr in reply.rr] == ['10.0.0.7']
+    assert upstream.queries == []
+
+
+def test_concurrent_identical_queries_are_coalesced(forwarding):
+    forwarder, upstream, _, _ = forwarding
+    upstream.delay = 0.3
+    replies = []
+    threads = [threading.Thread(target=lambda: replies.append(_ask(forwarder, 'hot.example'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert upstream.queries == ['hot.example']
+    assert len(replies) == 8 and all(len(reply.rr) == 2 for reply in replies)
+
+
+def test_unreachable_upstream_gives_servfail(node_dir):
+    import resolver
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    forwarder = resolver.ForwardingResolver(dns.dns_layer(NODE_ID), upstream=sock.getsockname(), timeout=0.2)
+    try:
+        assert _ask(forwarder, 'www.example').header.rcode == RCODE.SERVFAIL
+    finally:
+        sock.close()
+
+
+def test_popular_entries_are_prefetched_before_expiry(forwarding):
+    forwarder, upstream, now, _ = forwarding
+    _ask(forwarder, 'popular.example')
+    _ask(forwarder, 'popular.example')
+    _ask(forwarder, 'rare.example')
+    # 剩余TTL低于10%：命中过的条目在后台刷新，只命中一次的不刷新
+    now[0] += 95
+    _ask(forwarder, 'popular.example')
+    _ask(forwarder, 'rare.example')
+    assert wait_until(lambda: upstream.queries.count('popular.example') == 2, timeout=5)
+    time.sleep(0.2)
+    assert upstream.queries.count('rare.example') == 1
+    now[0] += 10
+    assert [rr.ttl for rr in _ask(forwarder, 'popular.example').rr] == [90, 290]
+    assert upstream.queries.count('popular.example') == 2
@@ -0,0 +1,53 @@
+import os
+
+import requests
+
+import blockchain as bc
+import dns
+from bench.chaingen import NODE_ID
+from shards import shard_of
+
+NAMES = [f'host-{i}.test' for i in range(30)]
+
+
+def test_hostnames_are_mined_on_their_own_shard(node_dir, monkeypatch):
+    monkeypatch.setattr(bc, 'pow_executor', None)
+    router = dns.open_shards(NODE_ID, 3)
+    try:
+        for name in NAMES:
+            router.layer(0).new_entry(name, '10.0.0.1', 80, 'dns')
+        for layer in router:
+            layer.flush_tmp_domains()
+
+        for name in NAMES:
+            owner = shard_of(name, 3)
+            assert router.layer(0).lookup(name) == ('10.0.0.1', 80, True)
+            for layer in router:
+                on_chain = any(tx.get('hostname') == name
+                               for block in layer.dns_blockchain.chain for tx in block['transactions'])
+                assert on_chain == (layer.shard == owner)
+        # 每个分片有自己的区块存储，0号分片沿用原来的文件
+        assert os.path.exists(os.path.join('data', 'domains.blocks'))
+        assert os.path.exists(os.path.join('data', 'shard-2', 'domains-2.blocks'))
+        assert all(len(layer.dns_blockchain.chain) > 1 for layer in router)
+
+        proof = router.layer(0).hostname_proof(NAMES[0])
+        owner = router.layer(proof['shard'])
+        assert proof['shard'] == shard_of(NAMES[0], 3)
+        assert proof['checkpoint']['height'] == len(owner.dns_blockchain.chain)
+    finally:
+        bc.pow_executor.shutdown()
+
+
+def test_api_selects_shard_chains(spawn_node, monkeypatch):
+    monkeypatch.setenv('DNS_SHARDS', '3')
+    node = spawn_node('sharded')
+
+    def length(shard):
+        params = {'type': 'dns', 'shard': shard}
+        return requests.get(f'http://{node}/nodes/tip', params=params, timeout=5).json()['length']
+
+    response = requests.get(f'http://{node}/debug/force_block', params={'type': 'dns', 'shard': 2}, timeout=30)
+    assert response.status_code == 200
+    assert [length(shard) for shard in range(3)] == [1, 1, 2]
+    assert requests.get(f'http://{node}/nodes/tip', params={'shard': 3}, timeout=5).status_code == 400
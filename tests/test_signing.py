@@ -0,0 +1,67 @@
+import pytest
+
+import signing
+from blockwallet import Wallet
+
+
+def _signed(wallet, i):
+    tx = {'hostname': f'h{i}.test', 'ip': '10.0.0.1', 'port': 80, 'node_id': wallet.address, 'lease_years': 1}
+    return signing.sign_transaction(tx, wallet)
+
+
+@pytest.fixture
+def wallet():
+    return Wallet()
+
+
+def test_verified_transactions_hit_the_cache(wallet, monkeypatch):
+    verifier = signing.Verifier(workers=1)
+    tx = _signed(wallet, 0)
+    assert verifier.verify([tx]) == []
+    assert verifier.is_verified(signing.tx_id(tx))
+
+    # 命中缓存的交易不再验签
+    monkeypatch.setattr(signing, '_verify_chunk', lambda items: pytest.fail('cached transaction verified again'))
+    cached = signing._CACHED.value
+    assert verifier.verify([dict(tx)]) == []
+    assert verifier.verify_blocks([{'transactions': [tx]}])
+    assert signing._CACHED.value == cached + 2
+
+
+def test_invalid_signatures_are_rejected_and_not_cached(wallet):
+    verifier = signing.Verifier(workers=1)
+    good = _signed(wallet, 0)
+    tampered = dict(_signed(wallet, 1), ip='10.6.6.6')
+    # 用另一个钱包签名，却声称是wallet的交易
+    impostor = _signed(Wallet(), 2)
+    impostor['node_id'] = wallet.address
+    garbage = dict(_signed(wallet, 3), signature='zz')
+
+    invalid = verifier.verify([good, tampered, impostor, garbage])
+    assert invalid == [tampered, impostor, garbage]
+    for tx in invalid:
+        assert not verifier.is_verified(signing.tx_id(tx))
+    assert not verifier.verify_blocks([{'transactions': [good]}, {'transactions': [tampered]}])
+
+
+def test_parallel_verification_finds_the_invalid_transaction(wallet):
+    verifier = signing.Verifier(workers=2)
+    try:
+        transactions = [_signed(wallet, i) for i in range(signing.PARALLEL_THRESHOLD + 8)]
+        transactions[17]['port'] = 81
+        assert verifier.verify(transactions) == [transactions[17]]
+        assert sum(verifier.is_verified(signing.tx_id(tx)) for tx in transactions) == len(transactions) - 1
+    finally:
+        verifier.shutdown()
+
+
+def test_swapped_public_key_is_rejected_after_a_cache_hit(wallet):
+    verifier = signing.Verifier(workers=1)
+    tx = _signed(wallet, 0)
+    assert verifier.verify([tx]) == []
+    assert verifier.verify([dict(tx)]) == []
+
+    # 签名与签名内容不变，只把公钥换成另一个钱包的：地址不再与node_id一致
+    swapped = dict(tx, public_key=Wallet().public_key)
+    assert verifier.verify([swapped]) == [swapped]
+    assert signing.Verifier(workers=1).verify([swapped]) == [swapped]
@@ -0,0 +1,151 @@
+import socket
+import struct
+
+import pytest
+from dnslib import DNSRecord, OPCODE, QTYPE, RR, SOA
+
+from bench import chaingen
+from conftest import free_port
+
+
+@pytest.fixture
+def zone_server(node_dir):
+    chaingen.generate('data', 50)
+    import dns
+    import resolver
+    layer = dns.dns_layer(node_identifier=chaingen.NODE_ID)
+    notified = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    notified.bind(('127.0.0.1', 0))
+    notified.settimeout(10)
+    port = free_port()
+    servers = resolver.serve(layer, address='127.0.0.1', port=port, origin='bench',
+                             secondaries=[notified.getsockname()])
+    yield layer, port, notified
+    for server in servers:
+        server.stop()
+    notified.close()
+
+
+def _transfer(port, request):
+    """
+    经TCP发送区域传送请求，读取到结束的SOA为止（只有一个SOA表示已是最新）
+    """
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as sock:
+        packed = request.pack()
+        sock.sendall(struct.pack('!H', len(packed)) + packed)
+        rrs = []
+        stream = sock.makefile('rb')
+        while True:
+            length = struct.unpack('!H', stream.read(2))[0]
+            message = DNSRecord.parse(stream.read(length))
+            assert message.header.rcode == 0
+            rrs += message.rr
+            if len(message.rr) == 1 and len(rrs) == 1 or len(rrs) > 1 and rrs[-1].rtype == QTYPE.SOA:
+                return rrs
+
+
+def _ixfr(port, serial):
+    request = DNSRecord.question('bench', 'IXFR')
+    request.add_auth(RR('bench', QTYPE.SOA, rdata=SOA('ns.bench', 'hostmaster.bench', (serial, 0, 0, 0, 0))))
+    return _transfer(port, request)
+
+
+def test_serial_tracks_the_chain_and_transfers(zone_server):
+    layer, port, notified = zone_server
+    height = len(layer.dns_blockchain.chain)
+    reply = DNSRecord.parse(DNSRecord.question('bench', 'SOA').send('127.0.0.1', port, timeout=5))
+    assert reply.rr[0].rdata.times[0] == height
+
+    rrs = _transfer(port, DNSRecord.question('bench', 'AXFR'))
+    names = {str(rr.rname) for rr in rrs if rr.rtype == QTYPE.A}
+    # DNS链的50个主机名与从注册链复制来的50个主机名
+    assert len(names) == 100 and {'dns-0.bench.', 'register-0.bench.'} <= names
+    assert rrs[0].rdata.times[0] == height
+
+    layer.dns_blockchain.new_transaction({'hostname': 'fresh.bench', 'ip': '10.0.0.9', 'port': 80})
+    layer.mine_dns_block()
+
+    # 新区块触发NOTIFY
+    data, secondary = notified.recvfrom(512)
+    message = DNSRecord.parse(data)
+    notified.sendto(message.reply().pack(), secondary)
+    assert message.header.opcode == OPCODE.NOTIFY
+    assert message.rr[0].rdata.times[0] == height + 1
+
+    # 增量只包含新区块的主机名
+    rrs = _ixfr(port, height)
+    assert [rr.rdata.times[0] for rr in rrs if rr.rtype == QTYPE.SOA] == [height + 1, height, height + 1, height + 1]
+    assert [(str(rr.rname), str(rr.rdata)) for rr in rrs if rr.rtype == QTYPE.A] == [('fresh.bench.', '10.0.0.9')]
+
+    # 已是最新时只返回SOA，日志之外的序列号返回完整区域
+    assert len(_ixfr(port, height + 1)) == 1
+    assert len([rr for rr in _ixfr(port, height + 5) if rr.rtype == QTYPE.A]) == 101
+
+
+def test_journal_falls_back_inside_reorg_window(zone_server):
+    layer = zone_server[0]
+    import zone
+    journal = zone.ZoneJournal(layer)
+    height = journal.serial
+    assert journal.changes_since(height - 1) is not None
+    journal._reorgs.append((height - 2, height - 1))
+    assert journal.changes_since(height - 1) is None
+    assert journal.changes_since(height - 2) is not None
+    journal.close()
+
+
+def test_transfer_refused_for_unknown_clients(zone_server):
+    layer, port, _ = zone_server
+    import resolver
+    request = DNSRecord.question('bench', 'AXFR')
+    messages = resolver.Resolver(layer, origin='bench').transfer(request, '192.0.2.1')
+    assert messages[0].header.rcode == 5
+
+
+def _mine(blockchain, hostnames, ip):
+    for hostname in hostnames:
+        blockchain.new_transaction({'hostname': hostname, 'ip': ip, 'port': 80})
+    blockchain.mine()
+
+
+def test_ixfr_across_a_reorg(node_dir):
+    import dns
+    import resolver
+    from blockchain import Blockchain
+    layer = dns.dns_layer(node_identifier=chaingen.NODE_ID)
+    local = layer.dns_blockchain
+    for i in range(3):
+        _mine(local, [f'shared{i}.bench'], '10.0.0.1')
+    fork = len(local.chain)
+    remote = Blockchain('other', str(node_dir / 'remote.json'), 'dns')
+    remote.replace_chain(list(local.chain))
+    for i in range(2):
+        _mine(local, [f'local{i}.bench'], '10.0.0.2')
+    old_height = len(local.chain)
+    for i in range(4):
+        _mine(remote, [f'remote{i}.bench'], '10.0.0.3')
+
+    server = resolver.Resolver(layer, origin='bench', transfer_clients=('127.0.0.1',))
+    journal = server.journal()
+    local.replace_chain(list(remote.chain))
+    height = len(local.chain)
+    assert journal.serial == height
+
+    # 分叉点之前的序列号：增量只有新分支上的主机名，旧分支的主机名不出现
+    changes = journal.changes_since(fork)
+    assert sorted(name for name, _ in changes) == [f'remote{i}.bench' for i in range(4)]
+    request = DNSRecord.question('bench', 'IXFR')
+    request.add_auth(RR('bench', QTYPE.SOA, rdata=SOA('ns.bench', 'hostmaster.bench', (fork, 0, 0, 0, 0))))
+    rrs = [rr for message in server.transfer(request, '127.0.0.1') for rr in message.rr]
+    assert [rr.rdata.times[0] for rr in rrs if rr.rtype == QTYPE.SOA] == [height, fork, height, height]
+    assert sorted(str(rr.rname) for rr in rrs if rr.rtype == QTYPE.A) == [f'remote{i}.bench.' for i in range(4)]
+
+    # 对方持有被移出主链的区间内的序列号：给不出增量，退回完整区域
+    for serial in range(fork + 1, old_height + 1):
+        assert journal.changes_since(serial) is None
+    request = DNSRecord.question('bench', 'IXFR')
+    request.add_auth(RR('bench', QTYPE.SOA, rdata=SOA('ns.bench', 'hostmaster.bench', (old_height, 0, 0, 0, 0))))
+    rrs = [rr for message in server.transfer(request, '127.0.0.1') for rr in message.rr]
+    names = sorted(str(rr.rname) for rr in rrs if rr.rtype == QTYPE.A)
+    assert names == sorted([f'shared{i}.bench.' for i in range(3)] + [f'remote{i}.bench.' for i in range(4)])
+    journal.close()
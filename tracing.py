@@ -0,0 +1,99 @@
+"""
+按请求的分阶段耗时跟踪
+
+请求开始时调用start()，热点路径用span()标记阶段，请求结束时调用finish()：
+总耗时超过阈值的请求以WARNING级别记录各阶段的耗时明细，例如
+    慢请求 POST /dns/register 1532.1ms
+      wallet 0.4ms
+      write:tmp_register.json 0.9ms
+      pow 1480.2ms
+      save:register 3.1ms
+      index:register 40.6ms
+
+阈值由 DNS_SLOW_REQUEST_MS 环境变量（或server.py的 --slow-request-ms）设置，
+为0时关闭：此时不创建跟踪对象，span()只做一次线程局部变量查找。
+"""
+
+import logging
+import os
+import threading
+from contextlib import nullcontext
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+# 慢请求阈值（秒），0表示关闭
+SLOW_REQUEST_SECONDS = float(os.environ.get('DNS_SLOW_REQUEST_MS') or 0) / 1000
+
+_local = threading.local()
+_NULL_SPAN = nullcontext()
+
+
+class Trace(object):
+    def __init__(self, name):
+        self.name = name
+        self.start = perf_counter()
+        self.spans = []  # (开始偏移, 嵌套深度, 阶段名, 耗时)
+        self.depth = 0
+
+    def format(self, total):
+        lines = [f'慢请求 {self.name} {total * 1000:.1f}ms']
+        for offset, depth, name, duration in sorted(self.spans):
+            lines.append(f'{"  " * (depth + 1)}{name} {duration * 1000:.1f}ms')
+        return '\n'.join(lines)
+
+
+class _Span(object):
+    __slots__ = ('trace', 'name', 'start', 'depth')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.depth = self.trace.depth
+        self.trace.depth += 1
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = perf_counter()
+        self.trace.depth -= 1
+        self.trace.spans.append((self.start - self.trace.start, self.depth, self.name, end - self.start))
+        return False
+
+
+def span(name):
+    """
+    标记当前请求中的一个阶段；当前线程没有进行中的跟踪时什么也不做
+
+    :param name: 阶段名
+    """
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name)
+
+
+def start(name):
+    """
+    在当前线程开始跟踪一个请求；阈值为0时不跟踪
+    """
+    if SLOW_REQUEST_SECONDS > 0:
+        _local.trace = Trace(name)
+
+
+def finish():
+    """
+    结束当前线程的跟踪，超过阈值时记录阶段明细
+
+    :return: 请求总耗时（秒），没有进行中的跟踪时为None
+    """
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return None
+    _local.trace = None
+    total = perf_counter() - trace.start
+    if total >= SLOW_REQUEST_SECONDS:
+        logger.warning('%s', trace.format(total))
+    return total
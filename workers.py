@@ -0,0 +1,115 @@
+"""
+多进程部署模式
+
+一个writer进程独占出块和持久化，监听在本机内部端口；
+N个reader进程共享同一个对外监听套接字，在本地从链文件提供
+/dns/request、/nodes/chain、/wallet/info 等只读请求，其余请求转发给writer。
+链文件与临时缓冲文件均以原子替换的方式写入，reader只在文件变化时重新加载。
+"""
+
+import logging
+import os
+import secrets
+import signal
+import socket
+import time
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+# 子进程异常退出后重启前的等待时间（秒）
+RESTART_DELAY = 1
+
+
+def _run_writer(create_app, port, runtime):
+    os.environ['DNS_NODE_ROLE'] = 'writer'
+    if runtime == 'async':
+        from aio_node import AsyncNode
+        node = AsyncNode()
+        node.install()
+        node.run(create_app(), host='127.0.0.1', port=port)
+    else:
+        create_app().run(host='127.0.0.1', port=port, threaded=True)
+
+
+def _run_reader(create_app, host, port, fd):
+    from werkzeug.serving import make_server
+    os.environ['DNS_NODE_ROLE'] = 'reader'
+    app = create_app()
+    server = make_server(host, port, app, threaded=True, fd=fd)
+    server.serve_forever()
+
+
+class WorkerPool(object):
+    def __init__(self, create_app, host='0.0.0.0', port=5000, workers=2, writer_port=None, runtime='flask'):
+        """
+        :param create_app: 创建Flask应用的工厂函数，在子进程中调用
+        :param workers: reader进程数
+        :param writer_port: writer进程的本机端口，默认为port+1
+        :param runtime: writer进程使用的运行时，'flask'或'async'
+        """
+        self.create_app = create_app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.writer_port = writer_port or port + 1
+        self.runtime = runtime
+        self.ctx = multiprocessing.get_context('fork')
+        self.writer = None
+        self.readers = []
+        self._stopping = False
+
+    def _listen(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(1024)
+        sock.set_inheritable(True)
+        return sock
+
+    def _start_writer(self):
+        p = self.ctx.Process(target=_run_writer, args=(self.create_app, self.writer_port, self.runtime),
+                             name='dns-writer')
+        p.start()
+        return p
+
+    def _start_reader(self, fd):
+        p = self.ctx.Process(target=_run_reader, args=(self.create_app, self.host, self.port, fd),
+                             name='dns-reader')
+        p.start()
+        return p
+
+    def _stop(self, *_):
+        self._stopping = True
+
+    def run(self):
+        # 在fork之前设置共享配置，所有进程使用同一个session密钥
+        os.environ.setdefault('DNS_SECRET_KEY', secrets.token_hex(16))
+        os.environ['DNS_WRITER_URL'] = f'http://127.0.0.1:{self.writer_port}'
+        sock = self._listen()
+        fd = sock.fileno()
+
+        self.writer = self._start_writer()
+        self.readers = [self._start_reader(fd) for _ in range(self.workers)]
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        logger.info("writer进程 127.0.0.1:%d，%d 个reader进程 %s:%d",
+                    self.writer_port, self.workers, self.host, self.port)
+
+        try:
+            while not self._stopping:
+                time.sleep(RESTART_DELAY)
+                if not self.writer.is_alive():
+                    logger.warning("writer进程退出（%s），正在重启", self.writer.exitcode)
+                    self.writer = self._start_writer()
+                for i, p in enumerate(self.readers):
+                    if not p.is_alive():
+                        logger.warning("reader进程退出（%s），正在重启", p.exitcode)
+                        self.readers[i] = self._start_reader(fd)
+        finally:
+            for p in [self.writer] + self.readers:
+                if p.is_alive():
+                    p.terminate()
+            for p in [self.writer] + self.readers:
+                p.join()
+            sock.close()
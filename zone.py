@@ -0,0 +1,162 @@
+"""
+由DNS链导出的区域及其变更日志，供区域传送（AXFR/IXFR，见resolver.py）使用
+
+区域的序列号是DNS链的高度，每个新区块加一；链重组只会换成更长的链，序列号同样递增。
+主机名以最早上链的记录为准、之后不再改变，所以一个区块对区域的变更就是它首次上链的主机名。
+ZoneJournal随DNS链事件记录最近JOURNAL_DEPTH个高度各自新增的主机名，
+从序列号s到当前序列号的增量就是 (s, 当前] 各高度新增的主机名，开销与变更量成正比。
+以下情况给不出增量，由调用方退回完整区域：
+    s 早于日志覆盖的最旧高度（超过JOURNAL_DEPTH，或链在进程运行中被重新加载）
+    s 位于某次重组被移出主链的区间 (分叉点, 重组前的高度] 内，对方持有的可能是旧分支上的记录
+    s 大于当前序列号
+节点分片时（见shards.py）区域由各分片DNS链上的主机名合成，见ShardedZoneJournal。
+"""
+
+import logging
+import threading
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# 保留变更日志的高度数
+JOURNAL_DEPTH = 1000
+# 记住的最近重组次数
+MAX_REORGS = 64
+
+
+class ZoneJournal(object):
+    def __init__(self, layer, depth=JOURNAL_DEPTH):
+        """
+        :param layer: dns_layer，需要有DNS链的ChainTracker
+        :param depth: 保留变更日志的高度数
+        """
+        self.layer = layer
+        self.blockchain = layer.dns_blockchain
+        self.tracker = layer.trackers['dns']
+        self.depth = depth
+        # 区域变化后的回调 listener(序列号)，例如发送NOTIFY
+        self.listeners = []
+        self._added = OrderedDict()               # 高度 -> 该高度首次上链的主机名
+        self._reorgs = deque(maxlen=MAX_REORGS)   # (分叉点, 重组前的高度)
+        self._base = 0                            # 日志覆盖 (_base, 当前序列号]
+        self._lock = threading.Lock()
+        self._seed()
+        self.blockchain.listeners.append(self._on_chain_event)
+
+    def close(self):
+        if self._on_chain_event in self.blockchain.listeners:
+            self.blockchain.listeners.remove(self._on_chain_event)
+
+    @property
+    def serial(self):
+        return self.tracker.state.height
+
+    def records(self):
+        """
+        :return: 完整区域，(主机名, 索引记录) 列表
+        """
+        return self.tracker.records()
+
+    def _seed(self):
+        # 由状态中记录的上链高度重建最近depth个高度的日志
+        height = self.tracker.state.height
+        self._base = max(height - self.depth, 0)
+        added = {h: [] for h in range(self._base + 1, height + 1)}
+        for hostname, record in self.tracker.records():
+            names = added.get(record.get('block_index'))
+            if names is not None:
+                names.append(hostname)
+        self._added = OrderedDict(sorted(added.items()))
+
+    def _record(self, block):
+        records = self.tracker.state.records
+        self._added[block['index']] = [
+            tx['hostname'] for tx in block['transactions']
+            if 'hostname' in tx and records.get(tx['hostname'], {}).get('block_index') == block['index']]
+
+    def _on_chain_event(self, blockchain, event, block):
+        if self.tracker.bootstrapping:
+            return
+        with self._lock:
+            if event == 'block':
+                self._record(block)
+            elif event == 'reorg':
+                for height in [h for h in self._added if h > block.fork_point]:
+                    del self._added[height]
+                self._reorgs.append((block.fork_point, block.fork_point + len(block.removed)))
+                for added in block.added:
+                    self._record(added)
+            else:
+                self._seed()
+            while len(self._added) > self.depth:
+                height, _ = self._added.popitem(last=False)
+                self._base = height
+        serial = self.serial
+        for listener in self.listeners:
+            try:
+                listener(serial)
+            except Exception as e:
+                logger.exception("区域变更通知失败: %s", e)
+
+    def changes_since(self, serial):
+        """
+        :param serial: 对方持有的序列号
+        :return: 之后新增的 (主机名, 索引记录) 列表；给不出增量时为None
+        """
+        with self._lock:
+            current = self.serial
+            if serial == current:
+                return []
+            if serial > current or serial < self._base or \
+                    any(fork < serial <= old for fork, old in self._reorgs):
+                return None
+            names = [name for height, names in self._added.items() if height > serial for name in names]
+        records = self.tracker.state.records
+        return [(name, records[name]) for name in names if name in records]
+
+
+class ShardedZoneJournal(object):
+    def __init__(self, layers, depth=JOURNAL_DEPTH):
+        """
+        各分片的区域合成的一个区域。序列号是各分片DNS链高度之和，任一分片出块都使它递增；
+        合计的序列号不能还原出各分片的高度，序列号不同时给不出增量，由调用方退回完整区域
+
+        :param layers: 按分片号排列的dns_layer
+        """
+        self.layer = layers[0]
+        self.journals = [ZoneJournal(layer, depth) for layer in layers]
+        self.listeners = []
+        for journal in self.journals:
+            journal.listeners.append(self._on_change)
+
+    def close(self):
+        for journal in self.journals:
+            journal.close()
+
+    @property
+    def serial(self):
+        return sum(journal.serial for journal in self.journals)
+
+    def records(self):
+        return [item for journal in self.journals for item in journal.records()]
+
+    def _on_change(self, _):
+        serial = self.serial
+        for listener in self.listeners:
+            try:
+                listener(serial)
+            except Exception as e:
+                logger.exception("区域变更通知失败: %s", e)
+
+    def changes_since(self, serial):
+        return [] if serial == self.serial else None
+
+
+def open_journal(layer):
+    """
+    :param layer: dns_layer；分片时为0号分片，区域包含其ShardRouter的全部分片
+    :return: ZoneJournal或ShardedZoneJournal
+    """
+    if layer.router is not None and len(layer.router) > 1:
+        return ShardedZoneJournal(layer.router.layers)
+    return ZoneJournal(layer)